@@ -6,8 +6,9 @@ from fastapi.security import OAuth2PasswordRequestForm
 from app import models, schemas
 from app.database import get_db
 from app.auth import utils
+from app.utils.profiler import ProfiledRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 # register
 @router.post("/register", response_model=schemas.UserOut)
@@ -0,0 +1,434 @@
+"""
+End-to-end benchmark of the file API.
+
+    python -m app.benchmark --sizes 1000,10000 --output bench.json
+    python -m app.benchmark --sizes 1000,10000 --baseline bench.json
+
+Runs the FastAPI app in-process (TestClient) in a scratch directory against
+a throw-away SQLite database, or the database given with --database-url
+(its file tables are emptied). For every dataset size it generates a tree
+with app.files.generate_dummy, then times each scenario and reports
+throughput and p50/p95/p99 latency. Results are written as JSON; with
+--baseline they are compared to an earlier run and the exit code is 1 when
+an endpoint regressed by more than --threshold.
+
+Storage settings come from the environment as usual, so layouts are compared
+by running twice, e.g. one file per entry against pack storage:
+
+    python -m app.benchmark --endpoints create_small,list_folder,sync --output files.json
+    PACK_THRESHOLD=4096 python -m app.benchmark --endpoints create_small,list_folder,sync --baseline files.json
+
+After each size the files, directories and bytes left in the storage
+directories are recorded too (on-disk metadata cost).
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench-password"
+UPLOAD_PAYLOAD = os.urandom(64 * 1024)
+SMALL_PAYLOAD = b"".join(b"%06d,small file row\n" % i for i in range(48))  # ~1 KiB of text
+
+
+class Context:
+    """Ids the scenarios pick from, plus files they created themselves."""
+
+    def __init__(self, size: int, folder_ids: list, file_ids: list):
+        self.size = size
+        self.folder_ids = folder_ids
+        self.file_ids = file_ids
+        # uploads land here; move/rename/delete only touch these
+        self.own_files = []
+        self.lock = threading.Lock()
+
+    def take_own_file(self):
+        with self.lock:
+            return self.own_files.pop() if self.own_files else None
+
+    def give_back(self, file_id):
+        if file_id is None:
+            return
+        with self.lock:
+            self.own_files.append(file_id)
+
+
+#scenarios: (client, ctx, rng) -> response
+def list_folder(client, ctx, rng):
+    return client.get(f"/files/folder/{rng.choice(ctx.folder_ids)}")
+
+
+def list_page(client, ctx, rng):
+    return client.get("/files/", params={"folder_id": rng.choice(ctx.folder_ids), "page": 1, "limit": 50})
+
+
+def search(client, ctx, rng):
+    return client.get(f"/files/search/file_{rng.randrange(ctx.size):08d}")
+
+
+def download(client, ctx, rng):
+    return client.get(f"/files/download/{rng.choice(ctx.file_ids)}")
+
+
+def upload(client, ctx, rng):
+    response = client.post(
+        "/files/upload",
+        files=[("uploaded_file", (f"bench_{uuid.uuid4().hex}.bin", UPLOAD_PAYLOAD))],
+        data={"parent_id": str(rng.choice(ctx.folder_ids))},
+    )
+    if response.status_code == 200:
+        ctx.give_back(response.json()["uploaded"][0]["id"])
+    return response
+
+
+def create_small(client, ctx, rng):
+    response = client.post(
+        "/files/upload",
+        files=[("uploaded_file", (f"small_{uuid.uuid4().hex}.csv", SMALL_PAYLOAD))],
+        data={"parent_id": str(rng.choice(ctx.folder_ids))},
+    )
+    if response.status_code == 200:
+        ctx.give_back(response.json()["uploaded"][0]["id"])
+    return response
+
+
+def copy(client, ctx, rng):
+    return client.post(
+        "/files/copy",
+        json={"file_ids": [rng.choice(ctx.file_ids)], "destination_folder_id": rng.choice(ctx.folder_ids)},
+    )
+
+
+def move(client, ctx, rng):
+    file_id = ctx.take_own_file()
+    try:
+        return client.post("/files/move", json={"file_ids": [file_id], "destination_folder_id": rng.choice(ctx.folder_ids)})
+    finally:
+        ctx.give_back(file_id)
+
+
+def rename(client, ctx, rng):
+    file_id = ctx.take_own_file()
+    try:
+        return client.put("/files/rename", params={"file_id": file_id, "new_name": f"renamed_{uuid.uuid4().hex}.bin"})
+    finally:
+        ctx.give_back(file_id)
+
+
+def delete(client, ctx, rng):
+    return client.delete(f"/files/delete/{ctx.take_own_file()}")
+
+
+def sync(client, ctx, rng):
+    return client.post("/files/sync-disk-to-db")
+
+
+# run in this order: uploads feed move/rename/delete
+SCENARIOS = {
+    "list_folder": list_folder,
+    "list_page": list_page,
+    "search": search,
+    "download": download,
+    "upload": upload,
+    "create_small": create_small,
+    "copy": copy,
+    "move": move,
+    "rename": rename,
+    "delete": delete,
+    "sync": sync,
+}
+
+
+#measuring
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(latencies: list, errors: int, wall: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / wall, 2) if wall else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def run_scenario(client, ctx, scenario, iterations: int, warmup: int, concurrency: int, seed: int) -> dict:
+    for i in range(warmup):
+        scenario(client, ctx, random.Random(seed - i - 1))
+
+    latencies, errors = [], []
+    per_worker = [iterations // concurrency + (n < iterations % concurrency) for n in range(concurrency)]
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        for _ in range(per_worker[n]):
+            started = time.perf_counter()
+            try:
+                response = scenario(client, ctx, rng)
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with ctx.lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors.append(n)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, len(errors), time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Hide the app's debug prints while timing."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+#dataset
+def reset_database():
+    from sqlalchemy import update
+
+    from app import models
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        db.query(models.Job).delete()
+        db.query(models.FileLog).delete()
+        db.query(models.ChangeEvent).delete()
+        db.query(models.FileMetadata).delete()
+        db.query(models.Counter).delete()
+        db.query(models.RecycleBin).delete()
+        # self-referencing rows: detach them first so the delete order doesn't matter
+        db.execute(update(models.FileModel).values(parent_id=None))
+        db.query(models.FileModel).delete()
+        db.execute(update(models.User).values(used_bytes=0))
+        db.commit()
+    finally:
+        db.close()
+
+    from app.files import utils
+
+    utils.log_writer.flush()
+    for directory in (utils.UPLOAD_DIR, utils.LOG_DIR):
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir(exist_ok=True)
+
+    from app.config import PACK_DIR, STORAGE_ROOT
+    from app.storage.backends import storage
+
+    storage.packs.close()
+    for directory in (STORAGE_ROOT, PACK_DIR):
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def build_dataset(size: int, seed: int) -> Context:
+    from app import models
+    from app.database import SessionLocal
+    from app.files import generate_dummy
+
+    reset_database()
+    args = generate_dummy.build_parser().parse_args([
+        "--files", str(size),
+        "--depth", "3",
+        "--fanout", str(max(2, round((size / 50) ** (1 / 3)))),  # ~50 files per folder
+        "--size-median", "8192",
+        "--size-max", str(4 * 1024 * 1024),
+        "--seed", str(seed),
+        "--user", BENCH_USER,
+        "--db",
+    ])
+    gen = generate_dummy.Generator(args)
+    folders = gen.folders()
+    counts = generate_dummy.seed_database(
+        generate_dummy.Generator(args), folders, generate_dummy.UPLOAD_DIR, BENCH_USER, args.batch_size, 0.5
+    )
+    generate_dummy.write_disk(
+        generate_dummy.Generator(args), folders, generate_dummy.UPLOAD_DIR, counts["first_recycle_id"]
+    )
+
+    db = SessionLocal()
+    try:
+        rows = db.query(models.FileModel.id, models.FileModel.is_folder).all()
+    finally:
+        db.close()
+    folder_ids = [row.id for row in rows if row.is_folder]
+    file_ids = [row.id for row in rows if not row.is_folder]
+    return Context(size, folder_ids, file_ids)
+
+
+def disk_usage() -> dict:
+    """Files, directories and bytes below the directories the storage backends write to."""
+    from app.config import PACK_DIR, STORAGE_ROOT
+    from app.files import utils
+
+    usage = {"files": 0, "dirs": 0, "bytes": 0}
+    for root in {utils.UPLOAD_DIR, STORAGE_ROOT, PACK_DIR}:
+        for dirpath, dirnames, filenames in os.walk(root):
+            usage["dirs"] += len(dirnames)
+            usage["files"] += len(filenames)
+            usage["bytes"] += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+    return usage
+
+
+#baseline comparison
+def compare(results: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list:
+    """Rows of (size, endpoint, metric, baseline, current, change, regressed)."""
+    rows = []
+    for size, endpoints in results["results"].items():
+        for endpoint, current in endpoints.items():
+            before = baseline.get("results", {}).get(size, {}).get(endpoint)
+            if not before:
+                continue
+            p95_change = (current["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+            rows.append((size, endpoint, "p95_ms", before["p95_ms"], current["p95_ms"], p95_change,
+                         p95_change > threshold and current["p95_ms"] - before["p95_ms"] > min_delta_ms))
+            rps_change = ((current["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"]
+                          if before["throughput_rps"] else 0.0)
+            rows.append((size, endpoint, "throughput_rps", before["throughput_rps"], current["throughput_rps"],
+                         rps_change, rps_change < -threshold and current["mean_ms"] - before["mean_ms"] > min_delta_ms))
+    return rows
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent.parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000", help="dataset sizes (files), comma separated")
+    parser.add_argument("--iterations", type=int, default=50, help="timed requests per endpoint")
+    parser.add_argument("--sync-iterations", type=int, default=3, help="timed requests for sync, which walks the whole tree")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed requests before each endpoint")
+    parser.add_argument("--concurrency", type=int, default=1, help="client threads per endpoint")
+    parser.add_argument("--endpoints", default=",".join(SCENARIOS), help="subset to run, comma separated")
+    parser.add_argument("--database-url", help="scratch database to use instead of a temporary SQLite file; it is emptied")
+    parser.add_argument("--workdir", type=Path, help="where uploads/ etc. are created (default: a temp dir)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results.json"))
+    parser.add_argument("--baseline", type=Path, help="earlier --output to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before flagging (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="ignore latency changes smaller than this")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = set(endpoints) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}; use {', '.join(SCENARIOS)}")
+
+    output = args.output.resolve()
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    workdir = (args.workdir or Path(tempfile.mkdtemp(prefix="fm_bench_"))).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    # the app resolves uploads/, file_logs/ and its engine at import time
+    os.chdir(workdir)
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir / 'bench.db'}"
+
+    from fastapi.testclient import TestClient
+
+    from app import config
+    from app.create_tables import upgrade_database
+    from app.database import engine
+    from app.main import app
+
+    upgrade_database()
+
+    results = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "database": engine.dialect.name,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "storage": {
+                "backend": config.STORAGE_BACKEND,
+                "layout": config.STORAGE_LAYOUT,
+                "compression": config.COMPRESSION,
+                "pack_threshold": config.PACK_THRESHOLD,
+            },
+        },
+        "results": {},
+        "disk": {},
+    }
+
+    with quiet(), TestClient(app) as client:
+        client.post("/auth/register", json={"username": BENCH_USER, "password": BENCH_PASSWORD})
+        token = client.post("/auth/login", data={"username": BENCH_USER, "password": BENCH_PASSWORD}).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+
+        for size in sizes:
+            with contextlib.redirect_stdout(sys.__stdout__):
+                print(f"\n== {size:,} files ({engine.dialect.name}, workdir {workdir})")
+            ctx = build_dataset(size, args.seed)
+            results["results"][str(size)] = {}
+            for name in endpoints:
+                iterations = args.sync_iterations if name == "sync" else args.iterations
+                stats = run_scenario(client, ctx, SCENARIOS[name], iterations, args.warmup, args.concurrency, args.seed)
+                results["results"][str(size)][name] = stats
+                with contextlib.redirect_stdout(sys.__stdout__):
+                    print(f"{name:<12} {stats['throughput_rps']:>9.1f} req/s  p50 {stats['p50_ms']:>9.2f} ms  "
+                          f"p95 {stats['p95_ms']:>9.2f} ms  p99 {stats['p99_ms']:>9.2f} ms"
+                          + (f"  errors {stats['errors']}" if stats["errors"] else ""))
+            results["disk"][str(size)] = disk_usage()
+            with contextlib.redirect_stdout(sys.__stdout__):
+                disk = results["disk"][str(size)]
+                print(f"{'on disk':<12} {disk['files']:>9,} files  {disk['dirs']:>7,} dirs  {disk['bytes'] / 1024 / 1024:>9.1f} MB")
+
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if baseline:
+        rows = compare(results, baseline, args.threshold, args.min_delta_ms)
+        regressions = [row for row in rows if row[-1]]
+        print(f"\nCompared with {args.baseline} (commit {baseline.get('meta', {}).get('commit') or '?'}):")
+        for size, endpoint, metric, before, current, change, regressed in rows:
+            flag = "REGRESSION" if regressed else ""
+            print(f"{size:>9} {endpoint:<12} {metric:<15} {before:>10.2f} -> {current:>10.2f} ({change:+.0%}) {flag}")
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Change feed: the create, rename, move, delete and star events of folder
+listings, pushed to clients over SSE (GET /changes) or a WebSocket
+(/changes/ws) instead of having them poll the listings.
+
+The file routes add a ChangeEvent row in the same transaction as the change
+(record()), so the table is an outbox shared by all uvicorn workers and its
+id is the event's sequence number. One poller thread per worker reads the
+rows added since its last poll, every CHANGE_FEED_POLL_INTERVAL seconds,
+and hands each subscriber the events of the folders it follows as one
+batch: a poll is one query however many clients are connected, each event
+is serialized once, and the fan-out is a dict lookup per event plus one
+wake-up per event loop.
+
+Ids are handed out at insert but show up at commit, so a lower seq can
+appear after a higher one. The poller keeps asking for such gaps for
+GAP_TIMEOUT seconds (a rolled back insert leaves one for good), and the
+cursor sent to clients is the highest seq with nothing missing below it:
+resuming from it can repeat an event, never skip one (clients drop repeats
+by "seq"). Events are deleted after CHANGE_FEED_RETENTION seconds; a client
+resuming from before the oldest one kept, from more than
+CHANGE_FEED_REPLAY_LIMIT events back, or too slow to keep up, gets a
+"reset" and should refetch its listings.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, func, or_
+
+from app import models
+from app.config import (
+    CHANGE_FEED_HEARTBEAT,
+    CHANGE_FEED_POLL_INTERVAL,
+    CHANGE_FEED_REPLAY_LIMIT,
+    CHANGE_FEED_RETENTION,
+)
+from app.database import SessionLocal
+from app.utils import metrics
+
+ROOT = 0  # the folder id clients use for the top level
+GAP_TIMEOUT = 10  # seconds a missing seq is waited for
+MAX_GAP = 1000  # larger jumps in the ids are not waited for seq by seq
+POLL_LIMIT = 5000  # events read per query
+QUEUE_LIMIT = 1000  # batches a subscriber may fall behind by before it is reset
+PRUNE_INTERVAL = 600  # seconds between deletes of expired events
+
+READY, EVENTS, RESET = "ready", "events", "reset"
+
+Event = namedtuple("Event", ["seq", "folders", "data"])  # data: the event as JSON
+Batch = namedtuple("Batch", ["kind", "cursor", "events"])
+
+
+def folder_key(folder_id) -> int:
+    return folder_id or ROOT
+
+
+def record(db, type: str, file, old_folder_id=None):
+    """Add a `type` event about `file`, in the folder it is in now, to the current transaction."""
+    if file.id is None:
+        db.flush()
+    db.add(models.ChangeEvent(
+        type=type,
+        folder_id=file.parent_id,
+        old_folder_id=old_folder_id,
+        file_id=file.id,
+        name=file.filename,
+        is_folder=bool(file.is_folder),
+    ))
+
+
+def to_event(row) -> Event:
+    data = {
+        "seq": row.id,
+        "type": row.type,
+        "folder": folder_key(row.folder_id),
+        "id": row.file_id,
+        "name": row.name,
+        "is_folder": bool(row.is_folder),
+    }
+    folders = {data["folder"]}
+    if row.type == "move":
+        data["from"] = folder_key(row.old_folder_id)
+        folders.add(data["from"])
+    return Event(row.id, folders, json.dumps(data))
+
+
+def in_folders(folders):
+    """Filter for the events of `folders`, moves out of them included."""
+    def matches(column):
+        ids = [folder for folder in folders if folder != ROOT]
+        condition = column.in_(ids)
+        return or_(condition, column == None) if ROOT in folders else condition
+    return or_(
+        matches(models.ChangeEvent.folder_id),
+        and_(models.ChangeEvent.type == "move", matches(models.ChangeEvent.old_folder_id)),
+    )
+
+
+class Subscription:
+    """One connected client: the folders it follows and the batches waiting for it."""
+
+    def __init__(self, folders, loop):
+        self.folders = frozenset(folders)
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.reset = False
+
+    def put(self, cursor: int, events: list):
+        # on the subscriber's event loop
+        if self.reset:
+            return
+        if self.queue.qsize() >= QUEUE_LIMIT:
+            self.reset = True
+            self.queue.put_nowait(RESET)
+            return
+        self.queue.put_nowait((cursor, events))
+
+
+def _deliver(batches):
+    for subscription, cursor, events in batches:
+        subscription.put(cursor, events)
+
+
+class ChangeFeed:
+    """The subscribers of this worker and the thread that reads new events for them."""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)  # folder -> subscriptions following it
+        self._lock = threading.Lock()
+        self._last = None  # highest seq read
+        self._gaps = {}  # seq not seen yet -> when it was first missed
+        self._pruned = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float = CHANGE_FEED_POLL_INTERVAL):
+        if self._thread is not None or interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="change-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def cursor(self) -> int:
+        """The highest seq this worker has seen every event up to."""
+        with self._lock:
+            if self._gaps:
+                return min(self._gaps) - 1
+            return self._last or 0
+
+    #subscribers
+    def _add(self, subscription: Subscription):
+        with self._lock:
+            for folder in subscription.folders:
+                self._subscribers[folder].add(subscription)
+        metrics.change_feed_subscribers.inc()
+
+    def _remove(self, subscription: Subscription):
+        with self._lock:
+            for folder in subscription.folders:
+                followers = self._subscribers.get(folder)
+                if followers is not None:
+                    followers.discard(subscription)
+                    if not followers:
+                        del self._subscribers[folder]
+        metrics.change_feed_subscribers.dec()
+
+    def replay(self, folders, since: int):
+        """The kept events of `folders` after `since`, None when some are gone or too many."""
+        db = SessionLocal()
+        try:
+            oldest = db.query(func.min(models.ChangeEvent.id)).scalar()
+            if oldest is not None and since < oldest - 1:
+                return None
+            rows = (
+                db.query(models.ChangeEvent)
+                .filter(models.ChangeEvent.id > since, in_folders(folders))
+                .order_by(models.ChangeEvent.id)
+                .limit(CHANGE_FEED_REPLAY_LIMIT + 1)
+                .all()
+            )
+        finally:
+            db.close()
+        if len(rows) > CHANGE_FEED_REPLAY_LIMIT:
+            return None
+        return [to_event(row) for row in rows]
+
+    async def listen(self, folders, since: int = None, heartbeat: float = CHANGE_FEED_HEARTBEAT):
+        """
+        What to send a client following `folders`: a READY batch with the
+        cursor to resume from, the events after `since` (when given) and then
+        new ones as they come, None after `heartbeat` quiet seconds, and a
+        last RESET batch if the client has to refetch its listings.
+        """
+        subscription = Subscription(folders, asyncio.get_running_loop())
+        # subscribed before the replay reads anything, so nothing falls between the two
+        self._add(subscription)
+        try:
+            replayed = set()
+            if since is None:
+                yield Batch(READY, self.cursor(), [])
+            else:
+                events = await run_in_threadpool(self.replay, subscription.folders, since)
+                if events is None:
+                    metrics.change_feed_resets.inc()
+                    yield Batch(RESET, self.cursor(), [])
+                    return
+                yield Batch(READY, since, [])
+                if events:
+                    replayed = {event.seq for event in events}
+                    # only up to what the poller has seen complete: a gap below may still fill
+                    yield Batch(EVENTS, max(since, min(events[-1].seq, self.cursor())), events)
+
+            while True:
+                try:
+                    item = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if item == RESET:
+                    metrics.change_feed_resets.inc()
+                    yield Batch(RESET, self.cursor(), [])
+                    return
+                cursor, events = item
+                if since is not None or replayed:
+                    events = [e for e in events if e.seq > (since or 0) and e.seq not in replayed]
+                if events:
+                    yield Batch(EVENTS, cursor, events)
+        finally:
+            self._remove(subscription)
+
+    #polling
+    def poll(self, db) -> int:
+        """Read the events added since the last poll and hand them out; returns how many were read."""
+        if self._last is None:
+            self._last = db.query(func.max(models.ChangeEvent.id)).scalar() or 0
+            return 0
+
+        with self._lock:
+            gaps = list(self._gaps)
+        new = models.ChangeEvent.id > self._last
+        rows = (
+            db.query(models.ChangeEvent)
+            .filter(or_(new, models.ChangeEvent.id.in_(gaps)) if gaps else new)
+            .order_by(models.ChangeEvent.id)
+            .limit(POLL_LIMIT)
+            .all()
+        )
+
+        now = time.monotonic()
+        with self._lock:
+            for row in rows:
+                if row.id > self._last:
+                    if row.id - self._last <= MAX_GAP:
+                        self._gaps.update(dict.fromkeys(range(self._last + 1, row.id), now))
+                    self._last = row.id
+                else:
+                    self._gaps.pop(row.id, None)
+            self._gaps = {seq: missed for seq, missed in self._gaps.items() if now - missed < GAP_TIMEOUT}
+        if rows:
+            metrics.change_feed_events.inc(len(rows))
+            self._fan_out(self.cursor(), [to_event(row) for row in rows])
+        return len(rows)
+
+    def _fan_out(self, cursor: int, events: list):
+        batches = defaultdict(list)
+        with self._lock:
+            for event in events:
+                # a move is sent once to a client following both of its folders
+                followers = set().union(*(self._subscribers.get(folder, ()) for folder in event.folders))
+                for subscription in followers:
+                    batches[subscription].append(event)
+        # one wake-up per event loop, however many of its clients have events
+        by_loop = defaultdict(list)
+        for subscription, batch in batches.items():
+            by_loop[subscription.loop].append((subscription, cursor, batch))
+        delivered = 0
+        for loop, deliveries in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, deliveries)
+                delivered += sum(len(batch) for _, _, batch in deliveries)
+            except RuntimeError:
+                pass  # the loop is closed: its clients are gone
+        metrics.change_feed_deliveries.inc(delivered)
+
+    def prune(self, db, retention: float = CHANGE_FEED_RETENTION) -> int:
+        """Delete expired events, always keeping the newest so resumes can tell what is gone."""
+        newest = db.query(func.max(models.ChangeEvent.id)).scalar()
+        if newest is None:
+            return 0
+        deleted = db.query(models.ChangeEvent).filter(
+            models.ChangeEvent.created_at < datetime.now() - timedelta(seconds=retention),
+            models.ChangeEvent.id < newest,
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+    def _loop(self, interval: float):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            read = 0
+            try:
+                read = self.poll(db)
+                if time.monotonic() - self._pruned > PRUNE_INTERVAL:
+                    self._pruned = time.monotonic()
+                    self.prune(db)
+            except Exception as e:
+                print(f"Warning: change feed poll failed: {e}")
+            finally:
+                db.close()
+            # a full read means more is waiting
+            if read < POLL_LIMIT:
+                self._stop.wait(interval)
+
+
+change_feed = ChangeFeed()
@@ -0,0 +1,142 @@
+"""
+GET /changes (Server-Sent Events) and /changes/ws (WebSocket): the change
+feed of the folders in ?folders=1,2,0 (0 = the top level).
+
+Both send a "ready" message with the cursor first, then the events. Each
+event is one JSON object:
+
+    {"seq": 812, "type": "move", "folder": 7, "from": 0, "id": 55, "name": "a.txt", "is_folder": false}
+
+type is create, rename, move, delete, star or unstar; "from" is only on
+moves. To resume after a disconnect, reconnect with ?since=<cursor> (SSE
+clients send Last-Event-ID, which the stream keeps up to date). A "reset"
+message means the events since then are not all there any more: refetch
+the listings and reconnect without since.
+
+EventSource can't send headers, so the token may also be given as ?token=.
+"""
+import json
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from jose import JWTError, jwt
+
+from app.auth.utils import get_user_by_username
+from app.changes.feed import EVENTS, change_feed
+from app.config import ALGORITHM, SECRET_KEY
+from app.database import SessionLocal
+
+router = APIRouter()
+
+MAX_FOLDERS = 200  # folders one connection may follow
+RETRY_MS = 3000  # how long EventSource waits before reconnecting
+
+
+def authenticate(authorization: Optional[str], token: Optional[str]):
+    """The user of a bearer header or a ?token=, None when neither is valid."""
+    scheme, _, bearer = (authorization or "").partition(" ")
+    token = token or (bearer if scheme.lower() == "bearer" else None)
+    if not token:
+        return None
+    try:
+        username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+    if username is None:
+        return None
+    # a session of its own: the connection stays open for as long as the client listens
+    db = SessionLocal()
+    try:
+        return get_user_by_username(db, username)
+    finally:
+        db.close()
+
+
+def parse_folders(raw: str) -> set:
+    try:
+        folders = {int(part) for part in raw.split(",") if part.strip()}
+    except ValueError:
+        raise HTTPException(400, "folders must be a comma separated list of folder ids")
+    if not folders or len(folders) > MAX_FOLDERS:
+        raise HTTPException(400, f"Follow between 1 and {MAX_FOLDERS} folders")
+    return folders
+
+
+def resume_point(since: Optional[int], last_event_id: Optional[str]) -> Optional[int]:
+    if since is None and last_event_id and last_event_id.isdigit():
+        return int(last_event_id)
+    return since
+
+
+async def sse_stream(folders: set, since: Optional[int]):
+    yield f"retry: {RETRY_MS}\n\n"
+    async for batch in change_feed.listen(folders, since):
+        if batch is None:
+            yield ": keep-alive\n\n"
+        elif batch.kind == EVENTS:
+            # unnamed, so EventSource.onmessage gets them; the id is what Last-Event-ID resumes from
+            yield "".join(f"id: {batch.cursor}\ndata: {event.data}\n\n" for event in batch.events)
+        else:
+            yield f"id: {batch.cursor}\nevent: {batch.kind}\ndata: {json.dumps({'cursor': batch.cursor})}\n\n"
+
+
+def ws_message(batch) -> str:
+    if batch is None:
+        return '{"type": "ping"}'
+    if batch.kind == EVENTS:
+        events = ", ".join(event.data for event in batch.events)
+        return f'{{"type": "events", "cursor": {batch.cursor}, "events": [{events}]}}'
+    return json.dumps({"type": batch.kind, "cursor": batch.cursor})
+
+
+@router.get("", summary="Change feed of some folders, as Server-Sent Events")
+async def changes_sse(
+    request: Request,
+    folders: str = Query(..., description="Comma separated folder ids, 0 for the top level"),
+    since: Optional[int] = Query(None, description="Cursor to resume from"),
+    token: Optional[str] = Query(None),
+):
+    user = await run_in_threadpool(authenticate, request.headers.get("authorization"), token)
+    if user is None:
+        raise HTTPException(401, "Invalid credentials or token expired", headers={"WWW-Authenticate": "Bearer"})
+    if not change_feed.running:
+        raise HTTPException(503, "The change feed is disabled")
+
+    return StreamingResponse(
+        sse_stream(parse_folders(folders), resume_point(since, request.headers.get("last-event-id"))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def changes_ws(
+    websocket: WebSocket,
+    folders: str = Query(...),
+    since: Optional[int] = Query(None),
+    token: Optional[str] = Query(None),
+):
+    user = await run_in_threadpool(authenticate, websocket.headers.get("authorization"), token)
+    if user is None:
+        await websocket.close(code=1008, reason="Invalid credentials or token expired")
+        return
+    if not change_feed.running:
+        await websocket.close(code=1013, reason="The change feed is disabled")
+        return
+    try:
+        folder_ids = parse_folders(folders)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+
+    await websocket.accept()
+    stream = change_feed.listen(folder_ids, since)
+    try:
+        async for batch in stream:
+            await websocket.send_text(ws_message(batch))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await stream.aclose()
@@ -0,0 +1,85 @@
+# check_query_plans.py
+# Fails (exit code 1) when one of the hot queries in app/files/routes.py would
+# scan a whole table instead of using an index. Run it after migrating:
+#   python -m app.check_query_plans
+# Works on MySQL (EXPLAIN type=ALL), PostgreSQL (Seq Scan, with seqscan
+# disabled so tiny tables don't hide a missing index) and SQLite (SCAN <table>).
+import sys
+from datetime import datetime
+
+from sqlalchemy import func, text
+
+from app import models
+from app.database import SessionLocal, engine
+
+# search uses LIKE '%term%', which no B-tree index can serve, so it isn't listed
+HOT_QUERIES = {
+    "list folder": lambda db: db.query(models.FileModel).filter(
+        models.FileModel.parent_id == 1,
+        ~func.coalesce(models.FileModel.path, "").ilike("%recyclebin%"),
+    ),
+    "list root": lambda db: db.query(models.FileModel).filter(
+        models.FileModel.parent_id == None,
+        ~func.coalesce(models.FileModel.path, "").ilike("%recyclebin%"),
+    ),
+    "name exists in folder": lambda db: db.query(models.FileModel).filter(
+        models.FileModel.filename == "report.csv",
+        models.FileModel.parent_id == 1,
+        models.FileModel.is_folder == False,
+    ),
+    "find by path": lambda db: db.query(models.FileModel).filter(
+        models.FileModel.path == "uploads/Documents",
+    ),
+    "logs of a file": lambda db: db.query(models.FileLog).filter(
+        models.FileLog.file_id == 1,
+    ),
+    "oldest recycle bin items": lambda db: db.query(models.RecycleBin).filter(
+        models.RecycleBin.deleted_at < datetime(2024, 1, 1),
+    ).order_by(models.RecycleBin.deleted_at).limit(100),
+}
+
+
+def compile_sql(query) -> str:
+    return str(query.statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+
+
+def full_scans(db, sql: str) -> list:
+    """Return a description of every full table scan in the plan of `sql`."""
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        rows = db.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+        # "SCAN files" is a table scan, "SCAN files USING INDEX ..." walks an index
+        return [row[-1] for row in rows if row[-1].startswith("SCAN") and "USING" not in row[-1]]
+    if dialect == "mysql":
+        rows = db.execute(text(f"EXPLAIN {sql}")).mappings().fetchall()
+        return [f"table {row['table']}: type=ALL" for row in rows if row["type"] == "ALL"]
+    if dialect == "postgresql":
+        db.execute(text("SET enable_seqscan = off"))
+        rows = db.execute(text(f"EXPLAIN {sql}")).fetchall()
+        return [row[0].strip() for row in rows if "Seq Scan" in row[0]]
+    raise SystemExit(f"Don't know how to read query plans for dialect '{dialect}'")
+
+
+def main():
+    db = SessionLocal()
+    failures = 0
+    try:
+        for name, build in HOT_QUERIES.items():
+            sql = compile_sql(build(db))
+            scans = full_scans(db, sql)
+            if scans:
+                failures += 1
+                print(f"FULL SCAN  {name}: {'; '.join(scans)}\n           {sql.replace(chr(10), ' ')}")
+            else:
+                print(f"ok         {name}")
+    finally:
+        db.rollback()
+        db.close()
+
+    if failures:
+        print(f"\n{failures} hot quer{'y' if failures == 1 else 'ies'} fell back to a full table scan")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
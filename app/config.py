@@ -7,4 +7,138 @@ SECRET_KEY = "change-me-to-a-secure-random-string"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-DATABASE_URL = "mysql+pymysql://root:@localhost:3306/file_manager"
+# DEBUG adds X-DB-* query headers to every response
+DEBUG = os.getenv("DEBUG", "false").lower() in ("1", "true", "yes")
+
+DATABASE_URL = os.getenv("DATABASE_URL", "mysql+pymysql://root:@localhost:3306/file_manager")
+
+
+def _parse_limits(raw: str, defaults: dict) -> dict:
+    """Parse "copy=4,zip=1" style overrides on top of the defaults."""
+    limits = dict(defaults)
+    for part in filter(None, (p.strip() for p in raw.split(","))):
+        name, _, value = part.partition("=")
+        limits[name.strip()] = max(1, int(value))
+    return limits
+
+
+def _parse_size(raw: str) -> int:
+    """Bytes from "500", "20M" or "10G" (binary units)."""
+    raw = raw.strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if raw and raw[-1] in units:
+        return int(float(raw[:-1]) * units[raw[-1]])
+    return int(raw)
+
+
+def _parse_quotas(raw: str) -> dict:
+    """Parse "user=10G,admin=0" into bytes per role."""
+    quotas = {}
+    for part in filter(None, (p.strip() for p in raw.split(","))):
+        role, _, value = part.partition("=")
+        quotas[role.strip()] = max(0, _parse_size(value))
+    return quotas
+
+
+# background jobs: worker threads per operation type
+JOB_CONCURRENCY = _parse_limits(
+    os.getenv("JOB_CONCURRENCY", ""),
+    {"copy": 2, "move": 2, "delete": 2, "zip": 1, "restore": 2, "sync": 1},
+)
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "1.0"))  # seconds between progress writes
+JOB_OUTPUT_DIR = Path(os.getenv("JOB_OUTPUT_DIR", "job_output"))
+# zip job results are deleted JOB_OUTPUT_RETENTION seconds after their job
+# finished (0 = kept forever), checked every JOB_OUTPUT_PRUNE_INTERVAL seconds
+JOB_OUTPUT_RETENTION = float(os.getenv("JOB_OUTPUT_RETENTION", "86400"))
+JOB_OUTPUT_PRUNE_INTERVAL = float(os.getenv("JOB_OUTPUT_PRUNE_INTERVAL", "600"))
+
+# seconds a file operation waits for overlapping operations before giving up
+PATH_LOCK_TIMEOUT = float(os.getenv("PATH_LOCK_TIMEOUT", "30"))
+# the uvicorn workers of a host share their path locks through a file here
+PATH_LOCK_DIR = Path(os.getenv("PATH_LOCK_DIR", "locks"))
+
+# log requests that issue more SQL statements than this (0 disables)
+QUERY_COUNT_WARN_THRESHOLD = int(os.getenv("QUERY_COUNT_WARN_THRESHOLD", "50"))
+
+# metrics: every worker process writes its counters here so /metrics can
+# report the sum over all uvicorn workers
+METRICS_DIR = Path(os.getenv("METRICS_DIR", "metrics_data"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))  # seconds between snapshot writes
+
+# sampling profiler: admins send "X-Profile: 1" to profile one request;
+# PROFILE_SAMPLE_RATE (0..1) also profiles that fraction of all requests
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))  # seconds between stack samples
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))  # newest profiles kept on disk
+
+# where file contents live: "local" (uploads/ mirrors the folder tree),
+# "sharded" (hash fan-out directories under STORAGE_ROOT) or "s3"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_ROOT = Path(os.getenv("STORAGE_ROOT", "storage"))
+STORAGE_MAX_WORKERS = int(os.getenv("STORAGE_MAX_WORKERS", "8"))  # parallel requests for batched S3 copies
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "")  # MinIO, moto, ...; empty for AWS
+S3_REGION = os.getenv("S3_REGION", "")
+# "tree": contents are stored at their logical path (uploads/a/b.txt), so
+# moves and renames move data; "id": new files are stored under
+# objects/<hash fan-out>/<id> and moves/renames only update the database
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "tree")
+# compression at rest for uploads: "off", "gzip", "zstd" (needs zstandard)
+# or "auto" (zstd when installed, else gzip); data that doesn't compress is stored raw
+COMPRESSION = os.getenv("COMPRESSION", "off")
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL")) if os.getenv("COMPRESSION_LEVEL") else None  # codec default when unset
+# pack storage: files of PACK_THRESHOLD bytes or less are appended to shared
+# segment files under PACK_DIR instead of getting a file each (0 disables)
+PACK_THRESHOLD = int(os.getenv("PACK_THRESHOLD", "0"))
+PACK_DIR = Path(os.getenv("PACK_DIR", "packs"))
+PACK_SEGMENT_SIZE = int(os.getenv("PACK_SEGMENT_SIZE", str(64 * 1024 * 1024)))
+# background compaction: every PACK_COMPACT_INTERVAL seconds (0 = only via
+# python -m app.storage.compactor) rewrite sealed segments that are more than
+# PACK_COMPACT_GARBAGE (0..1) unreferenced
+PACK_COMPACT_INTERVAL = float(os.getenv("PACK_COMPACT_INTERVAL", "300"))
+PACK_COMPACT_GARBAGE = float(os.getenv("PACK_COMPACT_GARBAGE", "0.5"))
+# storage quotas per role, e.g. "user=10G,admin=0" (0 or unlisted = unlimited);
+# a user's own quota_bytes, when set, overrides its role's
+ROLE_QUOTAS = _parse_quotas(os.getenv("ROLE_QUOTAS", ""))
+# recompute every user's used_bytes this often (0 = only through the reconcile_quotas job)
+QUOTA_RECONCILE_INTERVAL = float(os.getenv("QUOTA_RECONCILE_INTERVAL", "3600"))
+QUOTA_RECONCILE_BATCH = int(os.getenv("QUOTA_RECONCILE_BATCH", "500"))  # users per transaction
+# RecycleBin retention: items deleted more than RECYCLE_RETENTION_DAYS ago are
+# purged in the background every PURGE_INTERVAL seconds (0 = keep forever),
+# PURGE_BATCH items at a time and at most PURGE_RATE bytes per second (0 = unthrottled)
+RECYCLE_RETENTION_DAYS = float(os.getenv("RECYCLE_RETENTION_DAYS", "30"))
+PURGE_INTERVAL = float(os.getenv("PURGE_INTERVAL", "600"))
+PURGE_BATCH = int(os.getenv("PURGE_BATCH", "100"))
+PURGE_RATE = _parse_size(os.getenv("PURGE_RATE", "50M"))
+# change feed (GET /changes, /changes/ws): every worker reads new events this
+# often; events are kept CHANGE_FEED_RETENTION seconds for clients resuming
+# with ?since=, at most CHANGE_FEED_REPLAY_LIMIT of them per resume
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("CHANGE_FEED_POLL_INTERVAL", "0.5"))
+CHANGE_FEED_RETENTION = float(os.getenv("CHANGE_FEED_RETENTION", "86400"))
+CHANGE_FEED_REPLAY_LIMIT = int(os.getenv("CHANGE_FEED_REPLAY_LIMIT", "1000"))
+CHANGE_FEED_HEARTBEAT = float(os.getenv("CHANGE_FEED_HEARTBEAT", "15"))  # seconds between keep-alives
+# folder listings cached per worker (app.files.listing_cache), at most this
+# many bytes of JSON (0 disables); workers of one host tell each other about
+# changed folders over localhost UDP, finding each other in the channel dir
+LISTING_CACHE_SIZE = _parse_size(os.getenv("LISTING_CACHE_SIZE", "64M"))
+LISTING_CACHE_CHANNEL_DIR = Path(os.getenv("LISTING_CACHE_CHANNEL_DIR", "cache_channel"))
+# ingest-time metadata (app.files.metadata): METADATA_WORKERS threads extract
+# the MIME type, hash and attributes of new files, at most
+# METADATA_QUEUE_SIZE waiting; every METADATA_SCAN_INTERVAL seconds files
+# without (current) metadata are queued too (0 workers disables extraction)
+METADATA_WORKERS = int(os.getenv("METADATA_WORKERS", "2"))
+METADATA_QUEUE_SIZE = int(os.getenv("METADATA_QUEUE_SIZE", "1000"))
+METADATA_SCAN_INTERVAL = float(os.getenv("METADATA_SCAN_INTERVAL", "300"))
+# previews (GET /files/preview/{id}): made in PREVIEW_WORKERS processes and
+# kept in PREVIEW_CACHE_DIR, at most PREVIEW_CACHE_SIZE bytes; text previews
+# are PREVIEW_LINES lines by default (at most PREVIEW_MAX_LINES), thumbnails
+# PREVIEW_SIZE pixels; images over PREVIEW_MAX_SOURCE bytes are not thumbnailed
+PREVIEW_CACHE_DIR = Path(os.getenv("PREVIEW_CACHE_DIR", "previews"))
+PREVIEW_CACHE_SIZE = _parse_size(os.getenv("PREVIEW_CACHE_SIZE", "256M"))
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+PREVIEW_LINES = int(os.getenv("PREVIEW_LINES", "50"))
+PREVIEW_MAX_LINES = int(os.getenv("PREVIEW_MAX_LINES", "500"))
+PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", "256"))
+PREVIEW_MAX_SOURCE = _parse_size(os.getenv("PREVIEW_MAX_SOURCE", "50M"))
@@ -1,6 +1,17 @@
 # create_tables.py
-from app.database import Base, engine
-import app.models
+# Creates or upgrades the schema through the Alembic migrations in /migrations:
+#   python -m app.create_tables
+from alembic import command
+from alembic.config import Config
 
-Base.metadata.create_all(bind=engine)
-print(" All tables created in MySQL")
+from app.config import BASE_DIR
+
+
+def upgrade_database(revision: str = "head"):
+    config = Config(str(BASE_DIR / "alembic.ini"))
+    command.upgrade(config, revision)
+
+
+if __name__ == "__main__":
+    upgrade_database()
+    print(" Database schema is up to date")
@@ -8,8 +8,12 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 def get_db():
+    from app.utils.metrics import timed_checkout  # imports the models, which import this module
+
     db = SessionLocal()
     try:
+        # checked out up front, so the pool wait is measured for every request
+        timed_checkout(db)
         yield db
     finally:
         db.close()
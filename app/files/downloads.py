@@ -0,0 +1,201 @@
+"""
+Responses for stored objects: files (with Range support) and folders or
+selections as zip archives.
+
+Backends on the local file system hand their path to FileResponse, which does
+ranges and sendfile itself; other backends are streamed chunk by chunk.
+Compressed files are sent as stored to clients accepting their encoding, and
+decompressed on the fly (Range requests included) for everyone else.
+
+Archives are written as they are sent: entries carry their sizes and CRCs in
+data descriptors after their data, so nothing is buffered beyond about a
+chunk, and the transfer starts with the first entry.
+"""
+import io
+import mimetypes
+import re
+import time
+import zipfile
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+from fastapi import BackgroundTasks, HTTPException
+
+from app.storage import compression
+from app.storage.backends import storage
+from app.storage.base import CHUNK_SIZE
+from app.utils import metrics
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+ZIP_EPOCH = 315619200  # 1980-01-02, the earliest time a zip entry can carry
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """(start, length) of a single "bytes=a-b" range; None means send everything."""
+    match = RANGE_PATTERN.match((header or "").strip())
+    if not match or match.groups() == ("", "") or size == 0:
+        # no range, or several: a full 200 response is always allowed
+        return None
+    first, last = match.groups()
+    if not first:
+        length = min(int(last), size)
+        return size - length, length
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise HTTPException(416, "Requested range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end - start + 1
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def read_object(key: str, packed=None, start: int = 0, length: int = None):
+    """The (uncompressed) contents of a stored file, from `start` on."""
+    if packed:
+        return compression.read(storage, key, packed, start, length)
+    return storage.get_stream(key, start, length)
+
+
+def file_response(
+    key: str,
+    filename: str,
+    range_header: Optional[str] = None,
+    background: BackgroundTasks = None,
+    packed=None,
+    accept_encoding: Optional[str] = None,
+):
+    if packed:
+        return packed_response(key, filename, packed, range_header, background, accept_encoding)
+
+    path = storage.local_path(key)
+    if path is not None:
+        if not path.is_file():
+            raise HTTPException(404, f"File '{filename}' not found")
+        return metrics.MeteredFileResponse(path=path, filename=filename, background=background)
+
+    info = storage.stat(key)
+    if info is None or info.is_folder:
+        raise HTTPException(404, f"File '{filename}' not found")
+
+    byte_range = parse_range(range_header, info.size)
+    start, length = byte_range or (0, info.size)
+    headers = {
+        "Content-Disposition": content_disposition(filename),
+        "Content-Length": str(length),
+        "Accept-Ranges": "bytes",
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{start + length - 1}/{info.size}"
+    return metrics.MeteredStreamingResponse(
+        storage.get_stream(key, start, length),
+        status_code=206 if byte_range else 200,
+        media_type=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        headers=headers,
+        background=background,
+    )
+
+
+def packed_response(key: str, filename: str, packed, range_header, background, accept_encoding):
+    info = storage.stat(key)
+    if info is None or info.is_folder:
+        raise HTTPException(404, f"File '{filename}' not found")
+
+    headers = {"Content-Disposition": content_disposition(filename), "Vary": "Accept-Encoding"}
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = compression.codec(packed.codec).encoding
+    if not range_header and compression.accepts(accept_encoding, encoding):
+        # the stored object is a valid stream in the client's encoding: no work at all
+        headers.update({"Content-Encoding": encoding, "Content-Length": str(info.size)})
+        return metrics.MeteredStreamingResponse(
+            storage.get_stream(key), media_type=media_type, headers=headers, background=background
+        )
+
+    byte_range = parse_range(range_header, packed.size)
+    start, length = byte_range or (0, packed.size)
+    headers.update({"Content-Length": str(length), "Accept-Ranges": "bytes"})
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{start + length - 1}/{packed.size}"
+    return metrics.MeteredStreamingResponse(
+        read_object(key, packed, start, length),
+        status_code=206 if byte_range else 200,
+        media_type=media_type,
+        headers=headers,
+        background=background,
+    )
+
+
+class _ZipSink(io.RawIOBase):
+    """Where a streamed archive is written to: no seek, so zipfile uses data descriptors."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def stream_zip(members, progress=None):
+    """Yield a zip of `members`, (name in the archive, ObjectStat, Packed or None), chunk by chunk."""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, entry, packed in members:
+            info = zipfile.ZipInfo(
+                f"{name}/" if entry.is_folder else name,
+                date_time=time.localtime(max(entry.mtime or time.time(), ZIP_EPOCH))[:6],
+            )
+            if entry.is_folder:
+                archive.writestr(info, b"")
+                continue
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, "w", force_zip64=True) as f:
+                for chunk in read_object(entry.key, packed):
+                    f.write(chunk)
+                    if len(sink.buffer) >= CHUNK_SIZE:
+                        yield sink.take()
+            if sink.buffer:
+                yield sink.take()
+            if progress:
+                progress(1, packed.size if packed else entry.size)
+    # the central directory
+    yield sink.take()
+
+
+def write_zip(members, zip_path: Path, progress=None):
+    """Write a zip of `members` to zip_path."""
+    with open(zip_path, "wb") as f:
+        for chunk in stream_zip(members, progress):
+            f.write(chunk)
+
+
+def zip_response(members, filename: str, background: BackgroundTasks = None):
+    """A zip of `members`, streamed as it is written."""
+    return metrics.MeteredStreamingResponse(
+        stream_zip(members),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(filename)},
+        background=background,
+    )
+
+
+def folder_response(members, folder_name: str, background: BackgroundTasks):
+    return zip_response(members, f"{folder_name}.zip", background)
@@ -1,47 +1,333 @@
-import os
+"""
+Generate a synthetic file tree for testing and benchmarking.
+
+    python -m app.files.generate_dummy --files 50
+    python -m app.files.generate_dummy --files 1000000 --depth 4 --fanout 12 --db --no-disk --seed 7
+
+Everything goes into one folder, uploads/dataset_<seed>, with --depth levels
+of --fanout sub-folders below it; files are spread over all folders. The
+same arguments always produce the same tree (names, sizes, timestamps).
+
+--db bulk-inserts the matching FileModel rows (plus FileLog and RecycleBin
+rows) straight into the database without going through the API, then
+rebuilds the folder rollups, reconciles quotas and bumps the listing
+versions; without it run "Sync Disk to DB" afterwards. --recycled files are
+trashed the way the API trashes them, their rows kept under
+RecycleBin/<recycle id>/<name>, so they need --db. --no-disk skips the files
+themselves, which is what you want for 1M-10M entry workloads. Files are
+written through the configured storage backend (STORAGE_BACKEND), so the app
+finds them wherever it keeps contents; on a local file system they are
+sparse: they report their generated size without using that much space.
+"""
+import argparse
+import bisect
+import itertools
+import math
 import random
+import sys
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 
 UPLOAD_DIR = Path("./uploads")
 
-EXTENSIONS = [".txt", ".pdf", ".jpg", ".zip", ".docx", ".mp3", ".csv"]
+DEFAULT_EXT_MIX = ".txt=25,.pdf=20,.jpg=25,.docx=10,.csv=10,.zip=5,.mp3=5"
+LOG_ACTIONS = ["Create", "Download", "Download", "Rename", "Star", "Move"]
+EPOCH = datetime(2024, 1, 1)
 
-def create_dummy_file(path):
-    """Creates a small dummy file with random content."""
+
+def create_dummy_file(path, size: int = 0):
+    """Creates a dummy file of `size` bytes (sparse past the first line)."""
     path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w") as f:
-        f.write(f"This is a test file: {path.name}\nRandom ID: {random.randint(1000, 9999)}")
+    with open(path, "wb") as f:
+        header = f"This is a test file: {path.name}\n".encode()
+        f.write(header[:size] if size else header)
+        if size > len(header):
+            f.truncate(size)
+
+
+def dummy_chunks(name: str, size: int):
+    """The contents create_dummy_file() writes, as chunks for a storage backend."""
+    from app.storage.base import CHUNK_SIZE
+
+    header = f"This is a test file: {name}\n".encode()
+    yield header[:size] if size else header
+    left = size - len(header)
+    while left > 0:
+        yield bytes(min(left, CHUNK_SIZE))
+        left -= CHUNK_SIZE
+
+
+def parse_ext_mix(raw: str) -> tuple:
+    """".txt=30,.pdf=10" -> (extensions, cumulative weights)"""
+    extensions, weights = [], []
+    for part in filter(None, (p.strip() for p in raw.split(","))):
+        ext, _, weight = part.partition("=")
+        ext = ext if ext.startswith(".") else f".{ext}"
+        extensions.append(ext)
+        weights.append(float(weight or 1))
+    if not extensions or sum(weights) <= 0:
+        raise SystemExit(f"--ext-mix needs at least one extension with a positive weight, got '{raw}'")
+    return extensions, list(itertools.accumulate(weights))
+
+
+class Generator:
+    """Deterministic description of the tree; yields folders and files without touching disk or DB."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.extensions, self.cum_weights = parse_ext_mix(args.ext_mix)
+        self.root_name = f"dataset_{args.seed}"
+
+    def folders(self) -> list:
+        """[(key, parent_key, name, relative path)] breadth first; the root has parent_key None."""
+        folders = [(0, None, self.root_name, Path(self.root_name))]
+        level = [folders[0]]
+        for depth in range(1, self.args.depth + 1):
+            next_level = []
+            for key, _, _, path in level:
+                for j in range(self.args.fanout):
+                    name = f"folder_{depth}_{j}"
+                    folder = (len(folders), key, name, path / name)
+                    folders.append(folder)
+                    next_level.append(folder)
+            level = next_level
+        return folders
+
+    def size(self) -> int:
+        args = self.args
+        if args.size_dist == "fixed":
+            return args.size_median
+        if args.size_dist == "uniform":
+            return self.rng.randint(0, args.size_max)
+        # lognormal: most files small, a long tail of big ones
+        return min(args.size_max, int(self.rng.lognormvariate(math.log(max(1, args.size_median)), args.size_sigma)))
+
+    def extension(self) -> str:
+        point = self.rng.random() * self.cum_weights[-1]
+        return self.extensions[bisect.bisect_right(self.cum_weights, point)]
+
+    def timestamp(self) -> datetime:
+        return EPOCH + timedelta(seconds=self.rng.randrange(365 * 24 * 3600))
+
+    def files(self, folders: list):
+        """Yields (index, folder, filename, size, uploaded_at, recycled)."""
+        for i in range(self.args.files):
+            folder = folders[self.rng.randrange(len(folders))]
+            filename = f"file_{i:08d}{self.extension()}"
+            recycled = self.rng.random() < self.args.recycled
+            yield i, folder, filename, self.size(), self.timestamp(), recycled
+
+
+def trash_path(root: Path, recycle_id: int, filename: str) -> Path:
+    """Where a trashed file is kept, like routes.trash_key()."""
+    return root / "RecycleBin" / str(recycle_id) / filename
+
+
+#disk
+def write_disk(gen: Generator, folders: list, root: Path, first_recycle_id: int = None):
+    """
+    Write the tree through the storage backend, at the keys the rows' paths
+    name. first_recycle_id: the RecycleBin id seed_database gave the first
+    recycled file.
+    """
+    from app.storage.backends import storage
+
+    def write(path: Path, size: int):
+        local = storage.local_path(path.as_posix())
+        if local is not None:
+            create_dummy_file(local, size)
+        else:
+            storage.put_stream(path.as_posix(), dummy_chunks(path.name, size))
+
+    for _, _, _, path in folders:
+        storage.make_folder((root / path).as_posix())
+    written = 0
+    recycle_id = first_recycle_id
+    for _, folder, filename, size, _, recycled in gen.files(folders):
+        if recycled:
+            write(trash_path(root, recycle_id, filename), size)
+            recycle_id += 1
+        else:
+            write(root / folder[3] / filename, size)
+        written += 1
+        if written % 10000 == 0:
+            print(f"  {written:,} files written")
+    return written
+
+
+#database
+def seed_database(gen: Generator, folders: list, root: Path, username: str, batch_size: int, logs_per_file: float):
+    from sqlalchemy import func
+
+    from app import models
+    from app.database import SessionLocal
+    from app.files import quotas, rollups, versions
+
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        if not user:
+            raise SystemExit(f"User '{username}' not found; register it first or pass --user")
+
+        if db.query(models.FileModel).filter(
+            models.FileModel.parent_id == None, models.FileModel.filename == gen.root_name
+        ).first():
+            raise SystemExit(f"'{gen.root_name}' is already in the database; use another --seed or delete it")
+
+        next_id = (db.query(func.max(models.FileModel.id)).scalar() or 0) + 1
+        # recycled files get their RecycleBin ids in order, starting here; write_disk needs it too
+        first_recycle_id = next_recycle_id = (db.query(func.max(models.RecycleBin.id)).scalar() or 0) + 1
+        folder_ids = {}
+        rows = []
+        for key, parent_key, name, path in folders:
+            folder_ids[key] = next_id
+            rows.append({
+                "id": next_id,
+                "filename": name,
+                "path": (root / path).as_posix(),
+                "uploaded_by_id": user.id,
+                "uploaded_at": EPOCH,
+                "is_folder": True,
+                "is_star": False,
+                "parent_id": folder_ids.get(parent_key),
+                "size": 0,
+            })
+            next_id += 1
+        db.execute(models.FileModel.__table__.insert(), rows)
+        db.commit()
+        print(f"  {len(rows):,} folders")
+
+        log_rng = random.Random(gen.args.seed + 1)
+        file_rows, log_rows, recycle_rows = [], [], []
+        counts = {"files": 0, "logs": 0, "recycle_bin": 0, "first_recycle_id": first_recycle_id}
+        started = time.monotonic()
+
+        def flush():
+            for model, batch, name in (
+                (models.FileModel, file_rows, "files"),
+                (models.FileLog, log_rows, "logs"),
+                (models.RecycleBin, recycle_rows, "recycle_bin"),
+            ):
+                if batch:
+                    db.execute(model.__table__.insert(), batch)
+                    counts[name] += len(batch)
+                    batch.clear()
+            db.commit()
+
+        for _, folder, filename, size, uploaded_at, recycled in gen.files(folders):
+            folder_path = root / folder[3]
+            file_id = next_id
+            next_id += 1
+            path = (folder_path / filename).as_posix()
+            parent_id = folder_ids[folder[0]]
+            if recycled:
+                # as the API trashes a file: the row moves under the trash, detached from its
+                # folder, and the RecycleBin entry remembers where to restore it to
+                recycle_rows.append({
+                    "id": next_recycle_id,
+                    "filename": filename,
+                    "deleted_by_id": user.id,
+                    "deleted_at": uploaded_at + timedelta(days=log_rng.randrange(1, 60)),
+                    "is_folder": False,
+                    "path": trash_path(root, next_recycle_id, filename).as_posix(),
+                    "file_id": file_id,
+                    "parent_id": parent_id,
+                    "original_path": path,
+                    "size": size,
+                    "owner_id": user.id,
+                })
+                path, parent_id = recycle_rows[-1]["path"], None
+                next_recycle_id += 1
+            file_rows.append({
+                "id": file_id,
+                "filename": filename,
+                "path": path,
+                "uploaded_by_id": user.id,
+                "uploaded_at": uploaded_at,
+                "is_folder": False,
+                "is_star": log_rng.random() < 0.02,
+                "parent_id": parent_id,
+                "size": size,
+            })
+            # Poisson-ish: whole part plus a chance for one more
+            for n in range(int(logs_per_file) + (log_rng.random() < logs_per_file % 1)):
+                log_rows.append({
+                    "file_id": file_id,
+                    "user_id": user.id,
+                    "action": "Create" if n == 0 else log_rng.choice(LOG_ACTIONS),
+                    "timestamp": uploaded_at + timedelta(minutes=n * log_rng.randrange(1, 10000)),
+                })
+
+            if len(file_rows) >= batch_size:
+                flush()
+                rate = counts["files"] / max(time.monotonic() - started, 1e-6)
+                print(f"  {counts['files']:,} files, {counts['logs']:,} logs, "
+                      f"{counts['recycle_bin']:,} recycled ({rate:,.0f} files/s)")
+        flush()
+
+        # the bulk inserts skipped what the API keeps up to date on every change
+        rollups.rebuild(db)
+        quotas.reconcile(db)
+        versions.bump_tree(db, (root / gen.root_name).as_posix())
+        versions.bump(db, [None])
+        db.commit()
+        return counts
+    finally:
+        db.close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=50, help="number of files (default 50)")
+    parser.add_argument("--depth", type=int, default=3, help="folder levels below the dataset root")
+    parser.add_argument("--fanout", type=int, default=3, help="sub-folders per folder")
+    parser.add_argument("--size-dist", choices=("lognormal", "uniform", "fixed"), default="lognormal")
+    parser.add_argument("--size-median", type=int, default=64 * 1024, help="bytes; the size for --size-dist fixed")
+    parser.add_argument("--size-sigma", type=float, default=1.5, help="spread of the lognormal distribution")
+    parser.add_argument("--size-max", type=int, default=2 * 1024 ** 3, help="largest file in bytes")
+    parser.add_argument("--ext-mix", default=DEFAULT_EXT_MIX, help=f"extension weights (default {DEFAULT_EXT_MIX})")
+    parser.add_argument("--recycled", type=float, default=0.0, help="fraction of files placed in RecycleBin")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-disk", action="store_true", help="don't create folders/files on disk")
+    parser.add_argument("--db", action="store_true", help="bulk insert FileModel/FileLog/RecycleBin rows")
+    parser.add_argument("--user", default="admin", help="owner of the seeded rows (must exist)")
+    parser.add_argument("--logs-per-file", type=float, default=1.0, help="average FileLog rows per file")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per INSERT batch")
+    return parser
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
 
-def generate_structure():
-    print(f"Starting test data generation in: {UPLOAD_DIR.absolute()}")
-    
-    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    if args.no_disk and not args.db:
+        parser.error("--no-disk without --db would generate nothing")
+    if args.recycled and not args.db:
+        parser.error("--recycled needs --db: trashed files are only known by their RecycleBin rows")
 
-    top_folders = ["Documents", "Images", "Work_Project", "Archive", "Empty_Folder"]
-    for folder in top_folders:
-        folder_path = UPLOAD_DIR / folder
-        folder_path.mkdir(exist_ok=True)
-        print(f"Created folder: {folder}")
+    gen = Generator(args)
+    folders = gen.folders()
+    print(f"Dataset {gen.root_name}: {len(folders):,} folders, {args.files:,} files (seed {args.seed})")
 
-    nested_path = UPLOAD_DIR / "Work_Project" / "2024" / "Q1" / "Drafts"
-    nested_path.mkdir(parents=True, exist_ok=True)
-    create_dummy_file(nested_path / "project_plan.docx")
-    create_dummy_file(nested_path / "budget.csv")
-    print("Created nested structure: Work_Project > 2024 > Q1 > Drafts")
+    # the database first: the recycled files are written under the RecycleBin ids it hands out
+    counts = None
+    if args.db:
+        print("Seeding database")
+        counts = seed_database(Generator(args), folders, UPLOAD_DIR, args.user, args.batch_size, args.logs_per_file)
+        print(f"Inserted {len(folders):,} folders, {counts['files']:,} files, {counts['logs']:,} logs "
+              f"and {counts['recycle_bin']:,} RecycleBin rows")
 
-    for i in range(1, 15):
-        ext = random.choice(EXTENSIONS)
-        create_dummy_file(UPLOAD_DIR / "Documents" / f"report_{i}{ext}")
+    if not args.no_disk:
+        from app.config import STORAGE_BACKEND
 
-    for i in range(1, 10):
-        create_dummy_file(UPLOAD_DIR / "Images" / f"photo_{i}.jpg")
+        print(f"Writing files of {UPLOAD_DIR / gen.root_name} to the '{STORAGE_BACKEND}' storage backend")
+        write_disk(Generator(args), folders, UPLOAD_DIR, counts and counts["first_recycle_id"])
 
-    for i in range(1, 20):
-        ext = random.choice(EXTENSIONS)
-        create_dummy_file(UPLOAD_DIR / f"root_file_{i}{ext}")
+    if not args.db:
+        print("👉 Now go to your File Manager and run 'Sync Disk to DB' to see them.")
 
-    print("\nSuccess! Created ~50 items (files/folders).")
-    print("👉 Now go to your File Manager and run 'Sync Disk to DB' to see them.")
 
 if __name__ == "__main__":
-    generate_structure()
\ No newline at end of file
+    sys.exit(main())
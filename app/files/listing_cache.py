@@ -0,0 +1,246 @@
+"""
+Read-through cache of folder listings: the JSON bodies of GET
+/files/folder/{id} and GET /files/ per folder and query parameters, in an
+LRU of at most LISTING_CACHE_SIZE bytes per worker.
+
+Entries are dropped when their folder's listing changes. versions.bump()
+notes the folders a transaction touches; once it commits, their entries are
+dropped here and the folder ids go to every other process of this host as
+one UDP datagram on localhost (see Channel). Each entry also keeps the
+version it was built at and is only served while that is still the folder's
+version, which the ETag check reads anyway: a late or lost datagram, or a
+write from another host, costs a miss, never a stale listing.
+"""
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import event
+
+from app.config import LISTING_CACHE_CHANNEL_DIR, LISTING_CACHE_SIZE
+from app.database import SessionLocal
+from app.utils import metrics
+from app.utils.metrics import _pid_alive
+
+MAX_ENTRY_SHARE = 16  # a listing larger than 1/16 of the cache is not cached
+PENDING = "listing_cache_folders"  # Session.info key: folders changed in the current transaction
+PEER_REFRESH = 1  # seconds between re-reads of the channel dir
+DATAGRAM_SIZE = 60000
+PORT_SUFFIX = ".port"
+
+Entry = namedtuple("Entry", ["folder", "version", "body"])
+
+
+def folder_key(folder_id) -> int:
+    return folder_id or 0
+
+
+class ListingCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> Entry, least recently used first
+        self._by_folder = defaultdict(set)  # folder -> keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """The cached body for `key` if it was built at `version`, else None."""
+        if not self.max_bytes or version is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version != version:
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.listing_cache_requests.inc(result="hit" if entry else "miss")
+        return entry.body if entry else None
+
+    def put(self, key, folder_id, version, body: bytes):
+        if not self.max_bytes or version is None or len(body) > self.max_bytes // MAX_ENTRY_SHARE:
+            return
+        folder = folder_key(folder_id)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = Entry(folder, version, body)
+            self._by_folder[folder].add(key)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                metrics.listing_cache_evictions.inc()
+            self._report()
+
+    def invalidate(self, folder_ids):
+        dropped = 0
+        with self._lock:
+            for folder in {folder_key(f) for f in folder_ids}:
+                for key in list(self._by_folder.get(folder, ())):
+                    self._drop(key)
+                    dropped += 1
+            self._report()
+        metrics.listing_cache_invalidations.inc(dropped)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_folder.clear()
+            self._bytes = 0
+            self._report()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+        keys = self._by_folder[entry.folder]
+        keys.discard(key)
+        if not keys:
+            del self._by_folder[entry.folder]
+
+    def _report(self):
+        metrics.listing_cache_bytes.set(self._bytes)
+        metrics.listing_cache_entries.set(len(self._entries))
+
+    def respond(self, key, folder_id, version, content, headers: dict) -> Response:
+        """`content` as the JSON response FastAPI would have sent, keeping its body for `key`."""
+        body = JSONResponse(jsonable_encoder(content)).body
+        self.put(key, folder_id, version, body)
+        return cached_response(body, headers)
+
+
+def cached_response(body: bytes, headers: dict) -> Response:
+    return Response(body, media_type="application/json", headers=headers)
+
+
+class Channel:
+    """
+    Changed folder ids between the processes of this host: each worker
+    listens on a UDP port on localhost, announced as <pid>.port in
+    LISTING_CACHE_CHANNEL_DIR, and publish() sends every port there a
+    datagram of comma separated ids. Processes that don't listen (the
+    CLIs) can still publish.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._listener = None
+        self._sender = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._peers = ([], 0.0)  # (ports, read at)
+        self._lock = threading.Lock()
+
+    def _port_file(self):
+        return self.directory / f"{os.getpid()}{PORT_SUFFIX}"
+
+    def start(self):
+        if self._thread is not None or not LISTING_CACHE_SIZE:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.settimeout(1)
+        self._port_file().write_text(str(self._listener.getsockname()[1]))
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="listing-cache-channel", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            self._port_file().unlink(missing_ok=True)
+
+    def ports(self) -> list:
+        """The other processes' ports, re-read every PEER_REFRESH seconds."""
+        ports, read_at = self._peers
+        if time.monotonic() - read_at < PEER_REFRESH:
+            return ports
+        ports = []
+        for path in self.directory.glob(f"*{PORT_SUFFIX}"):
+            pid = path.stem
+            if not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            if not _pid_alive(int(pid)):
+                path.unlink(missing_ok=True)  # left behind by a worker that crashed
+                continue
+            try:
+                ports.append(int(path.read_text()))
+            except (OSError, ValueError):
+                continue  # being written right now
+        self._peers = (ports, time.monotonic())
+        return ports
+
+    def publish(self, folder_ids):
+        ids = sorted({folder_key(f) for f in folder_ids})
+        if not ids or not self.directory.is_dir():
+            return
+        payload = ",".join(map(str, ids)).encode()
+        datagrams = []
+        while payload:
+            # split at a comma, so every datagram is a list of whole ids
+            cut = len(payload) if len(payload) <= DATAGRAM_SIZE else payload.rindex(b",", 0, DATAGRAM_SIZE)
+            datagrams.append(payload[:cut])
+            payload = payload[cut + 1:]
+        sent = 0
+        with self._lock:
+            if self._sender is None:
+                self._sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for port in self.ports():
+                for datagram in datagrams:
+                    try:
+                        self._sender.sendto(datagram, ("127.0.0.1", port))
+                        sent += 1
+                    except OSError:
+                        break  # that worker is gone; its entries are checked by version anyway
+        metrics.listing_cache_messages.inc(sent, direction="sent")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                data, _ = self._listener.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                return  # closed by stop()
+            try:
+                ids = [int(part) for part in data.split(b",") if part]
+            except ValueError:
+                continue
+            metrics.listing_cache_messages.inc(direction="received")
+            listing_cache.invalidate(ids)
+
+
+listing_cache = ListingCache(LISTING_CACHE_SIZE)
+channel = Channel(LISTING_CACHE_CHANNEL_DIR)
+
+
+#transaction hooks
+def changed(db, folder_ids):
+    """The listings of `folder_ids` change when the current transaction commits."""
+    if LISTING_CACHE_SIZE:
+        db.info.setdefault(PENDING, set()).update(folder_key(f) for f in folder_ids)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _invalidate_committed(session):
+    folders = session.info.pop(PENDING, None)
+    if folders:
+        listing_cache.invalidate(folders)
+        try:
+            channel.publish(folders)
+        except OSError as e:
+            print(f"Warning: listing cache invalidation not sent: {e}")
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop(PENDING, None)
@@ -0,0 +1,277 @@
+"""
+Concurrency stress test for the path lock manager.
+
+    python -m app.files.lock_stress --threads 32 --ops 2000 --processes 4
+
+1. Random shared/exclusive requests over an overlapping tree; a referee checks
+   that no two conflicting holders are ever inside at the same time, that the
+   run finishes (no deadlock) and that disjoint subtrees really ran in parallel.
+2. The same requests from --processes processes sharing a lock dir, as the
+   uvicorn workers do; each holder notes when it was inside and the intervals
+   of conflicting holders must not overlap.
+3. check-then-act moves of real files between folders in a temp dir, the
+   same pattern move_files uses, from threads and then from processes; every
+   file must survive exactly once.
+Exits non-zero on any violation.
+"""
+import argparse
+import multiprocessing
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from app.files.locks import EXCLUSIVE, PathLockManager, names_key, path_key
+
+FOLDERS = [
+    "uploads",
+    "uploads/A", "uploads/A/x", "uploads/A/x/1", "uploads/A/y",
+    "uploads/B", "uploads/B/x", "uploads/B/z",
+    "uploads/C", "uploads/C/q", "uploads/C/q/r",
+]
+
+
+def overlaps(a: tuple, b: tuple) -> bool:
+    shorter = min(len(a), len(b))
+    return a[:shorter] == b[:shorter]
+
+
+class Referee:
+    """Tracks who is inside and fails loudly on a conflicting pair."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inside = {}
+        self.violations = []
+        self.max_parallel = 0
+
+    def enter(self, token, requests):
+        with self.lock:
+            for other in self.inside.values():
+                for key, mode in requests:
+                    for other_key, other_mode in other:
+                        if overlaps(key, other_key) and EXCLUSIVE in (mode, other_mode):
+                            self.violations.append((requests, other))
+            self.inside[token] = requests
+            self.max_parallel = max(self.max_parallel, len(self.inside))
+
+    def leave(self, token):
+        with self.lock:
+            del self.inside[token]
+
+
+def random_request(rng: random.Random) -> tuple:
+    exclusive, shared = [], []
+    for _ in range(rng.randint(1, 3)):
+        folder = rng.choice(FOLDERS)
+        kind = rng.random()
+        if kind < 0.3:
+            exclusive.append(folder)
+        elif kind < 0.6:
+            exclusive.append(names_key(folder))
+        else:
+            shared.append(folder)
+    return exclusive, shared
+
+
+def stress_manager(threads: int, ops: int, seed: int) -> list:
+    manager = PathLockManager()
+    referee = Referee()
+    errors = []
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        for i in range(ops // threads):
+            exclusive, shared = random_request(rng)
+            requests = manager._requests(exclusive, shared)
+            try:
+                with manager.lock(exclusive, shared, timeout=30):
+                    token = (n, i)
+                    referee.enter(token, requests)
+                    time.sleep(rng.random() / 2000)
+                    referee.leave(token)
+            except Exception as e:
+                errors.append(f"worker {n}: {e!r}")
+
+    started = time.monotonic()
+    problems = [f"thread still running (deadlock?)" for t in run_threads(worker, threads)]
+    problems += errors
+    problems += [f"conflicting holders inside together: {a} / {b}" for a, b in referee.violations[:5]]
+    if referee.max_parallel < 2:
+        problems.append("disjoint requests never ran in parallel")
+    if manager._held or manager._below:
+        problems.append(f"locks leaked: {manager._held}")
+
+    print(f"manager: {ops} lock calls on {threads} threads in {time.monotonic() - started:.2f}s, "
+          f"max {referee.max_parallel} holders at once")
+    return problems
+
+
+def _timed_holds(lock_dir: str, threads: int, ops: int, seed: int) -> tuple:
+    """One process of stress_processes(): (when each holder was inside, errors)."""
+    manager = PathLockManager(Path(lock_dir))
+    holds, errors = [], []
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        for _ in range(ops // threads):
+            exclusive, shared = random_request(rng)
+            try:
+                with manager.lock(exclusive, shared, timeout=60):
+                    entered = time.monotonic_ns()  # one clock for every process of the host
+                    time.sleep(rng.random() / 2000)
+                    holds.append((entered, time.monotonic_ns(), manager._requests(exclusive, shared)))
+            except Exception as e:
+                errors.append(f"worker {seed}/{n}: {e!r}")
+
+    run_threads(worker, threads)
+    if manager._held or manager._below or manager._host._counts:
+        errors.append(f"process {seed}: locks leaked")
+    return holds, errors
+
+
+def stress_processes(processes: int, threads: int, ops: int, seed: int) -> list:
+    """The manager's random requests from several processes sharing one lock dir."""
+    lock_dir = tempfile.mkdtemp(prefix="lock_stress_")
+    started = time.monotonic()
+    context = multiprocessing.get_context("spawn")  # separate interpreters, like uvicorn workers
+    with context.Pool(processes) as pool:
+        jobs = [(lock_dir, threads, ops // processes, seed * 100 + n) for n in range(processes)]
+        try:
+            results = pool.starmap_async(_timed_holds, jobs).get(timeout=300)
+        except multiprocessing.TimeoutError:
+            return ["process still running (deadlock?)"]
+    shutil.rmtree(lock_dir, ignore_errors=True)
+
+    problems = [error for _, errors in results for error in errors]
+    # sweep the holds by start time: each one against those that began before it ended
+    holds = sorted((start, end, n, requests) for n, (process_holds, _) in enumerate(results)
+                   for start, end, requests in process_holds)
+    violations, parallel = [], 0
+    for i, (start, end, n, requests) in enumerate(holds):
+        for other_start, _, other_n, other in holds[i + 1:]:
+            if other_start >= end:
+                break
+            if other_n != n:
+                parallel += 1
+            if any(overlaps(key, other_key) and EXCLUSIVE in (mode, other_mode)
+                   for key, mode in requests for other_key, other_mode in other):
+                violations.append((requests, other))
+    problems += [f"conflicting holders inside together: {a} / {b}" for a, b in violations[:5]]
+    if processes > 1 and not parallel:
+        problems.append("disjoint requests in different processes never ran in parallel")
+
+    print(f"processes: {len(holds)} lock calls from {processes} processes x {threads} threads "
+          f"in {time.monotonic() - started:.2f}s")
+    return problems
+
+
+def run_threads(target, threads: int) -> list:
+    """Run target(n) on `threads` threads; the ones still running after two minutes."""
+    pool = [threading.Thread(target=target, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join(timeout=120)
+    return [t for t in pool if t.is_alive()]
+
+
+def move_files(manager, folders: list, threads: int, files: int, seed: int) -> list:
+    """`files` moves per thread between `folders`, with the move_files check-then-act; the errors."""
+    errors = []
+
+    def worker(n):
+        rng = random.Random(seed * 7919 + n)
+        for _ in range(files):
+            src_folder, dest_folder = rng.sample(folders, 2)
+            entries = list(src_folder.iterdir())
+            if not entries:
+                continue
+            src = rng.choice(entries)
+            try:
+                with manager.lock(exclusive=[src, names_key(dest_folder)], timeout=60):
+                    if not src.exists():
+                        continue  # someone else moved it first
+                    existing = {p.name for p in dest_folder.iterdir()}
+                    name, counter = src.name, 1
+                    while name in existing:
+                        name = f"{src.stem}_copy{counter}{src.suffix}"
+                        counter += 1
+                    target = dest_folder / name
+                    if target.exists():
+                        errors.append(f"would overwrite {target}")
+                        continue
+                    shutil.move(str(src), str(target))
+            except Exception as e:
+                errors.append(f"worker {seed}/{n}: {e!r}")
+
+    if run_threads(worker, threads):
+        errors.append("move worker still running (deadlock?)")
+    return errors
+
+
+def _move_process(root: str, threads: int, files: int, seed: int) -> list:
+    root = Path(root)
+    folders = [root / name for name in ("A", "B", "C", "D")]
+    return move_files(PathLockManager(root / "locks"), folders, threads, files, seed)
+
+
+def stress_moves(threads: int, files: int, seed: int, processes: int = 1) -> list:
+    """Move files around with the move_files check-then-act, guarded by the manager."""
+    root = Path(tempfile.mkdtemp(prefix="lock_stress_"))
+    folders = [root / name for name in ("A", "B", "C", "D")]
+    for folder in folders:
+        folder.mkdir()
+    for i in range(files):
+        # few distinct names so moves keep colliding
+        (folders[i % len(folders)] / f"f{i % 7}_{i}.txt").write_text(str(i))
+
+    started = time.monotonic()
+    if processes == 1:
+        problems = move_files(PathLockManager(), folders, threads, files, seed)
+    else:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes) as pool:
+            jobs = [(str(root), threads, files, seed * 100 + n) for n in range(processes)]
+            try:
+                problems = sum(pool.starmap_async(_move_process, jobs).get(timeout=300), [])
+            except multiprocessing.TimeoutError:
+                problems = ["move process still running (deadlock?)"]
+
+    contents = sorted(int(p.read_text()) for folder in folders for p in folder.iterdir())
+    if contents != list(range(files)):
+        problems.append(f"expected {files} files after moves, found {len(contents)}")
+
+    print(f"moves: {processes} processes x {threads} threads x {files} moves in {time.monotonic() - started:.2f}s")
+    shutil.rmtree(root, ignore_errors=True)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=4000)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    assert path_key("uploads\\A/b.txt") == ("uploads", "A", "b.txt")
+
+    problems = stress_manager(args.threads, args.ops, args.seed)
+    problems += stress_processes(args.processes, args.threads, args.ops, args.seed)
+    problems += stress_moves(args.threads, args.files, args.seed)
+    problems += stress_moves(args.threads, args.files, args.seed, processes=args.processes)
+
+    for problem in problems:
+        print("FAIL:", problem)
+    if problems:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import PurePosixPath
+from typing import Callable, Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import ObjectDeletedError
+
+from app.config import PATH_LOCK_DIR, PATH_LOCK_TIMEOUT
+
+try:
+    import fcntl
+except ImportError:  # Windows: the locks only cover the threads of one process
+    fcntl = None
+
+# pseudo child used to lock the *names* inside a folder (who may add an entry)
+# without locking the entries themselves; "\0" can't appear in a real filename
+NAMES = "\0names"
+
+SHARED = "S"
+EXCLUSIVE = "X"
+
+BUSY = "Another operation is in progress on this file or folder. Try again."
+
+LOCK_FILE = "paths.lock"
+LOCK_SLOTS = 1 << 30  # bytes of the lock file that keys are hashed onto
+READ, WRITE = 1, 2
+RETRY_WAIT = (0.002, 0.05)  # first and longest pause before trying a key another process holds again
+
+
+def path_key(path) -> tuple:
+    """Normalise a DB/disk path ("uploads\\A/b.txt") into a tuple of parts."""
+    text = str(path).replace("\\", "/")
+    return tuple(part for part in PurePosixPath(text).parts if part not in ("", "."))
+
+
+def names_key(folder_path) -> tuple:
+    """Key guarding name allocation (create/move/rename into) inside folder_path."""
+    return path_key(folder_path) + (NAMES,)
+
+
+def key_slot(key: tuple) -> int:
+    """The byte of the lock file that stands for `key`."""
+    digest = hashlib.blake2b("/".join(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % LOCK_SLOTS
+
+
+class HostLocks:
+    """
+    PathLockManager keys between the processes of one host, as fcntl record
+    locks on one file in `directory`. A key holds a write lock on its own
+    byte (key_slot) and read locks on the bytes of its ancestors, so two
+    processes conflict exactly when one key is equal to or below the other;
+    keys in disjoint subtrees only share read locks. Two keys hashed onto
+    the same byte conflict for nothing, which only makes one of them wait.
+    Shared keys are taken like exclusive ones here: shared holders in
+    different processes exclude each other.
+
+    Record locks belong to the process, not the thread, so the process's
+    holders are counted per byte and the file is only locked or unlocked
+    when that count changes the lock the process needs. A call takes all of
+    its bytes without waiting or gives back what it took, then tries again,
+    so no process waits while holding part of a request.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._fd = None
+        self._counts = {}  # byte -> [read holders, write holders] in this process
+        self._lock = threading.Lock()
+
+    def _file(self) -> int:
+        if self._fd is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self.directory / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o666)
+        return self._fd
+
+    @staticmethod
+    def _needs(requests) -> list:
+        needs = {}
+        for key, _ in requests:
+            for i in range(len(key)):
+                needs.setdefault(key_slot(key[:i]), READ)
+            needs[key_slot(key)] = WRITE
+        return sorted(needs.items())
+
+    @staticmethod
+    def _level(counts) -> int:
+        return WRITE if counts[1] else READ if counts[0] else 0
+
+    def _set(self, slot: int, level: int):
+        """Lock (or unlock) one byte; OSError when another process holds it."""
+        if level == WRITE:
+            fcntl.lockf(self._file(), fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+        elif level == READ:
+            fcntl.lockf(self._file(), fcntl.LOCK_SH | fcntl.LOCK_NB, 1, slot)
+        else:
+            fcntl.lockf(self._file(), fcntl.LOCK_UN, 1, slot)
+
+    def _take(self, requests) -> bool:
+        with self._lock:
+            taken = []
+            for slot, need in self._needs(requests):
+                counts = self._counts.setdefault(slot, [0, 0])
+                before = self._level(counts)
+                counts[need - 1] += 1
+                taken.append((slot, need))
+                if self._level(counts) == before:
+                    continue
+                try:
+                    self._set(slot, self._level(counts))
+                except OSError:
+                    # held by another process; a failed upgrade keeps the read lock
+                    self._give_back(taken)
+                    return False
+            return True
+
+    def _give_back(self, needs):
+        for slot, need in needs:
+            counts = self._counts[slot]
+            before = self._level(counts)
+            counts[need - 1] -= 1
+            after = self._level(counts)
+            if counts == [0, 0]:
+                del self._counts[slot]
+            if after != before:
+                self._set(slot, after)  # an unlock or downgrade never waits
+
+    def acquire(self, requests, deadline: Optional[float]) -> bool:
+        pause = RETRY_WAIT[0]
+        while not self._take(requests):
+            if deadline is not None and time.monotonic() + pause > deadline:
+                return False
+            time.sleep(pause)
+            pause = min(pause * 2, RETRY_WAIT[1])
+        return True
+
+    def release(self, requests):
+        with self._lock:
+            self._give_back(self._needs(requests))
+
+
+class PathLockManager:
+    """
+    Hierarchical shared/exclusive locks keyed by path prefix.
+
+    Two locks conflict when one path is equal to or below the other and at
+    least one of them is exclusive, so disjoint subtrees never wait on each
+    other. Every call grants all of its keys at once or none of them; a caller
+    never holds some keys while waiting for others, so there is no lock
+    ordering to get wrong and no deadlock. Locks are not re-entrant: take them
+    once around the whole operation, not in recursive helpers.
+
+    Given a `directory`, the keys are also held between the processes of the
+    host (HostLocks): a thread is granted its keys in this process first, then
+    waits for them in the others.
+    """
+
+    def __init__(self, directory=None):
+        self._cond = threading.Condition()
+        # key -> [shared holders, exclusive holders] on exactly that key
+        self._held = {}
+        # prefix -> [shared holders, exclusive holders] on that key or anything below it
+        self._below = {}
+        self._host = HostLocks(directory) if directory is not None and fcntl is not None else None
+
+    def _conflicts(self, key: tuple, mode: str) -> bool:
+        for i in range(len(key)):
+            shared, exclusive = self._held.get(key[:i], (0, 0))
+            if exclusive or (mode == EXCLUSIVE and shared):
+                return True
+        shared, exclusive = self._below.get(key, (0, 0))
+        return bool(exclusive or (mode == EXCLUSIVE and shared))
+
+    def _update(self, key: tuple, mode: str, delta: int):
+        slot = 1 if mode == EXCLUSIVE else 0
+        counts = self._held.setdefault(key, [0, 0])
+        counts[slot] += delta
+        if counts == [0, 0]:
+            del self._held[key]
+        for i in range(len(key) + 1):
+            prefix = key[:i]
+            counts = self._below.setdefault(prefix, [0, 0])
+            counts[slot] += delta
+            if counts == [0, 0]:
+                del self._below[prefix]
+
+    def acquire(self, requests: list, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: not any(self._conflicts(key, mode) for key, mode in requests),
+                timeout,
+            )
+            if not ready:
+                return False
+            for key, mode in requests:
+                self._update(key, mode, 1)
+        if self._host is not None and not self._host.acquire(requests, deadline):
+            self._release_here(requests)
+            return False
+        return True
+
+    def release(self, requests: list):
+        if self._host is not None:
+            self._host.release(requests)
+        self._release_here(requests)
+
+    def _release_here(self, requests: list):
+        with self._cond:
+            for key, mode in requests:
+                self._update(key, mode, -1)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _requests(exclusive: Iterable = (), shared: Iterable = ()) -> list:
+        """Plain paths are converted with path_key(); tuples are used as-is."""
+        requests = {}
+        for mode, keys in ((SHARED, shared), (EXCLUSIVE, exclusive)):
+            for key in keys:
+                key = key if isinstance(key, tuple) else path_key(key)
+                # exclusive wins when the same key is asked for twice
+                if requests.get(key) != EXCLUSIVE:
+                    requests[key] = mode
+        return sorted(requests.items())
+
+    @contextmanager
+    def lock(self, exclusive: Iterable = (), shared: Iterable = (), timeout: Optional[float] = PATH_LOCK_TIMEOUT):
+        """with path_locks.lock(exclusive=[src_path, names_key(dest_path)]): ..."""
+        requests = self._requests(exclusive, shared)
+        if not self.acquire(requests, timeout):
+            raise HTTPException(409, BUSY)
+        try:
+            yield
+        finally:
+            self.release(requests)
+
+    @contextmanager
+    def lock_for(self, db: Session, keys: Callable, timeout: Optional[float] = PATH_LOCK_TIMEOUT):
+        """
+        Lock the paths returned by keys() -> (exclusive, shared), which reads them
+        from ORM records. A path can change while we wait (e.g. a parent got
+        renamed), so once granted the session snapshot is ended with a commit,
+        keys() is evaluated again and we retry until it is stable.
+        Callers must not have uncommitted changes in `db`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                requests = self._requests(*keys())
+            except ObjectDeletedError:
+                raise HTTPException(404, "File/Folder not found")
+
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not self.acquire(requests, remaining):
+                raise HTTPException(409, BUSY)
+
+            try:
+                db.commit()
+                current = self._requests(*keys())
+            except ObjectDeletedError:
+                self.release(requests)
+                raise HTTPException(404, "File/Folder not found")
+            except BaseException:
+                self.release(requests)
+                raise
+
+            if current == requests:
+                break
+            self.release(requests)
+
+        try:
+            yield
+        finally:
+            self.release(requests)
+
+
+path_locks = PathLockManager(PATH_LOCK_DIR)
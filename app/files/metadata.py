@@ -0,0 +1,481 @@
+"""
+Ingest-time metadata: the MIME type, SHA-256 and basic attributes of every
+file, kept in file_metadata so /files/properties is answered from the
+database without touching storage.
+
+Files are read once, in METADATA_WORKERS background threads per process:
+
+- file rows are queued when the transaction that adds them or rewrites
+  their contents commits (uploads, copies, restores of old RecycleBin
+  entries, disk syncs), at most METADATA_QUEUE_SIZE of them; past that they
+  wait for the next scan. A rewrite (a new size, codec or frame index)
+  deletes the old metadata in the same flush, and "Sync Disk to DB" does
+  the same for files whose stored object changed on disk (forget())
+- every METADATA_SCAN_INTERVAL seconds the files with no metadata, or
+  whose size changed since it was extracted, are queued as room allows
+
+Metadata is only current (fresh()) while the stored object still has the
+size and modification time it had when it was read, so contents rewritten
+at the same size are read again before their hash is trusted: by extract(),
+previews and upload negotiation, which links new files to stored contents
+by that hash.
+
+One pass over the (uncompressed) contents hashes them, counts lines and
+keeps the first HEAD_SIZE bytes, from which the type is sniffed and image
+dimensions or CSV columns are read:
+
+    image/png, image/jpeg, image/gif, image/bmp, image/webp  {"width", "height"}
+    text/csv, text/tab-separated-values                       {"rows", "columns", "lines"}
+    other text                                                {"lines", "encoding"}
+
+CSV rows are records (quoted line breaks don't end one), the header
+included. A file that can't be read gets a "failed" row and is not retried
+until its contents change; one missing from storage gets no row, so every scan
+looks for it again.
+"""
+import csv
+import hashlib
+import json
+import mimetypes
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import event, func, inspect, or_
+from sqlalchemy.exc import IntegrityError
+
+from app import models
+from app.config import METADATA_QUEUE_SIZE, METADATA_SCAN_INTERVAL, METADATA_WORKERS
+from app.database import SessionLocal
+from app.files.downloads import read_object
+from app.storage import compression, packs
+from app.storage.backends import storage
+from app.utils import metrics
+
+HEAD_SIZE = 64 * 1024  # bytes sniffed for the type and the image/CSV headers
+PENDING = "metadata_files"  # Session.info key: files added in the current transaction
+FORGET_BATCH = 1000  # ids per DELETE in forget()
+TRASH_PREFIX = "uploads/RecycleBin/"  # files.routes.TRASH_DIR: trashed files wait until restored
+
+SIGNATURES = [
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"BM", "image/bmp"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"(\xb5/\xfd", "application/zstd"),
+    (0, b"7z\xbc\xaf'\x1c", "application/x-7z-compressed"),
+    (0, b"Rar!\x1a\x07", "application/vnd.rar"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"OggS", "audio/ogg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"\x7fELF", "application/x-executable"),
+    (4, b"ftyp", "video/mp4"),
+]
+RIFF_TYPES = {b"WEBP": "image/webp", b"WAVE": "audio/wav", b"AVI ": "video/x-msvideo"}
+# zip based formats, told apart by their extension
+ZIP_SUFFIXES = {".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub", ".jar", ".apk"}
+CSV_TYPES = {"text/csv": None, "text/tab-separated-values": "\t"}
+TEXT_TYPES = {"application/json", "application/xml", "application/javascript", "application/x-sh", "application/sql"}
+
+
+#sniffing
+def sniff_type(filename: str, head: bytes) -> str:
+    guessed = mimetypes.guess_type(filename)[0]
+    for offset, magic, mime in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            if mime == "application/zip" and Path(filename).suffix.lower() in ZIP_SUFFIXES:
+                return guessed or mime
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] in RIFF_TYPES:
+        return RIFF_TYPES[head[8:12]]
+    if text_encoding(head):
+        if guessed and (guessed.startswith("text/") or guessed in TEXT_TYPES):
+            return guessed
+        return "text/plain"
+    return guessed or "application/octet-stream"
+
+
+def text_encoding(head: bytes):
+    """"utf-8" (or "utf-16" with a BOM) when `head` reads as text, else None."""
+    if head[:2] in (b"\xff\xfe", b"\xfe\xff"):
+        return "utf-16"
+    if b"\x00" in head:
+        return None
+    try:
+        # the head may end inside a character
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:
+            return None
+    return "utf-8"
+
+
+def image_size(mime: str, head: bytes):
+    """(width, height) from an image's header, None when it isn't in `head`."""
+    try:
+        if mime == "image/png" and head[12:16] == b"IHDR":
+            return struct.unpack(">II", head[16:24])
+        if mime == "image/gif":
+            return struct.unpack("<HH", head[6:10])
+        if mime == "image/bmp":
+            width, height = struct.unpack("<ii", head[18:26])
+            return width, abs(height)  # negative: stored top-down
+        if mime == "image/webp":
+            chunk = head[12:16]
+            if chunk == b"VP8X":
+                return 1 + int.from_bytes(head[24:27], "little"), 1 + int.from_bytes(head[27:30], "little")
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", head[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                bits = int.from_bytes(head[21:25], "little")
+                return 1 + (bits & 0x3FFF), 1 + ((bits >> 14) & 0x3FFF)
+        if mime == "image/jpeg":
+            return _jpeg_size(head)
+    except struct.error:
+        pass
+    return None
+
+
+def _jpeg_size(head: bytes):
+    position = 2
+    while position + 9 <= len(head):
+        if head[position] != 0xFF:
+            return None
+        marker = head[position + 1]
+        if marker == 0xFF:  # fill byte
+            position += 1
+            continue
+        # start of frame markers; C4, C8 and CC are other segments
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", head[position + 5:position + 9])
+            return width, height
+        position += 2 + struct.unpack(">H", head[position + 2:position + 4])[0]
+    return None
+
+
+def csv_columns(head: bytes, encoding: str, delimiter=None) -> int:
+    text = head.decode(encoding, errors="ignore")
+    first = text.splitlines()[0] if text else ""
+    if delimiter is None:
+        try:
+            delimiter = csv.Sniffer().sniff(text[:8192], delimiters=",;\t|").delimiter
+        except csv.Error:
+            delimiter = ","
+    return len(next(csv.reader([first], delimiter=delimiter), []))
+
+
+class Scan:
+    """The one pass over a file's contents: hash, size, line breaks and the head."""
+
+    def __init__(self, records: bool = False):
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = bytearray()
+        self.lines = 0
+        self.records = 0 if records else None  # line breaks outside double quotes, for CSV
+        self._quoted = False
+        self._last = b""
+
+    def feed(self, chunk: bytes):
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        if len(self.head) < HEAD_SIZE:
+            self.head += chunk[:HEAD_SIZE - len(self.head)]
+        self.lines += chunk.count(b"\n")
+        if self.records is None:
+            self._last = chunk[-1:]
+            return
+        # between every two quotes the state flips; "" inside a field flips it twice
+        for index, part in enumerate(chunk.split(b'"')):
+            if index:
+                self._quoted = not self._quoted
+            if not self._quoted:
+                self.records += part.count(b"\n")
+        self._last = chunk[-1:]
+
+    def line_count(self, breaks: int) -> int:
+        # a last line without a line break counts too
+        return breaks + (1 if self.size and self._last != b"\n" else 0)
+
+
+def analyse(filename: str, chunks) -> dict:
+    """The metadata columns for a file named `filename` with contents `chunks`."""
+    scan = Scan(records=mimetypes.guess_type(filename)[0] in CSV_TYPES)
+    for chunk in chunks:
+        scan.feed(chunk)
+    head = bytes(scan.head)
+    mime = sniff_type(filename, head)
+    attributes = {}
+    dimensions = image_size(mime, head)
+    if dimensions:
+        attributes.update(width=dimensions[0], height=dimensions[1])
+    encoding = text_encoding(head) if mime.startswith("text/") or mime in TEXT_TYPES else None
+    if encoding == "utf-8":
+        attributes.update(lines=scan.line_count(scan.lines), encoding=encoding)
+        if mime in CSV_TYPES and scan.records is not None:
+            attributes.update(rows=scan.line_count(scan.records), columns=csv_columns(head, encoding, CSV_TYPES[mime]))
+    elif encoding:
+        attributes["encoding"] = encoding
+    return {
+        "size": scan.size,
+        "mime_type": mime,
+        "sha256": scan.digest.hexdigest(),
+        "attributes": json.dumps(attributes) if attributes else None,
+    }
+
+
+#extraction
+CONTENT_COLUMNS = ("size", "codec", "frame_index")  # a change to any of them is new contents
+
+
+def fresh(meta, record, info) -> bool:
+    """
+    Whether `meta` was read from the contents `record` has now; `info` is
+    storage.stat() of them. A rewrite at the same size keeps the size, so the
+    stored object must also still have the size and time it had then.
+    """
+    if meta is None or info is None or meta.size != int(record.size or 0) or meta.stored_size != info.size:
+        return False
+    if packs.is_pack_key(record.storage_key):
+        return True  # never rewritten; the segment's time changes with every append
+    if meta.modified_at is None or not info.mtime:
+        return meta.modified_at is None and not info.mtime
+    # to the second: some databases keep no fractions
+    return abs(meta.modified_at.timestamp() - info.mtime) < 1
+
+
+def forget(db, file_ids):
+    """The contents of `file_ids` changed: drop their metadata; they are queued when the transaction commits."""
+    file_ids = list(file_ids)
+    for start in range(0, len(file_ids), FORGET_BATCH):
+        batch = file_ids[start:start + FORGET_BATCH]
+        db.query(models.FileMetadata).filter(models.FileMetadata.file_id.in_(batch)).delete(synchronize_session=False)
+    db.info.setdefault(PENDING, set()).update(file_ids)
+
+
+def extract(db, file_id: int) -> str:
+    """Read a file and store its metadata; returns "done", "failed", "missing" (not in storage) or "skipped"."""
+    record = db.get(models.FileModel, file_id)
+    if record is None or record.is_folder:
+        return "skipped"
+    current = db.get(models.FileMetadata, file_id)
+    key = record.storage_key or record.path
+    info = storage.stat(key)
+    if info is None:
+        # not written yet (the id layout commits the row first) or lost: the next scan looks again
+        return "missing"
+    if fresh(current, record, info):
+        return "skipped"  # taken over with the contents (upload negotiation) or extracted already
+    values = {
+        "status": "failed",
+        "size": int(record.size or 0),
+        # what fresh() compares, for failed reads too: they are tried again once the contents change
+        "stored_size": info.size,
+        "modified_at": datetime.fromtimestamp(info.mtime) if info.mtime else None,
+    }
+    try:
+        values.update(analyse(record.filename, read_object(key, compression.packed(record))), status="done")
+        path = storage.local_path(key)
+        if path is not None:
+            values["mode"] = os.stat(path).st_mode & 0o777
+    except OSError as e:
+        values["error"] = str(e)[:255]
+
+    row = current
+    if row is None:
+        row = models.FileMetadata(file_id=file_id)
+        db.add(row)
+    for column in ("mime_type", "sha256", "attributes", "stored_size", "mode", "modified_at", "error"):
+        setattr(row, column, values.get(column))
+    row.status, row.size, row.extracted_at = values["status"], values["size"], datetime.now()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()  # another process stored the same file first
+        return "skipped"
+    return values["status"]
+
+
+def taken_over(meta, file_id: int):
+    """A copy of `meta` for another file with the same contents."""
+    columns = ("status", "size", "mime_type", "sha256", "attributes", "stored_size", "mode", "modified_at", "error")
+    return models.FileMetadata(file_id=file_id, extracted_at=datetime.now(), **{c: getattr(meta, c) for c in columns})
+
+
+def stale(db, limit: int) -> list:
+    """Ids of up to `limit` files with no metadata, or with metadata from a different size."""
+    files, meta = models.FileModel, models.FileMetadata
+    rows = (
+        db.query(files.id)
+        .outerjoin(meta, meta.file_id == files.id)
+        .filter(
+            files.is_folder == False,
+            ~func.coalesce(files.path, "").startswith(TRASH_PREFIX, autoescape=True),
+            or_(meta.file_id == None, meta.size != func.coalesce(files.size, 0)),
+        )
+        .order_by(files.id)
+        .limit(limit)
+    )
+    return [file_id for (file_id,) in rows]
+
+
+class Extractor:
+    """A bounded queue of file ids, the threads working it and the periodic scan feeding it."""
+
+    def __init__(self, size: int = METADATA_QUEUE_SIZE):
+        self._queue = queue.Queue(size)
+        self._queued = set()  # ids in the queue or being extracted
+        self._again = set()  # ids submitted again while being extracted: their contents may have changed since
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def start(self, workers: int = METADATA_WORKERS, interval: float = METADATA_SCAN_INTERVAL):
+        if self._threads or workers <= 0:
+            return
+        self._stop.clear()
+        for number in range(workers):
+            thread = threading.Thread(target=self._work, name=f"metadata-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if interval > 0:
+            thread = threading.Thread(target=self._scan_loop, args=(interval,), name="metadata-scan", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def submit(self, file_ids) -> list:
+        """Queue `file_ids` as room allows; returns the ones that didn't fit."""
+        if not self.running:
+            return []
+        file_ids = list(file_ids)
+        for index, file_id in enumerate(file_ids):
+            with self._lock:
+                if file_id in self._queued:
+                    self._again.add(file_id)
+                    continue
+                try:
+                    self._queue.put_nowait(file_id)
+                except queue.Full:
+                    metrics.metadata_queue.set(self._queue.qsize())
+                    return file_ids[index:]
+                self._queued.add(file_id)
+        metrics.metadata_queue.set(self._queue.qsize())
+        return []
+
+    def scan(self) -> int:
+        """Queue files whose metadata is missing or out of date; returns how many were looked at."""
+        room = self._queue.maxsize - self._queue.qsize()
+        if room <= 0:
+            return 0
+        db = SessionLocal()
+        try:
+            # the ids already queued come back too; asking for that many more still fills the room
+            ids = stale(db, room + len(self._queued))
+        finally:
+            db.close()
+        self.submit(ids)
+        return len(ids)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                file_id = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            metrics.metadata_queue.set(self._queue.qsize())
+            started = time.perf_counter()
+            db = SessionLocal()
+            try:
+                result = extract(db, file_id)
+            except Exception as e:
+                db.rollback()
+                result = "failed"
+                print(f"Warning: metadata extraction of file {file_id} failed: {e}")
+            finally:
+                db.close()
+                with self._lock:
+                    self._queued.discard(file_id)
+                    again = file_id in self._again
+                    self._again.discard(file_id)
+                if again:
+                    self.submit([file_id])
+            metrics.metadata_extractions.inc(result=result)
+            metrics.metadata_extract_seconds.observe(time.perf_counter() - started)
+
+    def _scan_loop(self, interval: float):
+        # the first scan right away: it picks up what came in while the app was down
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"Warning: metadata scan failed: {e}")
+            self._stop.wait(interval)
+
+
+extractor = Extractor()
+
+
+#transaction hooks
+def _rewritten(record) -> bool:
+    state = inspect(record)
+    return any(state.attrs[column].history.has_changes() for column in CONTENT_COLUMNS)
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def _drop_rewritten(session, flush_context, instances):
+    # the old metadata describes the old contents; deleted in the same flush as the new ones land
+    ids = [
+        record.id for record in session.dirty
+        if isinstance(record, models.FileModel) and record.id is not None and not record.is_folder and _rewritten(record)
+    ]
+    if ids:
+        with session.no_autoflush:
+            for meta in session.query(models.FileMetadata).filter(models.FileMetadata.file_id.in_(ids)):
+                session.delete(meta)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _note_new_files(session, flush_context):
+    # new rows, and rows whose contents were (re)written: in the id layout the row is committed before its data
+    ids = [
+        record.id for record in session.new | session.dirty
+        if isinstance(record, models.FileModel) and not record.is_folder
+        and (record in session.new or _rewritten(record))
+    ]
+    if ids:
+        session.info.setdefault(PENDING, set()).update(ids)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _queue_committed(session):
+    ids = session.info.pop(PENDING, None)
+    if ids:
+        left = extractor.submit(sorted(ids))
+        if left:
+            metrics.metadata_deferred.inc(len(left))
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop(PENDING, None)
@@ -0,0 +1,248 @@
+"""
+Previews for GET /files/preview/{file_id}: the first lines of text and CSV
+files and thumbnails of images, so the UI doesn't download whole files to
+show them.
+
+A preview is made on its first request, in a pool of PREVIEW_WORKERS
+processes that read the file from storage themselves, and written to
+PREVIEW_CACHE_DIR under the file's SHA-256 (from app.files.metadata) and the
+preview's parameters. Copies and renames share it, and new contents get a new
+key, so nothing is ever invalidated. Requests for a preview already being made
+wait for it instead of making it again (per process; two workers may both
+make one, and the later rename wins).
+
+The cache stays under PREVIEW_CACHE_SIZE bytes: past it, the least recently
+served previews are deleted (a hit touches the file's mtime). Thumbnails
+need Pillow (pip install Pillow); without it image previews are 501.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import (
+    PREVIEW_CACHE_DIR,
+    PREVIEW_CACHE_SIZE,
+    PREVIEW_MAX_SOURCE,
+    PREVIEW_WORKERS,
+)
+from app.files.downloads import read_object
+from app.utils import metrics
+
+TEXT, IMAGE = "text", "image"
+THUMBNAIL_SIZES = (64, 128, 256, 512, 1024)  # requested sizes are rounded up to one of these
+MAX_TEXT_BYTES = 1024 * 1024  # a text preview stops here even with fewer lines
+EVICT_TO = 0.9  # share of PREVIEW_CACHE_SIZE left after an eviction
+THUMBNAIL_TYPES = {"image/png", "image/jpeg", "image/gif", "image/bmp", "image/webp", "image/tiff"}
+TEXT_TYPES = {"application/json", "application/xml", "application/javascript", "application/x-sh", "application/sql"}
+
+Spec = namedtuple("Spec", ["kind", "param", "media_type", "suffix"])
+
+
+def spec_for(mime: str, lines: int, size: int) -> Spec:
+    """What preview a file of type `mime` gets; 415 when it has none."""
+    if mime in THUMBNAIL_TYPES:
+        size = next((s for s in THUMBNAIL_SIZES if s >= size), THUMBNAIL_SIZES[-1])
+        # PNG where there may be transparency, JPEG for the rest
+        if mime in ("image/png", "image/gif", "image/webp"):
+            return Spec(IMAGE, size, "image/png", ".png")
+        return Spec(IMAGE, size, "image/jpeg", ".jpg")
+    if mime.startswith("text/") or mime in TEXT_TYPES:
+        media_type = "text/csv" if mime == "text/csv" else "text/plain"
+        return Spec(TEXT, lines, f"{media_type}; charset=utf-8", ".txt")
+    raise HTTPException(415, f"No preview for files of type {mime}")
+
+
+def cache_path(sha256: str, spec: Spec) -> Path:
+    return PREVIEW_CACHE_DIR / sha256[:2] / f"{sha256}-{spec.kind}{spec.param}{spec.suffix}"
+
+
+#making previews (in the pool's processes)
+def _text_preview(chunks, lines: int) -> bytes:
+    kept = bytearray()
+    for chunk in chunks:
+        kept += chunk
+        if kept.count(b"\n") >= lines or len(kept) >= MAX_TEXT_BYTES:
+            break
+    kept = b"".join(kept.splitlines(keepends=True)[:lines])[:MAX_TEXT_BYTES]
+    # cut on a character boundary
+    return kept.decode("utf-8", errors="ignore").encode("utf-8")
+
+
+def _thumbnail(chunks, size: int, suffix: str) -> bytes:
+    import io
+
+    from PIL import Image
+
+    source = io.BytesIO()
+    for chunk in chunks:
+        source.write(chunk)
+        if source.tell() > PREVIEW_MAX_SOURCE:
+            raise ValueError(f"images over {PREVIEW_MAX_SOURCE:,} bytes are not thumbnailed")
+    source.seek(0)
+    with Image.open(source) as image:
+        image.draft("RGB", (size, size))  # JPEG: decode at a fraction of the size already
+        image.thumbnail((size, size))
+        out = io.BytesIO()
+        if suffix == ".png":
+            image.save(out, "PNG", optimize=True)
+        else:
+            image.convert("RGB").save(out, "JPEG", quality=80)
+    return out.getvalue()
+
+
+def make(key: str, packed, spec: Spec, path: str) -> int:
+    """Write the preview `spec` of the stored object `key` to `path`; returns its size."""
+    chunks = read_object(key, packed)
+    data = _text_preview(chunks, spec.param) if spec.kind == TEXT else _thumbnail(chunks, spec.param, spec.suffix)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temporary.write_bytes(data)
+    os.replace(temporary, path)
+    return len(data)
+
+
+def _served(path: Path) -> bytes:
+    os.utime(path)  # most recently served: evicted last
+    return path.read_bytes()
+
+
+def _pillow_available() -> bool:
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class Previews:
+    """The process pool, the previews being made and the size of the disk cache."""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._pool = None
+        self._making = {}  # cache path -> Future of the process making it
+        self._bytes = None  # on disk, as last counted plus what was added since
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawned: forking a process with threads running can copy held locks
+            context = multiprocessing.get_context("spawn")
+            self._pool = ProcessPoolExecutor(max(PREVIEW_WORKERS, 1), mp_context=context)
+        return self._pool
+
+    def stop(self, pool=None):
+        """Shut the pool down (only if it is still `pool`, when given)."""
+        with self._lock:
+            if pool is not None and pool is not self._pool:
+                return
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def get(self, key: str, packed, sha256: str, spec: Spec) -> bytes:
+        """The preview, from the cache or made first."""
+        path = cache_path(sha256, spec)
+        try:
+            data = await run_in_threadpool(_served, path)
+            metrics.preview_requests.inc(kind=spec.kind, result="hit")
+            return data
+        except FileNotFoundError:
+            pass
+        if spec.kind == IMAGE and not _pillow_available():
+            raise HTTPException(501, "Thumbnails need Pillow: pip install Pillow")
+
+        with self._lock:
+            making = self._making.get(path)
+            if making is None:
+                pool = self._executor()
+                making = self._making[path] = (pool.submit(make, key, packed, spec, str(path)), pool)
+                result = "miss"
+            else:
+                result = "coalesced"
+        future, pool = making
+        if result == "miss":
+            started = time.perf_counter()
+            future.add_done_callback(lambda done: self._made(path, spec, started, done))
+        metrics.preview_requests.inc(kind=spec.kind, result=result)
+        try:
+            await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            # a worker died (out of memory, a crashing decoder): the next request starts a new pool
+            self.stop(pool)
+            raise HTTPException(500, "Preview failed")
+        except Exception as e:
+            # unreadable or oversized images, objects gone from storage
+            raise HTTPException(422, f"Preview failed: {e}")
+        return await run_in_threadpool(path.read_bytes)
+
+    def _made(self, path: Path, spec: Spec, started: float, future):
+        with self._lock:
+            self._making.pop(path, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        metrics.preview_seconds.observe(time.perf_counter() - started, kind=spec.kind)
+        self._account(future.result())
+
+    #eviction
+    def _account(self, added: int):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._count()[0]
+            else:
+                self._bytes += added
+            over = self._bytes > self.max_bytes
+        if over:
+            self.evict()
+        metrics.preview_cache_bytes.set(self._bytes)
+
+    def _count(self):
+        """(bytes, [(mtime, size, path)]) of the previews on disk."""
+        entries, total = [], 0
+        if not self.directory.is_dir():
+            return 0, entries
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    continue  # being written
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        return total, entries
+
+    def evict(self) -> int:
+        """Delete the least recently served previews until the cache is back under EVICT_TO of its size."""
+        total, entries = self._count()
+        deleted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            deleted += 1
+        with self._lock:
+            self._bytes = total
+        metrics.preview_evictions.inc(deleted)
+        return deleted
+
+
+preview_cache = Previews(PREVIEW_CACHE_DIR, PREVIEW_CACHE_SIZE)
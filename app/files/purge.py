@@ -0,0 +1,151 @@
+"""
+RecycleBin retention: items deleted more than RECYCLE_RETENTION_DAYS ago
+are deleted for good.
+
+    python -m app.files.purge            # one pass
+    python -m app.files.purge --loop     # every PURGE_INTERVAL seconds
+
+A pass deletes the expired items PURGE_BATCH at a time, one transaction and
+one batched storage delete per batch, and sleeps between batches so that no
+more than PURGE_RATE bytes a second are deleted; folder trees are removed
+in the purging thread, never in a request. The app runs passes in a
+background thread; the "purge_recycle_bin" job runs one on demand.
+"""
+import argparse
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+
+from app import models
+from app.config import PURGE_BATCH, PURGE_INTERVAL, PURGE_RATE, RECYCLE_RETENTION_DAYS
+from app.database import SessionLocal
+from app.files import routes as file_routes
+from app.files.locks import path_locks
+from app.utils import metrics
+
+
+def purge_expired(
+    db,
+    retention_days: float = RECYCLE_RETENTION_DAYS,
+    batch_size: int = PURGE_BATCH,
+    rate: int = PURGE_RATE,
+    stop: threading.Event = None,
+    progress=None,
+) -> dict:
+    """Delete RecycleBin items older than `retention_days`; returns counts and reclaimed bytes."""
+    counts = {"items": 0, "bytes": 0, "errors": 0, "batches": 0}
+    if retention_days <= 0:
+        return counts
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    stop = stop or threading.Event()
+
+    last_id = 0
+    while not stop.is_set():
+        items = (
+            db.query(models.RecycleBin)
+            .filter(models.RecycleBin.deleted_at < cutoff, models.RecycleBin.id > last_id)
+            .order_by(models.RecycleBin.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not items:
+            break
+        last_id = items[-1].id
+
+        started = time.monotonic()
+        try:
+            with path_locks.lock_for(db, lambda: ([item.path for item in items], [])):
+                results = file_routes.purge_recycle_items(items, db)
+                db.commit()
+        except HTTPException as e:
+            # busy or already gone: the items are still expired on the next pass
+            db.rollback()
+            counts["errors"] += len(items)
+            print(f"Warning: RecycleBin purge skipped {len(items)} items: {e.detail}")
+            continue
+
+        deleted = [item for item in items if results[item.id]["status"] == "deleted"]
+        size = sum(int(item.size or 0) for item in deleted)
+        counts["items"] += len(deleted)
+        counts["bytes"] += size
+        counts["errors"] += len(items) - len(deleted)
+        counts["batches"] += 1
+        metrics.purged_items.inc(len(deleted))
+        metrics.purged_bytes.inc(size)
+        if progress:
+            progress(len(items), size)
+
+        # bounded bandwidth: the batch may not take less than size / rate seconds
+        if rate > 0:
+            pause = size / rate - (time.monotonic() - started)
+            if pause > 0:
+                stop.wait(pause)
+    return counts
+
+
+class Purger:
+    """Runs purge_expired() in a background thread every `interval` seconds."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, interval: float = PURGE_INTERVAL):
+        if self._thread is not None or interval <= 0 or RECYCLE_RETENTION_DAYS <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="recycle-purger", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self, interval: float):
+        while not self._stop.wait(interval):
+            db = SessionLocal()
+            try:
+                counts = purge_expired(db, stop=self._stop)
+                if counts["items"] or counts["errors"]:
+                    print(f"RecycleBin purge: {counts}")
+            except Exception as e:
+                db.rollback()
+                print(f"Warning: RecycleBin purge failed: {e}")
+            finally:
+                db.close()
+
+
+purger = Purger()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loop", action="store_true", help="keep running, a pass every --interval seconds")
+    parser.add_argument("--interval", type=float, default=PURGE_INTERVAL or 600)
+    parser.add_argument("--days", type=float, default=RECYCLE_RETENTION_DAYS, help="retention in days")
+    args = parser.parse_args()
+
+    while True:
+        started = time.monotonic()
+        db = SessionLocal()
+        try:
+            counts = purge_expired(db, args.days)
+        finally:
+            db.close()
+        print(
+            f"{counts['items']:,} items purged in {counts['batches']} batches, "
+            f"{counts['bytes'] / 1024 / 1024:,.1f} MB reclaimed, {counts['errors']} failed "
+            f"in {time.monotonic() - started:.2f}s"
+        )
+        if not args.loop:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
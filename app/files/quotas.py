@@ -0,0 +1,201 @@
+"""
+Per-user storage quotas.
+
+Usage is a counter on the user row (User.used_bytes): the bytes of the
+files a user owns, RecycleBin included, changed by an UPDATE ... SET
+used_bytes = used_bytes + n in the same transaction as the rows it
+accounts for. Charges that have a quota to respect are conditional updates
+(... WHERE used_bytes + n <= quota), so concurrent uploads can't overshoot.
+
+A user's quota is User.quota_bytes, or ROLE_QUOTAS for its role when that
+is NULL; 0 or no entry means unlimited. Over-quota writes fail with 507.
+
+Uploads are refused before their body is read when the Content-Length is
+already over the remaining quota (see precheck_upload), and cut off as soon
+as the streamed bytes go over it. The counters can drift (crashes between
+storage and commit, rows edited by hand), so reconcile() recomputes them in
+batches; the app runs it every QUOTA_RECONCILE_INTERVAL seconds and it is
+also the "reconcile_quotas" job.
+"""
+import threading
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from jose import JWTError, jwt
+from sqlalchemy import func, update
+
+from app import models
+from app.config import (
+    ALGORITHM,
+    QUOTA_RECONCILE_BATCH,
+    QUOTA_RECONCILE_INTERVAL,
+    ROLE_QUOTAS,
+    SECRET_KEY,
+)
+from app.database import SessionLocal
+
+INSUFFICIENT_STORAGE = 507
+UPLOAD_PATHS = {"/files/upload"}  # routes whose request body becomes stored files
+MULTIPART_SLACK = 64 * 1024  # boundaries and part headers counted in an upload's Content-Length
+
+
+def quota_for(user: models.User) -> Optional[int]:
+    """The user's quota in bytes, None when unlimited."""
+    quota = user.quota_bytes if user.quota_bytes is not None else ROLE_QUOTAS.get(user.role, 0)
+    return quota or None
+
+
+def remaining(user: models.User) -> Optional[int]:
+    quota = quota_for(user)
+    return None if quota is None else max(quota - (user.used_bytes or 0), 0)
+
+
+def exceeded(user: models.User, size: int) -> HTTPException:
+    return HTTPException(
+        INSUFFICIENT_STORAGE,
+        f"Storage quota exceeded: {size:,} bytes more would go over the {quota_for(user):,} byte quota "
+        f"({user.used_bytes or 0:,} used)",
+    )
+
+
+def adjust(db, user_id: Optional[int], delta):
+    """Change a user's usage by `delta` bytes, without a quota check (frees, transfers, sync)."""
+    delta = int(delta or 0)
+    if user_id is None or not delta:
+        return
+    db.execute(update(models.User).where(models.User.id == user_id).values(used_bytes=models.User.used_bytes + delta))
+
+
+def charge(db, user_id: Optional[int], size):
+    """Add `size` bytes to a user's usage; 507 when that would go over the quota."""
+    size = int(size or 0)
+    if user_id is None or size <= 0:
+        return adjust(db, user_id, size)
+    user = db.get(models.User, user_id)
+    quota = quota_for(user) if user else None
+    statement = update(models.User).where(models.User.id == user_id).values(used_bytes=models.User.used_bytes + size)
+    if quota is not None:
+        statement = statement.where(models.User.used_bytes + size <= quota)
+    if db.execute(statement).rowcount == 0 and quota is not None:
+        db.refresh(user)
+        raise exceeded(user, size)
+
+
+def limited(db, user_id: Optional[int], chunks):
+    """Pass `chunks` through, failing with 507 once they are more than the user has left."""
+    user = db.get(models.User, user_id) if user_id is not None else None
+    left = remaining(user) if user else None
+    if left is None:
+        yield from chunks
+        return
+    received = 0
+    for chunk in chunks:
+        received += len(chunk)
+        if received > left:
+            raise exceeded(user, received)
+        yield chunk
+
+
+#early rejection
+def precheck_upload(method: str, path: str, headers) -> Optional[JSONResponse]:
+    """A 507 for an upload whose Content-Length alone is over the sender's remaining quota."""
+    if method != "POST" or path not in UPLOAD_PATHS:
+        return None
+    length = headers.get("content-length")
+    scheme, _, token = (headers.get("authorization") or "").partition(" ")
+    if not length or not length.isdigit() or scheme.lower() != "bearer":
+        return None
+    try:
+        username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None  # the route answers 401 itself
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        left = remaining(user) if user else None
+        if left is None or int(length) <= left + MULTIPART_SLACK:
+            return None
+        error = exceeded(user, int(length))
+        return JSONResponse({"detail": error.detail}, status_code=error.status_code)
+    finally:
+        db.close()
+
+
+#reconciliation
+def actual_usage(db, user_ids) -> dict:
+    usage = dict.fromkeys(user_ids, 0)
+    files = db.query(models.FileModel.uploaded_by_id, func.coalesce(func.sum(models.FileModel.size), 0)).filter(
+        models.FileModel.uploaded_by_id.in_(user_ids), models.FileModel.is_folder == False
+    ).group_by(models.FileModel.uploaded_by_id)
+    # trashed files keep their rows; only entries from before the central trash live in RecycleBin alone
+    binned = db.query(models.RecycleBin.owner_id, func.coalesce(func.sum(models.RecycleBin.size), 0)).filter(
+        models.RecycleBin.owner_id.in_(user_ids), models.RecycleBin.is_folder == False, models.RecycleBin.file_id == None
+    ).group_by(models.RecycleBin.owner_id)
+    for user_id, size in list(files) + list(binned):
+        usage[user_id] += int(size)
+    return usage
+
+
+def reconcile(db, batch_size: int = QUOTA_RECONCILE_BATCH, progress=None) -> dict:
+    """Recompute every user's used_bytes, a batch of users per transaction; returns what was corrected."""
+    counts = {"users": 0, "corrected": 0, "drift_bytes": 0}
+    last_id = 0
+    while True:
+        # locked while their usage is summed, so charges of this batch wait for the correction
+        users = (
+            db.query(models.User).filter(models.User.id > last_id).order_by(models.User.id)
+            .limit(batch_size).with_for_update().all()
+        )
+        if not users:
+            break
+        last_id = users[-1].id
+        usage = actual_usage(db, [user.id for user in users])
+        for user in users:
+            drift = usage[user.id] - (user.used_bytes or 0)
+            if drift:
+                user.used_bytes = usage[user.id]
+                counts["corrected"] += 1
+                counts["drift_bytes"] += abs(drift)
+        db.commit()
+        counts["users"] += len(users)
+        if progress:
+            progress(len(users))
+    return counts
+
+
+class Reconciler:
+    """Runs reconcile() in a background thread every `interval` seconds."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, interval: float = QUOTA_RECONCILE_INTERVAL):
+        if self._thread is not None or interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="quota-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self, interval: float):
+        while not self._stop.wait(interval):
+            db = SessionLocal()
+            try:
+                counts = reconcile(db)
+                if counts["corrected"]:
+                    print(f"Quota reconciliation: {counts}")
+            except Exception as e:
+                db.rollback()
+                print(f"Warning: quota reconciliation failed: {e}")
+            finally:
+                db.close()
+
+
+reconciler = Reconciler()
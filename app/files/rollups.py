@@ -0,0 +1,122 @@
+"""
+Per-folder rollups: the bytes, files and subfolders below a folder.
+
+    python -m app.files.rollups      # rebuild every folder's rollup
+
+Every folder row carries tree_size, file_count and folder_count for its
+whole subtree. A mutation changes them with one UPDATE ... SET col = col + n
+over the ancestor chain of the rows it adds or removes, in the same
+transaction, so properties and listings read folder sizes without walking
+anything. rebuild() recomputes them from the rows in one pass, for data
+written around the app (sync scripts, manual edits).
+"""
+import sys
+import time
+from collections import namedtuple
+
+from sqlalchemy import update
+
+from app import models
+from app.database import SessionLocal
+from app.files import versions
+
+REBUILD_BATCH = 1000  # folders per UPDATE statement in rebuild()
+
+Rollup = namedtuple("Rollup", ["size", "files", "folders"])
+
+
+def own(record) -> Rollup:
+    """What a single row adds to the folders above it, not counting anything below it."""
+    return Rollup(0, 0, 1) if record.is_folder else Rollup(int(record.size or 0), 1, 0)
+
+
+def subtree(record) -> Rollup:
+    """What a row and everything below it add to the folders above it."""
+    if not record.is_folder:
+        return own(record)
+    return Rollup(int(record.tree_size or 0), record.file_count or 0, (record.folder_count or 0) + 1)
+
+
+def ancestors(db, parent_id) -> list:
+    """Ids of the folder `parent_id` and every folder above it."""
+    ids = []
+    while parent_id is not None and parent_id not in ids:
+        ids.append(parent_id)
+        # parents are usually in the session already, so this rarely queries
+        parent = db.get(models.FileModel, parent_id)
+        parent_id = parent.parent_id if parent else None
+    return ids
+
+
+def apply(db, parent_id, rollup: Rollup, sign: int = 1):
+    """Add (sign=1) or remove (sign=-1) `rollup` on the chain of folders from `parent_id` up."""
+    if parent_id is None or not any(rollup):
+        return
+    ids = ancestors(db, parent_id)
+    # every listing on the way up shows a changed folder size; the top level's
+    # version is read from its folders' versions, so no shared row is written here
+    db.execute(
+        update(models.FileModel).where(models.FileModel.id.in_(ids)).values(
+            tree_size=models.FileModel.tree_size + sign * rollup.size,
+            file_count=models.FileModel.file_count + sign * rollup.files,
+            folder_count=models.FileModel.folder_count + sign * rollup.folders,
+            version=models.FileModel.version + 1,
+        )
+    )
+
+
+def added(db, record):
+    """`record` (with its subtree) now sits below record.parent_id."""
+    apply(db, record.parent_id, subtree(record))
+
+
+def removed(db, record, parent_id=None):
+    """`record` (with its subtree) no longer sits below `parent_id` (default: its parent)."""
+    apply(db, record.parent_id if parent_id is None else parent_id, subtree(record), -1)
+
+
+#bulk rebuild
+def rebuild(db) -> dict:
+    """Recompute every folder's rollup from the rows; returns how many were changed."""
+    rows = db.query(
+        models.FileModel.id, models.FileModel.parent_id, models.FileModel.is_folder, models.FileModel.size,
+        models.FileModel.tree_size, models.FileModel.file_count, models.FileModel.folder_count,
+    ).all()
+    parents = {row.id: row.parent_id for row in rows}
+    sums = {row.id: [0, 0, 0] for row in rows if row.is_folder}
+
+    for row in rows:
+        contribution = own(row)
+        parent_id, seen = row.parent_id, set()
+        while parent_id in sums and parent_id not in seen:
+            seen.add(parent_id)
+            for i, value in enumerate(contribution):
+                sums[parent_id][i] += value
+            parent_id = parents.get(parent_id)
+
+    current = {row.id: [int(row.tree_size or 0), row.file_count or 0, row.folder_count or 0] for row in rows if row.is_folder}
+    changed = [
+        {"id": folder_id, "tree_size": size, "file_count": files, "folder_count": folders}
+        for folder_id, (size, files, folders) in sums.items()
+        if current[folder_id] != [size, files, folders]
+    ]
+    for start in range(0, len(changed), REBUILD_BATCH):
+        db.execute(update(models.FileModel), changed[start:start + REBUILD_BATCH])
+    # the listings showing the corrected folders
+    versions.bump(db, {parents[row["id"]] for row in changed})
+    db.commit()
+    return {"folders": len(sums), "corrected": len(changed)}
+
+
+def main():
+    db = SessionLocal()
+    try:
+        started = time.monotonic()
+        counts = rebuild(db)
+        print(f"{counts['folders']:,} folders, {counts['corrected']:,} corrected in {time.monotonic() - started:.2f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,32 @@
+import json
 import os
 import shutil
-import tempfile
 import threading
 from typing import List, Optional
 from datetime import datetime
 from pathlib import Path
 
-from fastapi import APIRouter, BackgroundTasks, Depends, File, Form, HTTPException, Query, UploadFile
-from fastapi.responses import FileResponse
-from sqlalchemy import func, null
+from fastapi import APIRouter, BackgroundTasks, Depends, File, Form, HTTPException, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy import String, func, literal, null, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from app.config import PACK_THRESHOLD, PREVIEW_LINES, PREVIEW_MAX_LINES, PREVIEW_SIZE
 from app.database import get_db
 from app.auth.utils import get_current_user, role_required
 from app import models
-from app.files import utils
+from app.changes import feed as changes
+from app.files import downloads, metadata, quotas, rollups, tree, utils, versions
+from app.files.listing_cache import cached_response, listing_cache
+from app.files.locks import names_key, path_locks
+from app.files.previews import THUMBNAIL_SIZES, preview_cache, spec_for
+from app.storage import compression, layout, packs
+from app.storage.backends import storage
+from app.storage.base import CHUNK_SIZE, ObjectStat, child_key, normalize_key, rebase
+from app.utils import metrics
+from app.utils.profiler import ProfiledRoute
 from pydantic import BaseModel
 from sqlalchemy.orm import joinedload
 from watchdog.observers import Observer
@@ -22,9 +34,9 @@ from watchdog.events import FileSystemEventHandler
 import time
 
 
-from app.schemas import CopyRequest
+from app.schemas import BulkStarRequest, CopyRequest, DeleteRequest, DownloadRequest, FolderResponse, PermanentDeleteRequest, RestoreRequest, UploadNegotiation
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
  
 #uploads directory (it change as per client needs) 
 UPLOAD_DIR = Path("uploads")
@@ -147,6 +159,217 @@ def get_folder_full_path(folder: models.FileModel):
         parent = parent.parent
     return UPLOAD_DIR.joinpath(*parts)
 
+#storage keys
+def record_key(record) -> str:
+    """Key of a file's/folder's contents in the storage backend."""
+    if record.storage_key:
+        return record.storage_key
+    if record.path:
+        return normalize_key(record.path)
+    if record.is_folder:
+        return get_folder_full_path(record).as_posix()
+    return (UPLOAD_DIR / record.filename).as_posix()
+
+def tree_keys(db: Session, folder_path: Optional[str] = None):
+    """Keys of the tree-layout files below a folder for backends that can't list one; None lets the backend list."""
+    if storage.can_list:
+        return None
+    if folder_path is None:
+        return []
+    return [path for (path,) in db.query(models.FileModel.path).filter(
+        models.FileModel.path.startswith(f"{normalize_key(folder_path)}/", autoescape=True),
+        models.FileModel.storage_key == None,
+        models.FileModel.is_folder == False,
+    )]
+
+def stored(key: str, is_folder: bool) -> bool:
+    """Whether the backend has `key`; folders always exist when they needn't be stored."""
+    return (is_folder and (layout.BY_ID or not storage.has_folders)) or storage.exists(key)
+
+def move_tree_contents(src: str, dst: str, db: Session):
+    """Move what the tree layout keeps below folder `src`; id-layout files are not affected."""
+    if not storage.has_folders:
+        storage.move_tree(src, dst, tree_keys(db, src))
+    elif storage.exists(src):
+        storage.move_tree(src, dst)
+
+def moved_back(src: str, dst: str, is_folder: bool, db: Session):
+    """
+    An undo step for what was just moved from `src` to `dst` in storage: moves
+    it back, to be run by undo_storage() once the rows are back at `src`.
+    """
+    def step():
+        if not is_folder:
+            storage.move(dst, src)
+        elif not storage.has_folders:
+            keys = tree_keys(db, src)
+            storage.move_tree(dst, src, keys and [rebase(key, src, dst) for key in keys])
+        elif storage.exists(dst):
+            storage.move_tree(dst, src)
+    return step
+
+def undo_storage(undo: list):
+    """Run the undo steps of an operation whose rows were rolled back, newest first."""
+    while undo:
+        step = undo.pop()
+        try:
+            step()
+        except Exception as e:
+            print(f"Warning: a storage change was not undone: {e}")
+
+def relocate(record, new_path: str, db: Session):
+    """Storage side of moving/renaming `record` to `new_path`; nothing to do for id-layout files."""
+    if record.storage_key:
+        return
+    old_path = record_key(record)
+    if record.is_folder:
+        move_tree_contents(old_path, new_path, db)
+    elif not storage.exists(old_path):
+        return
+    elif layout.BY_ID:
+        # a tree-layout file moves to its id key the first time it is touched
+        layout.assign_key(record)
+        storage.move(old_path, record.storage_key)
+    else:
+        storage.move(old_path, new_path)
+
+def taken_names(folder_id: Optional[int], key: str, db: Session) -> set:
+    """Names already used in a folder: by rows, and in the tree layout by what is on disk."""
+    names = {name for (name,) in live_files(db).with_entities(models.FileModel.filename).filter(models.FileModel.parent_id == folder_id)}
+    if storage.can_list and not layout.BY_ID:
+        names.update(entry.key.rpartition("/")[2] for entry in storage.list(key, recursive=False))
+    return names
+
+def content_fields(record) -> dict:
+    """Columns describing how a file's contents are stored, for the rows that take them over."""
+    return {"codec": record.codec, "frame_index": record.frame_index}
+
+#trash: deleted subtrees keep their rows, under TRASH_DIR/<recycle id>/<name>
+TRASH_DIR = UPLOAD_DIR / "RecycleBin"
+
+def trash_key(recycle_item) -> str:
+    return child_key(child_key(TRASH_DIR.as_posix(), str(recycle_item.id)), recycle_item.filename)
+
+def in_trash(record) -> bool:
+    return normalize_key(record.path or "").startswith(f"{TRASH_DIR.as_posix()}/")
+
+def live_files(db: Session):
+    """FileModel rows that are not in the trash."""
+    return db.query(models.FileModel).filter(
+        ~func.coalesce(models.FileModel.path, "").startswith(f"{TRASH_DIR.as_posix()}/", autoescape=True)
+    )
+
+def rebase_paths(db: Session, old: str, new: str):
+    """Point the paths of the row at `old` and of everything below it at `new`, in one UPDATE."""
+    versions.bump_tree(db, old)
+    db.execute(
+        update(models.FileModel)
+        .where((models.FileModel.path == old) | models.FileModel.path.startswith(f"{old}/", autoescape=True))
+        .values(path=literal(new, String).concat(func.substr(models.FileModel.path, len(old) + 1))),
+        execution_options={"synchronize_session": "fetch"},
+    )
+
+def listing_changed(db: Session, type: str, record, old_folder_id=None):
+    """`record` was created, renamed, moved, deleted or (un)starred: bump the listing versions, tell the change feed."""
+    changes.record(db, type, record, old_folder_id)
+    versions.bump(db, [record.parent_id, old_folder_id] if type == "move" else [record.parent_id])
+
+def listed_size(record) -> dict:
+    """Size fields of a listing entry; a folder's are its rollup."""
+    if not record.is_folder:
+        return {"size": record.size}
+    return {"size": record.tree_size, "file_count": record.file_count, "folder_count": record.folder_count}
+
+def store_new_file(record, chunks, db: Session) -> int:
+    """Write a new file's contents and commit its row; in the id layout the row comes first, for its id."""
+    # over the uploader's quota: stops reading as soon as the bytes are more than is left
+    chunks = quotas.limited(db, record.uploaded_by_id, chunks)
+
+    def commit_charged(key, committed=False):
+        try:
+            rollups.added(db, record)
+            quotas.charge(db, record.uploaded_by_id, record.size)
+            listing_changed(db, "create", record)
+            db.commit()
+        except (HTTPException, IntegrityError) as e:
+            # someone else's upload got the space, or the name, first
+            db.rollback()
+            if committed:
+                db.delete(record)
+                db.commit()
+            # a tree-layout key is the winner's path then, holding its contents
+            if not packs.is_pack_key(key) and (record.storage_key or isinstance(e, HTTPException)):
+                storage.delete(key)
+            if isinstance(e, IntegrityError):
+                raise HTTPException(409, f"'{record.filename}' already exists in this folder")
+            raise
+
+    if PACK_THRESHOLD:
+        small, chunks = packs.read_small(chunks, PACK_THRESHOLD)
+        if small is not None:
+            # appended to a pack segment: the key alone locates it, in either layout
+            record.storage_key = storage.packs.append(small)
+            record.size = len(small)
+            db.add(record)
+            commit_charged(record.storage_key)
+            return record.size
+
+    chunks, packer = compression.pack(record.filename, chunks)
+
+    def put(key):
+        size = storage.put_stream(key, chunks)
+        record.size = packer.size if packer else size
+        if packer:
+            record.codec, record.frame_index = packer.codec, packer.index()
+
+    if not layout.BY_ID:
+        put(record.path)
+        db.add(record)
+        commit_charged(record.path)
+        return record.size
+
+    db.add(record)
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(409, f"'{record.filename}' already exists in this folder")
+    layout.assign_key(record)
+    db.commit()
+    try:
+        put(record.storage_key)
+    except BaseException:
+        db.delete(record)
+        db.commit()
+        raise
+    commit_charged(record.storage_key, committed=True)
+    # queued when the row was committed, maybe read before its data was there
+    metadata.extractor.submit([record.id])
+    return record.size
+
+def zip_members(folder, db: Session) -> list:
+    """(name in the archive, ObjectStat, Packed or None) for everything stored below a folder."""
+    prefix = utils.get_folder_full_path(folder).as_posix()
+    # rows the physical tree can't tell about: compressed files, and id-layout files, which
+    # are not below the folder's path at all
+    special = db.query(models.FileModel).filter(
+        models.FileModel.path.startswith(f"{prefix}/", autoescape=True),
+        (models.FileModel.storage_key != None) | (models.FileModel.codec != None),
+    ).all()
+    packed = {row.path: compression.packed(row) for row in special if not row.storage_key}
+
+    members = []
+    if stored(prefix, True):
+        members = [
+            (e.key[len(prefix) + 1:], e, packed.get(e.key))
+            for e in storage.walk(prefix, tree_keys(db, prefix))
+        ]
+    for row in special:
+        info = storage.stat(row.storage_key) if row.storage_key else None
+        if info is not None:
+            members.append((row.path[len(prefix) + 1:], info, compression.packed(row)))
+    return members
+
 #create folder
 @router.post("/folder")
 def create_folder(
@@ -154,38 +377,44 @@ def create_folder(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    existing = db.query(models.FileModel).filter(
-        models.FileModel.filename == folder.name,
-        models.FileModel.parent_id == folder.parent_id,
-        models.FileModel.is_folder == True
-    ).first()
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="Folder already exists")
-
+    parent_folder = None
     if folder.parent_id:
-        parent_folder = db.query(models.FileModel).filter(models.FileModel.id == folder.parent_id).first()
+        parent_folder = live_files(db).filter(models.FileModel.id == folder.parent_id).first()
         if not parent_folder:
             raise HTTPException(status_code=404, detail="Parent folder not found")
-        # Ensure we get a Path object from the parent
-        parent_path = Path(get_folder_full_path(parent_folder))
-    else:
-        parent_path = Path(UPLOAD_DIR)
 
-    new_folder_path = parent_path / folder.name
-    new_folder_path.mkdir(parents=True, exist_ok=True)
+    def parent_disk_path():
+        # Ensure we get a Path object from the parent
+        return Path(get_folder_full_path(parent_folder)) if parent_folder else Path(UPLOAD_DIR)
 
-    new_folder = models.FileModel(
-        filename=folder.name,
-        # Standardize path with forward slashes using as_posix()
-        path=new_folder_path.as_posix(), 
-        uploaded_by_id=current_user.id,
-        is_folder=True,
-        parent_id=folder.parent_id
-    )
-    db.add(new_folder)
-    db.commit()
-    db.refresh(new_folder)
+    with path_locks.lock_for(db, lambda: ([names_key(parent_disk_path())], [])):
+        existing = live_files(db).filter(
+            models.FileModel.filename == folder.name,
+            models.FileModel.parent_id == folder.parent_id,
+        ).first()
+        
+        if existing:
+            # one name per folder, files and folders alike (uq_files_parent_filename)
+            detail = "Folder already exists" if existing.is_folder else "A file with this name already exists"
+            raise HTTPException(status_code=400, detail=detail)
+
+        new_folder_path = parent_disk_path() / folder.name
+        if not layout.BY_ID:
+            storage.make_folder(new_folder_path.as_posix())
+
+        new_folder = models.FileModel(
+            filename=folder.name,
+            # Standardize path with forward slashes using as_posix()
+            path=new_folder_path.as_posix(), 
+            uploaded_by_id=current_user.id,
+            is_folder=True,
+            parent_id=folder.parent_id
+        )
+        db.add(new_folder)
+        rollups.added(db, new_folder)
+        listing_changed(db, "create", new_folder)
+        db.commit()
+        db.refresh(new_folder)
 
     utils.append_log(new_folder.id, f" created folder by ", username=current_user.username)
     db.add(models.FileLog(user_id=current_user.id, file_id=new_folder.id, action="Create"))
@@ -208,39 +437,45 @@ def create_file(
 ):
     actual_parent_id = file.parent_id if file.parent_id and file.parent_id != 0 else None
 
-    existing = db.query(models.FileModel).filter(
-        models.FileModel.filename == file.name,
-        models.FileModel.parent_id == actual_parent_id,
-        models.FileModel.is_folder == False
-    ).first()
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="File already exists")
-
+    parent_folder = None
     if actual_parent_id:
-        parent_folder = db.query(models.FileModel).filter(models.FileModel.id == actual_parent_id).first()
+        parent_folder = live_files(db).filter(models.FileModel.id == actual_parent_id).first()
         if not parent_folder:
             raise HTTPException(status_code=404, detail="Parent folder not found")
-        parent_disk_path = Path(get_folder_full_path(parent_folder))
-    else:
-        parent_disk_path = Path(UPLOAD_DIR)
 
-    # Create physical file
-    new_file_disk_path = parent_disk_path / file.name
-    new_file_disk_path.touch(exist_ok=True)
+    def parent_disk_path():
+        return Path(get_folder_full_path(parent_folder)) if parent_folder else Path(UPLOAD_DIR)
 
-    new_file = models.FileModel(
-        filename=file.name,
-        # Standardize path with forward slashes using as_posix()
-        path=new_file_disk_path.as_posix(), 
-        uploaded_by_id=current_user.id,
-        is_folder=False,
-        parent_id=actual_parent_id,
-    )
-    
-    db.add(new_file)
-    db.commit()
-    db.refresh(new_file)
+    with path_locks.lock_for(db, lambda: ([names_key(parent_disk_path())], [])):
+        existing = live_files(db).filter(
+            models.FileModel.filename == file.name,
+            models.FileModel.parent_id == actual_parent_id,
+        ).first()
+        
+        if existing:
+            detail = "A folder with this name already exists" if existing.is_folder else "File already exists"
+            raise HTTPException(status_code=400, detail=detail)
+
+        new_file_disk_path = parent_disk_path() / file.name
+
+        new_file = models.FileModel(
+            filename=file.name,
+            # Standardize path with forward slashes using as_posix()
+            path=new_file_disk_path.as_posix(), 
+            uploaded_by_id=current_user.id,
+            is_folder=False,
+            parent_id=actual_parent_id,
+        )
+
+        # Create the (empty) stored file, keeping one that is already there
+        if not layout.BY_ID and storage.exists(new_file.path):
+            db.add(new_file)
+            rollups.added(db, new_file)
+            listing_changed(db, "create", new_file)
+            db.commit()
+        else:
+            store_new_file(new_file, [], db)
+        db.refresh(new_file)
 
     utils.append_log(new_file.id, f" created file by ", username=current_user.username)
     db.add(models.FileLog(user_id=current_user.id, file_id=new_file.id, action="Create"))
@@ -256,10 +491,21 @@ def create_file(
 #get/folder 
 @router.get("/folder/{folder_id}", summary="Get contents of a folder")
 def get_folder_contents(
+    request: Request,
     folder_id: int = 0,  
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
+    current = versions.version(db, folder_id)
+    etag = versions.listing_etag(folder_id, current)
+    unchanged = versions.not_modified(request, etag, "folder")
+    if unchanged:
+        return unchanged
+    cache_key = ("folder", folder_id)
+    cached = listing_cache.get(cache_key, current)
+    if cached is not None:
+        return cached_response(cached, versions.cache_headers(etag))
+
     if folder_id == 0:
         items = db.query(models.FileModel).filter(models.FileModel.parent_id == None, ~func.coalesce(models.FileModel.path, "").ilike("%recyclebin%")).all()
     else:
@@ -275,10 +521,25 @@ def get_folder_contents(
     "type": "folder" if f.is_folder else "file",
     "uploaded_by": f.uploaded_by.username if f.uploaded_by else None,
     "uploaded_at": f.uploaded_at,
-    "path": f.path
+    "path": f.path,
+    **listed_size(f),
 })
 
-    return result
+    return listing_cache.respond(cache_key, folder_id, current, result, versions.cache_headers(etag))
+
+#get/tree
+@router.get("/tree/{folder_id}", summary="Get the subtree of a folder", response_model=List[FolderResponse])
+def get_folder_tree(
+    folder_id: int = 0,
+    depth: Optional[int] = Query(None, ge=1, description="Levels to include below the folder; all when not given"),
+    folders_only: bool = False,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    if folder_id and not live_files(db).filter(models.FileModel.id == folder_id, models.FileModel.is_folder == True).count():
+        raise HTTPException(status_code=404, detail="Folder not found")
+    rows = tree.subtree_rows(db, folder_id, f"{TRASH_DIR.as_posix()}/", depth, folders_only)
+    return StreamingResponse(tree.stream_tree(rows, folder_id, depth), media_type="application/json")
 
 # upload file
 @router.post("/upload")
@@ -288,25 +549,34 @@ async def upload_file_or_folder(
     parent_id: int = Form(None),
     current_user: models.User = Depends(get_current_user),  
 ):  
-    saved_items = []
-
     # Determine upload path
     if not parent_id or parent_id == 0:
         parent_id = None
         upload_path = UPLOAD_DIR
     else:
-        parent_folder = db.query(models.FileModel).filter(models.FileModel.id == parent_id).first()
+        parent_folder = live_files(db).filter(models.FileModel.id == parent_id).first()
         if not parent_folder:
             raise HTTPException(status_code=404, detail="Parent folder not found")
         upload_path = Path(parent_folder.path or (UPLOAD_DIR / parent_folder.filename))
     
-    upload_path.mkdir(parents=True, exist_ok=True)
+    if not layout.BY_ID:
+        storage.make_folder(upload_path.as_posix())
+
+    metrics.active_uploads.inc()
+    try:
+        saved_items = await store_uploads(uploaded_file, upload_path, parent_id, db, current_user)
+    finally:
+        metrics.active_uploads.dec()
+
+    return {"uploaded": saved_items}
 
+
+async def store_uploads(uploaded_file: List[UploadFile], upload_path: Path, parent_id, db: Session, current_user):
+    saved_items = []
     for file in uploaded_file:
-        existing_file = db.query(models.FileModel).filter(
+        existing_file = live_files(db).filter(
             models.FileModel.filename == file.filename,
             models.FileModel.parent_id == parent_id,
-            models.FileModel.is_folder == False
         ).first()
         if existing_file:
             raise HTTPException(
@@ -315,8 +585,6 @@ async def upload_file_or_folder(
             )
 
         file_path = upload_path / file.filename
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
 
         file_db = models.FileModel(
             filename=file.filename,
@@ -324,11 +592,14 @@ async def upload_file_or_folder(
             uploaded_by_id=current_user.id if current_user else None,
             is_folder=False,
             parent_id=parent_id,
-            size=file_path.stat().st_size,
             is_star=False,
         )
-        db.add(file_db)
-        db.commit()
+        # streamed from the spooled upload in chunks, off the event loop
+        await file.seek(0)
+        size = await run_in_threadpool(
+            store_new_file, file_db, iter(lambda: file.file.read(CHUNK_SIZE), b""), db
+        )
+        metrics.upload_bytes.observe(size)
         db.refresh(file_db)
 
         utils.append_log(file_db.id, f"uploaded {file.filename} by", username=current_user.username if current_user else "anonymous")
@@ -341,11 +612,160 @@ async def upload_file_or_folder(
             "parent_id": parent_id
         })
 
-    return {"uploaded": saved_items}
+    return saved_items
+
+#upload negotiation: contents that are already stored are not uploaded again
+def stored_contents(db: Session, candidates) -> dict:
+    """(size, sha256) -> (file row, its metadata) for the candidates whose contents some file already has."""
+    wanted = {(c.size, c.sha256.lower()) for c in candidates}
+    meta, files = models.FileMetadata, models.FileModel
+    rows = db.query(meta, files).join(files, files.id == meta.file_id).filter(
+        meta.size.in_({size for size, _ in wanted}),
+        meta.sha256.in_({digest for _, digest in wanted}),
+        meta.status == "done",
+        # extracted from the contents the file has now
+        meta.size == func.coalesce(files.size, 0),
+    )
+    found = {}
+    for row, record in rows:
+        if (row.size, row.sha256) in wanted:
+            found.setdefault((row.size, row.sha256), (record, row))
+    return found
+
+def create_from_stored(matches, upload_path: Path, parent_id, db: Session, current_user):
+    """
+    New rows for (candidate, source row, source metadata) triples, sharing the
+    source's stored contents; returns (created, names to upload after all).
+    """
+    records, upload, changed = [], [], set()
+    for candidate, source, meta in matches:
+        # rewritten since it was hashed (at the same size): the hash says nothing about it now
+        if source.id in changed or not metadata.fresh(meta, source, storage.stat(record_key(source))):
+            changed.add(source.id)
+            upload.append(candidate.name)
+            continue
+        record = models.FileModel(
+            filename=candidate.name,
+            path=(upload_path / candidate.name).as_posix(),
+            uploaded_by_id=current_user.id if current_user else None,
+            is_folder=False,
+            parent_id=parent_id,
+            is_star=False,
+            size=source.size,
+            **content_fields(source),
+        )
+        db.add(record)
+        records.append((source, meta, record))
+    metadata.forget(db, changed)
+    db.flush()
+
+    # hard links where the backend has them, so not even the server writes the data again
+    missing = copy_objects([(source, layout.assign_key(record)) for source, _, record in records], link=True)
+    for source, _, record in records:
+        if record_key(source) in missing:
+            # deleted since it was looked up
+            db.delete(record)
+            upload.append(record.filename)
+    records = [(source, meta, record) for source, meta, record in records if record_key(source) not in missing]
+    db.flush()
+
+    keys = [record_key(record) for _, _, record in records]
+    size = sum(int(record.size or 0) for _, _, record in records)
+    try:
+        rollups.apply(db, parent_id, rollups.Rollup(size, len(records), 0))
+        quotas.charge(db, current_user.id if current_user else None, size)
+    except HTTPException:
+        db.rollback()
+        storage.delete_many(keys)
+        raise
+    for _, meta, record in records:
+        db.add(metadata.taken_over(meta, record.id))
+        listing_changed(db, "create", record)
+    db.commit()
+
+    created = []
+    for _, _, record in records:
+        username = current_user.username if current_user else "anonymous"
+        utils.append_log(record.id, f"uploaded {record.filename} (contents already stored) by", username=username)
+        created.append({
+            "id": record.id,
+            "name": record.filename,
+            "type": "file",
+            "size": record.size,
+            "parent_id": parent_id
+        })
+    return created, upload
+
+@router.post("/upload/negotiate", summary="Create the files whose contents are stored already; list the rest to upload")
+def negotiate_upload(
+    request: UploadNegotiation,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    parent_id = request.parent_id or None
+    if parent_id is None:
+        upload_path = UPLOAD_DIR
+    else:
+        parent_folder = live_files(db).filter(models.FileModel.id == parent_id).first()
+        if not parent_folder:
+            raise HTTPException(status_code=404, detail="Parent folder not found")
+        upload_path = Path(parent_folder.path or (UPLOAD_DIR / parent_folder.filename))
+    names = [candidate.name for candidate in request.files]
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=400, detail="Every file needs a name of its own")
+
+    # a client naming a hash gets a file with those contents: fine while every user may download every file
+    found = stored_contents(db, request.files) if request.files else {}
+    matches = []
+    upload = []
+    for candidate in request.files:
+        stored_as = found.get((candidate.size, candidate.sha256.lower()))
+        if stored_as:
+            matches.append((candidate, *stored_as))
+        else:
+            upload.append(candidate.name)
+
+    created = []
+    with path_locks.lock_for(db, lambda: ([names_key(upload_path)], [])):
+        existing_file = live_files(db).filter(
+            models.FileModel.filename.in_(names),
+            models.FileModel.parent_id == parent_id,
+        ).first()
+        if existing_file:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File '{existing_file.filename}' already exists in this folder."
+            )
+        if matches:
+            if not layout.BY_ID:
+                storage.make_folder(upload_path.as_posix())
+            created, missed = create_from_stored(matches, upload_path, parent_id, db, current_user)
+            upload += missed
+
+    metrics.upload_negotiated_files.inc(len(created), result="created")
+    metrics.upload_negotiated_files.inc(len(upload), result="upload")
+    metrics.upload_negotiated_bytes.inc(sum(int(item["size"] or 0) for item in created))
+    return {"created": created, "upload": upload}
 
 #get files with pagination
 @router.get("/")    
-def get_files(folder_id: Optional[int] = None, page: int = 1, limit: int = 10, db: Session = Depends(get_db)):
+def get_files(
+    request: Request,
+    folder_id: Optional[int] = None,
+    page: int = 1,
+    limit: int = 10,
+    db: Session = Depends(get_db),
+):
+    current = versions.version(db, folder_id)
+    etag = versions.listing_etag(folder_id, current, page=page, limit=limit)
+    unchanged = versions.not_modified(request, etag, "files")
+    if unchanged:
+        return unchanged
+    cache_key = ("files", folder_id, page, limit)
+    cached = listing_cache.get(cache_key, current)
+    if cached is not None:
+        return cached_response(cached, versions.cache_headers(etag))
+
     query = db.query(models.FileModel)
     if folder_id is not None:
         query = query.filter(models.FileModel.parent_id == folder_id, ~models.FileModel.path.ilike("%RecycleBin%"))
@@ -364,23 +784,25 @@ def get_files(folder_id: Optional[int] = None, page: int = 1, limit: int = 10, d
             "is_folder": f.is_folder,
             "uploaded_by": f.uploaded_by.username if f.uploaded_by else None,
             "uploaded_at": f.uploaded_at,
-            "size": f.size,
+            **listed_size(f),
             "path":f.path if f.path else str((UPLOAD_DIR / f.filename).relative_to(UPLOAD_DIR)),
         }
         for f in items
     ]
 
-    return {
+    listing = {
         "data": data,
         "total": total,
         "page": page,
         "limit": limit,
         "pages": (total + limit - 1) // limit,
     }
+    return listing_cache.respond(cache_key, folder_id, current, listing, versions.cache_headers(etag))
 
 #see logs
 @router.get("/log/{file_id}", summary="Get logs for a file/folder")
 def get_file_log(file_id: int):
+    utils.log_writer.flush()
     log_file = utils.get_log_path(file_id)
     print(f" Checking path for log id {file_id}: {log_file}")
 
@@ -395,37 +817,93 @@ def get_file_log(file_id: int):
 @router.get("/properties")
 def file_os_properties(file_id: int, db: Session = Depends(get_db)):
 
-    file = db.query(models.FileModel).filter(models.FileModel.id == file_id).first()
+    file = live_files(db).filter(models.FileModel.id == file_id).first()
     if not file:
         raise HTTPException(404, detail="File not found in database.")
 
-    full_path = get_full_path(file) 
-    path = Path(full_path) 
-    
-    if not path.exists():
-        raise HTTPException(404, detail=f"Physical file/folder not found at: {full_path}")
+    # all from the database: storage was read once, when the file came in (app.files.metadata)
+    meta = None if file.is_folder else db.get(models.FileMetadata, file.id)
+    suffix = Path(file.filename).suffix
+    file_type = "folder" if file.is_folder else (suffix[1:] if suffix else "unknown")
+
+    def timestamp(value):
+        return value.strftime("%Y-%m-%d %H:%M:%S") if value is not None else None
+
+    # compressed files: the size is what a download delivers, stored_size what is on disk
+    compressed = {}
+    if file.codec:
+        stored = meta.stored_size if meta and meta.stored_size is not None else None
+        compressed = {"codec": file.codec, "stored_size": stored / 1024 / 1024 if stored is not None else None}
+    # folders: everything below them, from the rollup
+    folder = {"file_count": file.file_count, "folder_count": file.folder_count} if file.is_folder else {}
+    # current: extracted from the contents the file has now; otherwise extraction is still to come
+    current = meta is not None and meta.size == int(file.size or 0)
+    extracted = {}
+    if current:
+        extracted = {
+            "mime_type": meta.mime_type,
+            "sha256": meta.sha256,
+            **(json.loads(meta.attributes) if meta.attributes else {}),
+        }
+    if not file.is_folder:
+        extracted["metadata_status"] = meta.status if current else "pending"
+    # permission bits are only known for local storage
+    mode = meta.mode if current else None
 
-    stats = path.stat()
-    file_type = "folder" if path.is_dir() else (path.suffix[1:] if path.suffix else "unknown")
-    file_size_mb = stats.st_size / 1024 / 1024
-    
-    
     return {
-        "name": path.name,
+        "name": file.filename,
         "type": file_type,
-        "size": file_size_mb,
-        "created_at": datetime.fromtimestamp(stats.st_ctime).strftime("%Y-%m-%d %H:%M:%S"),
-        "modified_at": datetime.fromtimestamp(stats.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
-        "accessed_at": datetime.fromtimestamp(stats.st_atime).strftime("%Y-%m-%d %H:%M:%S"),
-        "absolute_path": str(path.resolve()),
-        "is_readable": os.access(path, os.R_OK),
-        "is_writable": os.access(path, os.W_OK),
-        "is_executable": os.access(path, os.X_OK)
+        "size": (file.tree_size if file.is_folder else file.size or 0) / 1024 / 1024,
+        "created_at": timestamp(file.uploaded_at),
+        "modified_at": timestamp(meta.modified_at if current and meta.modified_at else file.uploaded_at),
+        "accessed_at": None,
+        "absolute_path": storage.uri(file.storage_key or file.path or get_full_path(file)),
+        "is_readable": True if mode is None else bool(mode & 0o444),
+        "is_writable": True if mode is None else bool(mode & 0o222),
+        "is_executable": False if mode is None else bool(mode & 0o111),
+        **compressed,
+        **folder,
+        **extracted,
     }
 
+#preview
+def preview_source(db: Session, file_id: int):
+    """(storage key, Packed, metadata) of a file to preview; its metadata is extracted now if it isn't yet."""
+    file = live_files(db).filter(models.FileModel.id == file_id).first()
+    if not file or file.is_folder:
+        raise HTTPException(404, "File not found")
+    meta = db.get(models.FileMetadata, file.id)
+    if not metadata.fresh(meta, file, storage.stat(file.storage_key or file.path)):
+        metadata.extract(db, file.id)
+        meta = db.get(models.FileMetadata, file.id)
+    if meta is None:
+        raise HTTPException(404, f"File '{file.filename}' not found")
+    if meta.status != "done":
+        raise HTTPException(422, f"File '{file.filename}' could not be read: {meta.error}")
+    return file.storage_key or file.path, compression.packed(file), meta
+
+@router.get("/preview/{file_id}", summary="Preview a file: the first lines of text, a thumbnail of an image")
+async def preview_file(
+    file_id: int,
+    request: Request,
+    lines: int = Query(PREVIEW_LINES, ge=1, le=PREVIEW_MAX_LINES, description="Lines of a text or CSV file"),
+    size: int = Query(PREVIEW_SIZE, ge=1, le=THUMBNAIL_SIZES[-1], description="Longest side of a thumbnail, in pixels"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    key, packed, meta = await run_in_threadpool(preview_source, db, file_id)
+    spec = spec_for(meta.mime_type, lines, size)
+    # the same contents always give the same preview
+    headers = {"ETag": f'"{meta.sha256[:32]}-{spec.kind}{spec.param}"', "Cache-Control": "private, no-cache"}
+    if versions.matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    data = await preview_cache.get(key, packed, meta.sha256, spec)
+    return Response(data, media_type=spec.media_type, headers=headers)
+
 #download logs
 @router.get("/log/{file_id}/download", summary="Download logs as text")
 def download_file_log(file_id: int):
+    utils.log_writer.flush()
     log_file = utils.get_log_path(file_id)
     if not log_file.exists():
         raise HTTPException(404, "Log file not found")
@@ -435,38 +913,40 @@ def download_file_log(file_id: int):
 @router.get("/download/{file_id}", summary="Download a file or folder")
 def download_file_or_folder(
     file_id: int,
+    request: Request,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    file_db = db.query(models.FileModel).filter(models.FileModel.id == file_id).first()
+    file_db = live_files(db).filter(models.FileModel.id == file_id).first()
     if not file_db:
         raise HTTPException(404, "Not found")
 
     if file_db.is_folder:
-        folder_path = utils.get_folder_full_path(file_db)
-        if not folder_path.exists() or not folder_path.is_dir():
+        folder_key = utils.get_folder_full_path(file_db).as_posix()
+        info = storage.stat(folder_key)
+        if (info is None and not stored(folder_key, True)) or (info and not info.is_folder):
             raise HTTPException(404, "Folder not found")
 
-        temp_dir = Path(tempfile.gettempdir())
-        zip_base = temp_dir / f"{file_db.id}_{file_db.filename}"
-        zip_path = shutil.make_archive(str(zip_base), "zip", str(folder_path))
-        send_path = Path(zip_path)
-        send_name = f"{file_db.filename}.zip"
-
-        background_tasks.add_task(send_path.unlink, missing_ok=True)
+        response = downloads.folder_response(zip_members(file_db, db), file_db.filename, background_tasks)
 
     else:
         # File download
-        file_path = Path(file_db.path)
-        if not file_path.exists():
+        file_key = record_key(file_db)
+        if not storage.exists(file_key) and not file_db.storage_key:
             # Try upload dir
-            file_path = UPLOAD_DIR / file_db.filename
-            if not file_path.exists():
+            file_key = (UPLOAD_DIR / file_db.filename).as_posix()
+            if not storage.exists(file_key):
                 raise HTTPException(404, f"File '{file_db.filename}' not found")
 
-        send_path = file_path
-        send_name = file_db.filename
+        response = downloads.file_response(
+            file_key,
+            Path(file_db.filename).name,
+            request.headers.get("range"),
+            background_tasks,
+            packed=compression.packed(file_db),
+            accept_encoding=request.headers.get("accept-encoding"),
+        )
 
     # Log download
     file_log = models.FileLog(
@@ -479,88 +959,130 @@ def download_file_or_folder(
 
     utils.append_log(file_db.id, f"Downloaded by ", username=current_user.username)
 
-    return FileResponse(
-        path=send_path,
-        filename=Path(send_name).name,
-        background=background_tasks
-    )
+    return response
+
+@router.post("/download", summary="Download several files and folders as one zip")
+def download_selection(
+    request: DownloadRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    ids = _dedupe(request.file_ids)
+    if not ids:
+        raise HTTPException(400, "No files selected")
+    records = {f.id: f for f in live_files(db).filter(models.FileModel.id.in_(ids)).all()}
+    missing = [file_id for file_id in ids if file_id not in records]
+    if missing:
+        raise HTTPException(404, f"Not found: {missing}")
+
+    # a selected folder brings its selected descendants along already
+    roots, _ = outermost(records.values())
+    members = selection_members(roots, db)
+
+    db.add_all([models.FileLog(file_id=record.id, user_id=current_user.id, action="Download") for record in roots])
+    db.commit()
+    for record in roots:
+        utils.append_log(record.id, f"Downloaded by ", username=current_user.username)
+
+    return downloads.zip_response(members, request.name or "download.zip", background_tasks)
+
+def outermost(records):
+    """(the records not below another one of them, the ones that are), shallowest first."""
+    roots, nested, root_folders = [], [], []
+    for record in sorted(records, key=lambda f: (f.path or "").replace("\\", "/").count("/")):
+        record_path = (record.path or "").replace("\\", "/")
+        if any(record_path.startswith(f"{folder}/") for folder in root_folders):
+            nested.append(record)
+            continue
+        roots.append(record)
+        if record.is_folder:
+            root_folders.append(record_path)
+    return roots, nested
+
+def selection_members(roots, db: Session) -> list:
+    """zip_members() of a whole selection, each item under a name of its own at the top of the archive."""
+    members, names = [], set()
+    for record in roots:
+        name = generate_unique_filename(record.filename, names)
+        names.add(name)
+        key = record_key(record)
+        if record.is_folder:
+            members.append((name, storage.stat(key) or ObjectStat(key, 0, None, True), None))
+            members.extend((f"{name}/{member}", info, packed) for member, info, packed in zip_members(record, db))
+            continue
+        info = storage.stat(key)
+        if info is None:
+            print(f"Warning: {key} missing, left out of the download")
+            continue
+        members.append((name, info, compression.packed(record)))
+    return members
 
 #move to recycle bin
 def move_to_recycle_bin_db(file_db, current_user, db: Session):
     """
-    Safely move a file/folder to RecycleBin recursively.
+    Safely move a file/folder, with everything below it, to the RecycleBin.
+    Locks the whole subtree while moving.
     """
-    if "RecycleBin" in str(file_db.path):
-        return
-
-    for child in getattr(file_db, "children", []):
-        move_to_recycle_bin_db(child, current_user, db)
-
-    file_log = models.FileLog(
-        file_id=file_db.id,
-        user_id=current_user.id,
-        action="Delete"
-    )
-    db.add(file_log)
-
-    file_path = None
-    if file_db.is_folder:
-        file_path = utils.get_folder_full_path(file_db)
-    elif file_db.path:
-        file_path = Path(file_db.path)
-    else:
-        file_path = utils.UPLOAD_DIR / file_db.filename
-
-    if not file_path.exists():
-        print(f"Skipping missing file: {file_path}")
-        return
-
-    if file_db.parent_id:
-        parent_folder_db = db.query(models.FileModel).get(file_db.parent_id)
-        parent_folder = utils.get_folder_full_path(parent_folder_db)
-    else:
-        parent_folder = utils.UPLOAD_DIR
+    with path_locks.lock_for(db, lambda: (recycle_lock_keys(file_db), [])):
+        _move_to_recycle_bin(file_db, current_user, db)
 
-    recycle_bin_folder = parent_folder / "RecycleBin"
-    recycle_bin_folder.mkdir(parents=True, exist_ok=True)
+def recycle_lock_keys(file_db) -> list:
+    return [record_key(file_db) if file_db.is_folder else file_db.path or utils.UPLOAD_DIR / file_db.filename]
 
-    dest_path = recycle_bin_folder / file_db.filename
-    if dest_path.exists():
-        dest_path = recycle_bin_folder / f"{file_db.id}_{file_db.filename}"
-
-    if str(dest_path).startswith(str(file_path)):
-        print(f" Skipping self-move: {file_path} → {dest_path}")
+def _move_to_recycle_bin(file_db, current_user, db: Session, commit: bool = True, undo: list = None):
+    """
+    Move `file_db` and its subtree into the trash, keeping every row: the
+    contents go to RecycleBin/<recycle id>/<name> in one move (none in the id
+    layout), the rows' paths follow in one UPDATE and the top row is detached
+    from its parent, which the RecycleBin entry remembers for the restore.
+    Raises HTTPException when the contents are missing or can't be moved,
+    leaving the caller to roll the session back; the move of the contents is
+    added to `undo` for the caller to undo_storage() when it does.
+    """
+    if in_trash(file_db):
         return
 
-    try:
-        shutil.move(str(file_path), str(dest_path))
-    except Exception as e:
-        print(f"Error moving {file_path} → {dest_path}: {e}")
-        return
+    file_key = record_key(file_db)
+    if not stored(file_key, file_db.is_folder):
+        raise HTTPException(404, f"'{file_db.filename}' not found on disk")
 
     recycle_item = models.RecycleBin(
         filename=file_db.filename,
         # original_name=file_db.original_name,
         deleted_by_id=current_user.id,
         is_folder=file_db.is_folder,
-        path=str(dest_path)
+        file_id=file_db.id,
+        parent_id=file_db.parent_id,
+        original_path=file_db.path,
+        storage_key=file_db.storage_key,
+        **content_fields(file_db),
+        size=rollups.subtree(file_db).size,
+        owner_id=file_db.uploaded_by_id,
     )
     db.add(recycle_item)
+    db.flush()
+    recycle_item.path = trash_key(recycle_item)
 
-    log_path = utils.get_log_path(file_db.id)
-    if log_path.exists():
-        removed_log_path = log_path.parent / f"removed_log_file_{file_db.id}.txt"
-        try:
-            shutil.move(str(log_path), str(removed_log_path))
-        except Exception as e:
-            print(f"Error moving log file: {e}")
-
+    # id-layout files stay where they are, only their logical path changes
     try:
-        db.delete(file_db)
-        db.commit()
+        if file_db.is_folder:
+            move_tree_contents(file_key, recycle_item.path, db)
+        elif not file_db.storage_key:
+            storage.move(file_key, recycle_item.path)
     except Exception as e:
-        db.rollback()
-        print(f"DB delete error: {e}")
+        raise HTTPException(500, f"Failed to move '{file_db.filename}' to the RecycleBin: {e}")
+    if undo is not None and (file_db.is_folder or not file_db.storage_key):
+        undo.append(moved_back(file_key, recycle_item.path, file_db.is_folder, db))
+
+    db.add(models.FileLog(file_id=file_db.id, user_id=current_user.id, action="Delete"))
+    rollups.removed(db, file_db)
+    listing_changed(db, "delete", file_db)
+    rebase_paths(db, normalize_key(file_db.path or file_key), recycle_item.path)
+    file_db.path = recycle_item.path
+    file_db.parent_id = None
+    if commit:
+        db.commit()
 
 #delete file/folder (move to recycle bin)
 @router.delete("/delete/{file_id}", summary="Delete a file or folder (Move to RecycleBin)")
@@ -569,20 +1091,20 @@ def delete_file_or_folder_db(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    file_db = db.query(models.FileModel).filter(models.FileModel.id == file_id).first()
+    file_db = live_files(db).filter(models.FileModel.id == file_id).first()
     if not file_db:
         raise HTTPException(404, "File/Folder not found")
 
+    move_to_recycle_bin_db(file_db, current_user, db)
+
+    db.commit()
+
     utils.append_log(
         file_db.id,
         f" deleted file {file_db.filename}  by",
         username=current_user.username
     )
 
-    move_to_recycle_bin_db(file_db, current_user, db)
-
-    db.commit()
-
     return {"deleted_file_id": file_id, "status": "Moved to RecycleBin"}
 
 #permanent delete from recycle bin
@@ -597,18 +1119,11 @@ def permanently_delete_from_recycle_bin_db(
     if not recycle_item:
         raise HTTPException(404, "RecycleBin item not found")
 
-    src_path = Path(recycle_item.path)
-    if src_path.exists():
-        try:
-            if recycle_item.is_folder:
-                shutil.rmtree(src_path)
-            else:
-                src_path.unlink()
-        except Exception as e:
-            raise HTTPException(500, f"Error deleting file/folder: {e}")
-
-    db.delete(recycle_item)
-    db.commit()
+    with path_locks.lock_for(db, lambda: ([recycle_item.path], [])):
+        result = purge_recycle_items([recycle_item], db)[recycle_item.id]
+        if result["status"] != "deleted":
+            raise HTTPException(500, result["detail"])
+        db.commit()
     
     utils.append_log(
         recycle_item.id,
@@ -630,67 +1145,113 @@ def generate_unique_filename(filename: str, existing_names: set) -> str:
         counter += 1
     return new_name
 
-def recursive_copy(src_record, dest_folder_id, db: Session, current_user):
+def recursive_copy(src_record, dest_folder_id, db: Session, current_user, progress=None):
     """
     src_record: The FileModel object we are copying
     dest_folder_id: The ID of the parent we are pasting into
+    progress: optional callback(items, bytes) called once per copied entry
     """
     if dest_folder_id:
         dest_parent = db.query(models.FileModel).filter(models.FileModel.id == dest_folder_id).first()
-        dest_parent_path = Path(dest_parent.path)
+        dest_parent_key = record_key(dest_parent)
     else:
-        dest_parent_path = Path(UPLOAD_DIR)
+        dest_parent_key = UPLOAD_DIR.as_posix()
 
-    dest_parent_path.mkdir(parents=True, exist_ok=True)
+    if not layout.BY_ID:
+        storage.make_folder(dest_parent_key)
 
     # 2. Prevent name collisions in the destination
-    existing_names = {f.name for f in dest_parent_path.iterdir()}
+    existing_names = taken_names(dest_folder_id, dest_parent_key, db)
     new_filename = generate_unique_filename(src_record.filename, existing_names)
-    new_physical_path = dest_parent_path / new_filename
+    new_key = child_key(dest_parent_key, new_filename)
 
     # 3. Create DB Record
     new_record = models.FileModel(
         filename=new_filename,
-        path=new_physical_path.as_posix(), # ✅ Standard POSIX path
+        path=new_key, # ✅ Standard POSIX path
         is_folder=src_record.is_folder,
         parent_id=dest_folder_id,
         uploaded_by_id=current_user.id,
-        size=src_record.size if not src_record.is_folder else 0
+        size=src_record.size if not src_record.is_folder else 0,
+        **content_fields(src_record),
     )
     db.add(new_record)
     db.flush() # Get new_record.id for children
+    rollups.added(db, new_record)
 
-    # 4. Physical Operation
-    src_physical_path = Path(src_record.path)
-    
+    # 4. Storage Operation
     if src_record.is_folder:
-        new_physical_path.mkdir(exist_ok=True)
-        # Recursively copy children from the DB relationship
-        for child in src_record.children:
-            recursive_copy(child, new_record.id, db, current_user)
+        if not layout.BY_ID:
+            storage.make_folder(new_key)
+        copy_children(src_record, new_record, db, current_user, progress)
     else:
-        if src_physical_path.exists():
-            shutil.copy2(src_physical_path, new_physical_path)
-            new_record.size = new_physical_path.stat().st_size
-        else:
-            print(f"Warning: Physical file {src_physical_path} missing during copy.")
+        quotas.charge(db, current_user.id, new_record.size)
+        copy_objects([(src_record, layout.assign_key(new_record))])
 
     db.commit()
+    if progress:
+        progress(1, new_record.size or 0)
     return new_record
 
+def copy_children(src_folder, new_folder, db: Session, current_user, progress=None):
+    """Copy the contents of src_folder into the freshly created (empty) new_folder."""
+    copies = []
+    for child in src_folder.children:
+        if child.is_folder:
+            recursive_copy(child, new_folder.id, db, current_user, progress)
+            continue
+        record = models.FileModel(
+            filename=child.filename,
+            path=child_key(new_folder.path, child.filename),
+            is_folder=False,
+            parent_id=new_folder.id,
+            uploaded_by_id=current_user.id,
+            size=child.size,
+            **content_fields(child),
+        )
+        db.add(record)
+        copies.append((child, record))
+    db.flush()
+    size = sum(record.size or 0 for _, record in copies)
+    rollups.apply(db, new_folder.id, rollups.Rollup(int(size), len(copies), 0))
+    quotas.charge(db, current_user.id, size)
+
+    # the files of one folder go to the backend as one batch
+    copy_objects([(child, layout.assign_key(record)) for child, record in copies])
+    db.commit()
+    if progress:
+        for _, record in copies:
+            progress(1, record.size or 0)
+
+def copy_objects(copies, link: bool = False) -> set:
+    """Copy the stored contents of each (source record, new record) pair; returns the source keys that were missing."""
+    # pack entries are immutable, so a copy just refers to the same one
+    for src, new in copies:
+        if packs.is_pack_key(src.storage_key):
+            new.storage_key = src.storage_key
+    copies = [(src, new) for src, new in copies if not packs.is_pack_key(src.storage_key)]
+    transfer = storage.link_many if link else storage.copy_many
+    missing = set(transfer([(record_key(src), record_key(new)) for src, new in copies]))
+    for src, _ in copies:
+        if record_key(src) in missing:
+            print(f"Warning: Physical file {record_key(src)} missing during copy.")
+    return missing
+
 # copy_file_or_folder
 def copy_file_or_folder(src: models.FileModel, dest_folder: models.FileModel, db: Session, current_user: models.User):
 
-    src_path = UPLOAD_DIR / src.filename
-    dest_path = UPLOAD_DIR / dest_folder.filename / src.filename if dest_folder else UPLOAD_DIR / src.filename
-    
-    if dest_path.exists():
-         pass 
+    src_key = (UPLOAD_DIR / src.filename).as_posix()
+    dest_key = (UPLOAD_DIR / dest_folder.filename / src.filename if dest_folder else UPLOAD_DIR / src.filename).as_posix()
 
     if src.is_folder:
-        shutil.copytree(src_path, dest_path)
+        entries = list(storage.walk(src_key, tree_keys(db, src_key)))
+        storage.make_folder(dest_key)
+        for entry in entries:
+            if entry.is_folder:
+                storage.make_folder(rebase(entry.key, src_key, dest_key))
+        storage.copy_many([(e.key, rebase(e.key, src_key, dest_key)) for e in entries if not e.is_folder])
     else:
-        shutil.copy2(src_path, dest_path)
+        storage.copy(src_key, dest_key)
 
     new_file = models.FileModel(
         filename=src.filename,
@@ -699,6 +1260,7 @@ def copy_file_or_folder(src: models.FileModel, dest_folder: models.FileModel, db
         parent_id=dest_folder.id if dest_folder else None,
     )
     db.add(new_file)
+    rollups.added(db, new_file)
     db.commit()
     db.refresh(new_file)
     
@@ -706,90 +1268,128 @@ def copy_file_or_folder(src: models.FileModel, dest_folder: models.FileModel, db
     
     return new_file
 
-@router.post("/copy")
-def copy_files(
-    request: CopyRequest,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    dest_id = request.destination_folder_id if request.destination_folder_id != 0 else None
-    
+def copy_records(file_ids: List[int], dest_id: Optional[int], db: Session, current_user, progress=None):
+    """Copy every id in file_ids into dest_id, returning the new records."""
     copied_items = []
-    for file_id in request.file_ids:
+    for file_id in file_ids:
         # Load with children to ensure recursive copy works
-        src_file = db.query(models.FileModel).options(joinedload(models.FileModel.children)).filter(
+        src_file = live_files(db).options(joinedload(models.FileModel.children)).filter(
             models.FileModel.id == file_id
         ).first()
         
         if not src_file: continue
 
-        try:
-            new_record = recursive_copy(src_file, dest_id, db, current_user)
-            copied_items.append({"id": new_record.id, "name": new_record.filename})
-        except Exception as e:
-            db.rollback()
-            raise HTTPException(500, f"Copy failed for {src_file.filename}: {str(e)}")
+        def lock_keys():
+            dest_parent = db.query(models.FileModel).filter(models.FileModel.id == dest_id).first() if dest_id else None
+            dest_path = dest_parent.path if dest_parent else UPLOAD_DIR
+            # readers of the source may run alongside, writers to the destination names may not
+            return [names_key(dest_path)], [src_file.path]
 
-    return {"status": "success", "copied_files": copied_items}
+        with path_locks.lock_for(db, lock_keys):
+            try:
+                new_record = recursive_copy(src_file, dest_id, db, current_user, progress)
+                listing_changed(db, "create", new_record)
+                db.commit()
+                copied_items.append({"id": new_record.id, "name": new_record.filename})
+            except HTTPException:
+                db.rollback()
+                raise
+            except Exception as e:
+                db.rollback()
+                raise HTTPException(500, f"Copy failed for {src_file.filename}: {str(e)}")
 
-@router.post("/move")
-def move_files(
-    request: CopyRequest, 
+    return copied_items
+
+@router.post("/copy")
+def copy_files(
+    request: CopyRequest,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
+    dest_id = request.destination_folder_id if request.destination_folder_id != 0 else None
+    
+    copied_items = copy_records(request.file_ids, dest_id, db, current_user)
+
+    return {"status": "success", "copied_files": copied_items}
+
+def move_records(file_ids: List[int], destination_folder_id: Optional[int], db: Session, progress=None):
+    """Move every id in file_ids under destination_folder_id (0/None = root)."""
     # 1. Get Destination
     dest_folder = None
-    if request.destination_folder_id and request.destination_folder_id != 0:
-        dest_folder = db.query(models.FileModel).filter(
-            models.FileModel.id == request.destination_folder_id,
+    if destination_folder_id and destination_folder_id != 0:
+        dest_folder = live_files(db).filter(
+            models.FileModel.id == destination_folder_id,
             models.FileModel.is_folder == True
         ).first()
-        dest_path_obj = Path(dest_folder.path)
-    else:
-        dest_path_obj = Path(UPLOAD_DIR)
+        if not dest_folder:
+            raise HTTPException(404, "Destination folder not found")
+
+    def dest_path():
+        return Path(dest_folder.path) if dest_folder else Path(UPLOAD_DIR)
+
+    dest_id = dest_folder.id if dest_folder else None
 
     moved_files = []
 
-    for file_id in request.file_ids:
-        src_file = db.query(models.FileModel).filter(models.FileModel.id == file_id).first()
+    for file_id in file_ids:
+        src_file = live_files(db).filter(models.FileModel.id == file_id).first()
         if not src_file: continue
 
-        src_path = Path(src_file.path)
-        
-        # Determine initial target path
-        target_path = dest_path_obj / src_file.filename
+        with path_locks.lock_for(db, lambda: ([src_file.path, names_key(dest_path())], [])):
+            dest_key = dest_path().as_posix()
+            src_path = normalize_key(src_file.path)
 
-        if not src_path.exists():
-            raise HTTPException(404, f"Source '{src_file.path}' not found on disk")
+            if not stored(record_key(src_file), src_file.is_folder):
+                raise HTTPException(404, f"Source '{src_file.path}' not found on disk")
 
-        # Check: Cannot move a folder into itself
-        if src_file.is_folder and dest_path_obj.resolve().is_relative_to(src_path.resolve()):
-            raise HTTPException(400, "Cannot move a folder into its own subfolder")
+            # Check: Cannot move a folder into itself
+            if src_file.is_folder and (dest_key == src_path or dest_key.startswith(f"{src_path}/")):
+                raise HTTPException(400, "Cannot move a folder into its own subfolder")
 
-        try:
-            # Handle name collisions at destination
-            existing_names = {f.name for f in dest_path_obj.iterdir()}
-            final_name = generate_unique_filename(src_file.filename, existing_names)
-            final_dest_path = dest_path_obj / final_name
+            try:
+                # Handle name collisions at destination
+                existing_names = taken_names(dest_id, dest_key, db)
+                final_name = generate_unique_filename(src_file.filename, existing_names)
+                final_dest_key = child_key(dest_key, final_name)
+
+                # Storage Move (none for id-layout files)
+                if not layout.BY_ID:
+                    storage.make_folder(dest_key)
+                relocate(src_file, final_dest_key, db)
+
+                # Update DB Record
+                if src_file.is_folder:
+                    versions.bump_tree(db, src_path)
+                rollups.removed(db, src_file)
+                old_parent_id = src_file.parent_id
+                src_file.filename = final_name
+                src_file.path = final_dest_key
+                src_file.parent_id = dest_id
+                rollups.added(db, src_file)
+                listing_changed(db, "move", src_file, old_folder_id=old_parent_id)
+
+                if src_file.is_folder:
+                    update_child_paths(src_file, db)
 
-            # Physical Move
-            shutil.move(str(src_path), str(final_dest_path))
+                db.commit()
+                moved_files.append({"id": src_file.id, "name": src_file.filename})
 
-            # Update DB Record
-            src_file.filename = final_name
-            src_file.path = final_dest_path.as_posix()
-            src_file.parent_id = dest_folder.id if dest_folder else None
+            except Exception as e:
+                db.rollback()
+                raise HTTPException(500, f"Error moving {src_file.filename}: {str(e)}")
 
-            if src_file.is_folder:
-                update_child_paths(src_file, db)
+        if progress:
+            progress(1, src_file.size or 0)
 
-            db.commit()
-            moved_files.append({"id": src_file.id, "name": src_file.filename})
+    return moved_files
 
-        except Exception as e:
-            db.rollback()
-            raise HTTPException(500, f"Error moving {src_file.filename}: {str(e)}")
+@router.post("/move")
+def move_files(
+    request: CopyRequest, 
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    moved_files = move_records(request.file_ids, request.destination_folder_id, db)
 
     return {"status": "success", "moved_files": moved_files}
 
@@ -807,7 +1407,7 @@ def rename_file_or_folder(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    file = db.query(models.FileModel).filter_by(id=file_id).first()
+    file = live_files(db).filter_by(id=file_id).first()
     if not file:
         raise HTTPException(status_code=404, detail="File/folder not found")
 
@@ -819,45 +1419,52 @@ def rename_file_or_folder(
         if not new_ext and old_ext:
             final_name = f"{new_name}{old_ext}"
 
-    old_db_path = file.path.replace("\\", "/")
-    old_path_obj = Path(old_db_path)
+    def lock_keys():
+        parent_path = Path(file.path.replace("\\", "/")).parent
+        return [file.path, names_key(parent_path)], []
+
+    with path_locks.lock_for(db, lock_keys):
+        old_db_path = file.path.replace("\\", "/")
+        old_path_obj = Path(old_db_path)
     
-    new_db_path = (old_path_obj.parent / final_name).as_posix()
+        new_db_path = (old_path_obj.parent / final_name).as_posix()
     
-    old_full_disk_path = Path(UPLOAD_DIR).parent / old_db_path
-    new_full_disk_path = Path(UPLOAD_DIR).parent / new_db_path
-
-    if new_full_disk_path.exists():
-        raise HTTPException(status_code=400, detail="A file or folder with this name already exists")
+        taken = (not layout.BY_ID and storage.exists(new_db_path)) or db.query(models.FileModel.id).filter(
+            models.FileModel.path == new_db_path
+        ).first()
+        if taken:
+            raise HTTPException(status_code=400, detail="A file or folder with this name already exists")
 
-    try:
-        if old_full_disk_path.exists():
-            old_full_disk_path.rename(new_full_disk_path)
+        try:
+            relocate(file, new_db_path, db)
+            if file.is_folder:
+                versions.bump_tree(db, old_db_path)
 
-        file.filename = final_name
-        file.path = new_db_path
+            file.filename = final_name
+            file.path = new_db_path
 
-        if file.is_folder:
-            old_prefix = old_db_path if old_db_path.endswith('/') else f"{old_db_path}/"
-            new_prefix = new_db_path if new_db_path.endswith('/') else f"{new_db_path}/"
+            if file.is_folder:
+                old_prefix = old_db_path if old_db_path.endswith('/') else f"{old_db_path}/"
+                new_prefix = new_db_path if new_db_path.endswith('/') else f"{new_db_path}/"
 
-            children = (
-                db.query(models.FileModel)
-                .filter(models.FileModel.path.like(f"{old_prefix}%") | 
-                        models.FileModel.path.like(f"{old_prefix.replace('/', '\\')}%"))
-                .all()
-            )
+                children = (
+                    db.query(models.FileModel)
+                    .filter(models.FileModel.path.like(f"{old_prefix}%") | 
+                            models.FileModel.path.like(f"{old_prefix.replace('/', '\\')}%"))
+                    .all()
+                )
 
-            for child in children:
-                current_child_path = child.path.replace("\\", "/")
-                child.path = current_child_path.replace(old_prefix, new_prefix, 1)
+                for child in children:
+                    current_child_path = child.path.replace("\\", "/")
+                    child.path = current_child_path.replace(old_prefix, new_prefix, 1)
 
-        db.commit()
-        return {"message": "Successfully Renamed", "new_name": final_name, "new_path": new_db_path}
+            listing_changed(db, "rename", file)
+            db.commit()
+            return {"message": "Successfully Renamed", "new_name": final_name, "new_path": new_db_path}
 
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Rename failed: {str(e)}")
+        except Exception as e:
+            db.rollback()
+            raise HTTPException(status_code=500, detail=f"Rename failed: {str(e)}")
 
 #star
 @router.put("/star")
@@ -866,7 +1473,7 @@ def star_file_or_folder(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    file = db.query(models.FileModel).filter(models.FileModel.id == file_id).first()
+    file = live_files(db).filter(models.FileModel.id == file_id).first()
 
     if not file:
         raise HTTPException(status_code=404, detail="File/folder not found")
@@ -875,10 +1482,11 @@ def star_file_or_folder(
         file.is_star = not file.is_star
 
         db.add(file)
+        listing_changed(db, "star" if file.is_star else "unstar", file)
         db.commit()
         db.refresh(file)
 
-        utils.append_log(file.id, f"{current_user.username} toggled star for '{file.filename}'")
+        utils.append_log(file.id, f"toggled star for '{file.filename}' by", username=current_user.username)
         return {
             "id": file.id,
             "is_star": file.is_star,
@@ -905,42 +1513,47 @@ def search_file(query: str, db: Session = Depends(get_db)):
     return {"results": files}
 
 
-@router.post("/sync-disk-to-db")
-def sync_disk_to_db(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    upload_root = Path(UPLOAD_DIR) 
-    
+def sync_disk_tree(db: Session, current_user, progress=None):
+    """Create DB rows for anything under UPLOAD_DIR that is not indexed yet."""
+    if not storage.can_list:
+        raise HTTPException(400, f"The '{storage.name}' storage backend cannot be scanned; the database is its index")
+
     db_files = {
         f.path.replace("\\", "/"): f
         for f in db.query(models.FileModel).all()
     }
 
     created_count = 0
+    created_ids = set()
+    indexed = {}  # file rows found in storage: their entries, to tell whether their contents changed
 
-    paths = sorted(upload_root.rglob("*"), key=lambda p: len(p.parts))
+    entries = sorted(storage.list(UPLOAD_DIR.as_posix()), key=lambda e: e.key.count("/"))
 
-    for fs_path in paths:
-        if fs_path.name.startswith(".") or fs_path.name == "uploads":
+    for entry in entries:
+        name = entry.key.rpartition("/")[2]
+        if name.startswith(".") or name == "uploads":
+            continue
+        if entry.key == TRASH_DIR.as_posix() or entry.key.startswith(f"{TRASH_DIR.as_posix()}/"):
             continue
 
-        relative_to_root = fs_path.relative_to(upload_root)
-        db_path = utils.to_db_path(relative_to_root)
+        db_path = entry.key
 
         if db_path in db_files:
+            record = db_files[db_path]
+            if not entry.is_folder and not record.is_folder:
+                indexed[record.id] = (record, entry)
             continue
 
         parent_db_path = utils.get_parent_db_path(db_path)
         parent_record = db_files.get(parent_db_path)
 
         new_record = models.FileModel(
-            filename=fs_path.name,
+            filename=name,
             path=db_path,
-            is_folder=fs_path.is_dir(),
+            is_folder=entry.is_folder,
             parent_id=parent_record.id if parent_record else None,
             uploaded_by_id=current_user.id,
-            size=fs_path.stat().st_size if fs_path.is_file() else 0,
+            size=entry.size,
             is_star=False # Assuming default
         )
 
@@ -950,12 +1563,59 @@ def sync_disk_to_db(
             db.flush() 
             db_files[db_path] = new_record 
             created_count += 1
+            rollups.added(db, new_record)
+            if not entry.is_folder:
+                quotas.adjust(db, current_user.id, entry.size)
+            # one event for a new folder, none for what was found inside it
+            if parent_record is None or parent_record.id not in created_ids:
+                listing_changed(db, "create", new_record)
+            created_ids.add(new_record.id)
         except Exception as e:
             db.rollback()
             raise HTTPException(500, f"Error syncing {db_path}: {str(e)}")
 
+        if progress:
+            progress(1, new_record.size or 0)
+
+    refresh_changed(indexed, db)
     db.commit()
 
+    return created_count
+
+REFRESH_BATCH = 1000  # files per metadata query in refresh_changed()
+
+def refresh_changed(indexed: dict, db: Session):
+    """
+    Files edited in storage, behind the app's back: {id: (row, storage entry)}.
+    A new size goes to the row (with its rollups and quota); whatever changed,
+    the metadata is dropped and read again (metadata.forget()).
+    """
+    ids, metas = list(indexed), {}
+    for start in range(0, len(ids), REFRESH_BATCH):
+        batch = ids[start:start + REFRESH_BATCH]
+        metas.update((meta.file_id, meta) for meta in db.query(models.FileMetadata).filter(models.FileMetadata.file_id.in_(batch)))
+    changed = []
+    for file_id, (record, entry) in indexed.items():
+        # a compressed file's entry is its stored size, not what a download delivers
+        resized = not record.codec and entry.size != int(record.size or 0)
+        meta = metas.get(file_id)
+        if not resized and (meta is None or metadata.fresh(meta, record, entry)):
+            continue  # nothing read yet, or still what was read
+        if resized:
+            delta = entry.size - int(record.size or 0)
+            rollups.apply(db, record.parent_id, rollups.Rollup(delta, 0, 0))
+            quotas.adjust(db, record.uploaded_by_id, delta)
+            record.size = entry.size
+        changed.append(file_id)
+    metadata.forget(db, changed)
+
+@router.post("/sync-disk-to-db")
+def sync_disk_to_db(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    created_count = sync_disk_tree(db, current_user)
+
     return {
         "message": "Disk sync completed",
         "created_entries": created_count
@@ -963,14 +1623,28 @@ def sync_disk_to_db(
 
 #recycle bin get
 @router.get("/recyclebin")
-def get_recyclebin(db:Session = Depends(get_db)):
+def get_recyclebin(
+    page: int = Query(1, ge=1),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
     """
-    get all files folder of recyclbin
+    get files folder of recyclbin, newest first, a page at a time
     """
-    items = db.query(models.RecycleBin).all()
-    
-        
-    return {"results":items}    
+    query = db.query(models.RecycleBin)
+    total = query.count()
+    items = (
+        query.order_by(models.RecycleBin.deleted_at.desc(), models.RecycleBin.id.desc())
+        .offset((page - 1) * limit).limit(limit).all()
+    )
+
+    return {
+        "results": items,
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "pages": (total + limit - 1) // limit,
+    }
 
 RECYCLE_BIN_DIR = os.path.join(UPLOAD_DIR, "RecycleBin")
 
@@ -985,6 +1659,100 @@ def restore_file(
     if not recycle_file:
         raise HTTPException(status_code=404, detail="File not found in Recycle Bin")
 
+    with path_locks.lock_for(db, lambda: (restore_lock_keys(recycle_file), [])):
+        restored_file = restore_recycle_item(recycle_file, replace, db, current_user)
+        db.commit()
+        db.refresh(restored_file)
+
+    return {
+        "status": "success",
+        "message": f"File '{restored_file.filename}' restored successfully",
+        "target_path": restored_file.path
+    }
+
+def restore_lock_keys(recycle_file) -> list:
+    # the item in the bin and the names of the folder it goes back into
+    src_path = Path(recycle_file.path)
+    if recycle_file.file_id is None:
+        return [src_path, names_key(src_path.parent.parent)]
+    return [src_path, names_key(Path(recycle_file.original_path or UPLOAD_DIR / recycle_file.filename).parent)]
+
+def restore_recycle_item(recycle_file, replace: bool, db: Session, current_user, undo: list = None) -> models.FileModel:
+    """
+    Put one RecycleBin entry back where it was deleted from, or at the top
+    level when that folder is gone; the caller holds the locks and commits.
+    The subtree's rows were kept, so this is one storage move plus one UPDATE
+    of their paths, whatever the size of the folder. The storage moves are
+    added to `undo`, for a caller that rolls the rows back (_move_to_recycle_bin).
+    """
+    undo = [] if undo is None else undo
+    if recycle_file.file_id is None:
+        restored = restore_legacy_item(recycle_file, replace, db, current_user, undo)
+        listing_changed(db, "create", restored)
+        return restored
+
+    root = db.get(models.FileModel, recycle_file.file_id)
+    if root is None:
+        raise HTTPException(status_code=404, detail="File not found in Recycle Bin")
+    parent = db.get(models.FileModel, recycle_file.parent_id) if recycle_file.parent_id else None
+    if parent is not None and in_trash(parent):
+        parent = None
+    parent_key = record_key(parent) if parent else UPLOAD_DIR.as_posix()
+    target_key = child_key(parent_key, root.filename)
+
+    old_file_db = live_files(db).filter(
+        models.FileModel.parent_id == (parent.id if parent else None),
+        models.FileModel.filename == root.filename,
+        models.FileModel.id != root.id,
+    ).first()
+    # an id-layout item goes back without touching storage, so only its row can be in the way
+    target = None if root.storage_key or (root.is_folder and layout.BY_ID) else storage.stat(target_key)
+
+    if target is not None or old_file_db:
+        if not replace:
+            raise HTTPException(
+                status_code=409,
+                detail=f"File '{root.filename}' already exists at destination."
+            )
+        try:
+            if old_file_db:
+                # what is replaced goes to the RecycleBin in turn
+                _move_to_recycle_bin(old_file_db, current_user, db, commit=False, undo=undo)
+            elif target.is_folder:
+                storage.delete_tree(target_key, tree_keys(db, target_key))
+            else:
+                storage.delete(target_key)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to delete existing file: {str(e)}")
+
+    try:
+        if not layout.BY_ID:
+            storage.make_folder(parent_key)
+        if root.is_folder:
+            move_tree_contents(recycle_file.path, target_key, db)
+        elif not root.storage_key:
+            storage.move(recycle_file.path, target_key)
+    except Exception as e:
+        # what was replaced goes back too
+        undo_storage(undo)
+        raise HTTPException(status_code=500, detail=f"Failed to restore file on disk: {str(e)}")
+    if root.is_folder or not root.storage_key:
+        undo.append(moved_back(recycle_file.path, target_key, root.is_folder, db))
+    if storage.has_folders and not layout.BY_ID:
+        storage.delete_tree(child_key(TRASH_DIR.as_posix(), str(recycle_file.id)), [])
+
+    rebase_paths(db, recycle_file.path, target_key)
+    root.path = target_key
+    root.parent_id = parent.id if parent else None
+    rollups.added(db, root)
+    listing_changed(db, "create", root)
+    db.delete(recycle_file)
+    return root
+
+def restore_legacy_item(recycle_file, replace: bool, db: Session, current_user, undo: list) -> models.FileModel:
+    """Restore an entry from before the central trash: only its own row was kept, in RecycleBin."""
     src_path = Path(recycle_file.path)
     file_name = src_path.name
 
@@ -1008,56 +1776,285 @@ def restore_file(
         target_parent_id = None
 
     target_path = target_folder_disk_path / file_name
+    src_key, target_key = normalize_key(src_path), target_path.as_posix()
+
+    # Important: search using .as_posix() to find the existing DB record
+    old_file_db = db.query(models.FileModel).filter(
+        models.FileModel.path == target_key
+    ).first()
+    # an id-layout item goes back without touching storage, so only its row can be in the way
+    target = None if recycle_file.storage_key else storage.stat(target_key)
 
     # Handle Overwrite Logic
-    if target_path.exists():
-        if not replace:
-            raise HTTPException(
-                status_code=409,
-                detail=f"File '{file_name}' already exists at destination."
-            )
-        else:
-            # Important: search using .as_posix() to find the existing DB record
-            old_file_db = db.query(models.FileModel).filter(
-                models.FileModel.path == target_path.as_posix()
-            ).first()
-            
-            if old_file_db:
-                db.delete(old_file_db)
-                db.commit()
-            
-            try:
-                if target_path.is_file():
-                    target_path.unlink()
-                else:
-                    shutil.rmtree(target_path)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Failed to delete existing file: {str(e)}")
+    if (target is not None or old_file_db) and not replace:
+        raise HTTPException(
+            status_code=409,
+            detail=f"File '{file_name}' already exists at destination."
+        )
+
+    # the item's usage moves to whoever restores it; checked before anything is touched
+    if recycle_file.owner_id != current_user.id:
+        quotas.charge(db, current_user.id, recycle_file.size)
+        quotas.adjust(db, recycle_file.owner_id, -(recycle_file.size or 0))
+
+    if target is not None or old_file_db:
+        keys = tree_keys(db, target_key)
+        if old_file_db:
+            if not old_file_db.is_folder:
+                quotas.adjust(db, old_file_db.uploaded_by_id, -(old_file_db.size or 0))
+            rollups.removed(db, old_file_db)
+            listing_changed(db, "delete", old_file_db)
+            db.delete(old_file_db)
+            db.flush()
+    
+        try:
+            if old_file_db and old_file_db.storage_key:
+                storage.delete(old_file_db.storage_key)
+            if target is not None and not target.is_folder:
+                storage.delete(target_key)
+            elif target is not None or (old_file_db and old_file_db.is_folder):
+                storage.delete_tree(target_key, keys)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to delete existing file: {str(e)}")
 
-    # Physical Move
+    # Storage Move
     try:
-        target_folder_disk_path.mkdir(parents=True, exist_ok=True)
-        # Use .as_posix() or string conversion for shutil
-        shutil.move(src_path.as_posix(), target_path.as_posix())
+        if not layout.BY_ID:
+            storage.make_folder(target_folder_disk_path.as_posix())
+        if recycle_file.is_folder:
+            move_tree_contents(src_key, target_key, db)
+        elif not recycle_file.storage_key:
+            storage.move(src_key, target_key)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to restore file on disk: {str(e)}")
+    if recycle_file.is_folder or not recycle_file.storage_key:
+        undo.append(moved_back(src_key, target_key, recycle_file.is_folder, db))
 
     # DB Update
     db.delete(recycle_file)  # remove from recycle bin
-    
+
     restored_file = models.FileModel(
         filename=file_name,
         path=target_path.as_posix(),  
         uploaded_by_id=current_user.id,
         is_folder=recycle_file.is_folder,
         parent_id=target_parent_id,
+        storage_key=recycle_file.storage_key,
+        size=recycle_file.size,
+        **content_fields(recycle_file),
     )
     db.add(restored_file)
+    rollups.added(db, restored_file)
+    return restored_file
+
+#bulk operations: one id lookup, one transaction, one result per requested id
+def _dedupe(ids: List[int]) -> List[int]:
+    return list(dict.fromkeys(ids))
+
+@router.post("/bulk/delete", summary="Move many files/folders to RecycleBin at once")
+def bulk_delete(
+    request: DeleteRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    ids = _dedupe(request.file_ids)
+    records = {f.id: f for f in live_files(db).filter(models.FileModel.id.in_(ids)).all()}
+    results = {file_id: {"id": file_id, "status": "not_found"} for file_id in ids if file_id not in records}
+
+    # a selected folder takes its selected descendants with it, and they share its outcome
+    roots, nested = outermost(records.values())
+    root_of = {
+        record.id: next(
+            root.id for root in roots
+            if root.is_folder and normalize_key(record.path).startswith(f"{normalize_key(root.path)}/")
+        )
+        for record in nested
+    }
+
+    def lock_keys():
+        return [key for record in roots for key in recycle_lock_keys(record)], []
+
+    with path_locks.lock_for(db, lock_keys):
+        for record in roots:
+            # a savepoint per item: a failed one leaves nothing behind in the transaction, or in storage
+            undo = []
+            try:
+                with db.begin_nested():
+                    _move_to_recycle_bin(record, current_user, db, commit=False, undo=undo)
+                results[record.id] = {"id": record.id, "status": "deleted"}
+            except HTTPException as e:
+                undo_storage(undo)
+                results[record.id] = {"id": record.id, "status": "error", "detail": e.detail}
+            except Exception as e:
+                undo_storage(undo)
+                results[record.id] = {"id": record.id, "status": "error", "detail": str(e)}
+        db.commit()
+
+    for record in nested:
+        outcome = results[root_of[record.id]]
+        results[record.id] = {"id": record.id, "status": outcome["status"], "detail": (
+            "Deleted with its parent folder" if outcome["status"] == "deleted"
+            else f"Not deleted with its parent folder: {outcome['detail']}"
+        )}
+
+    for record in roots:
+        if results[record.id]["status"] == "deleted":
+            utils.append_log(record.id, f" deleted file {record.filename}  by", username=current_user.username)
+
+    return {"results": [results[file_id] for file_id in ids]}
+
+@router.post("/bulk/star", summary="Star or unstar many files/folders at once")
+def bulk_star(
+    request: BulkStarRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    ids = _dedupe(request.file_ids)
+    records = {f.id: f for f in live_files(db).filter(models.FileModel.id.in_(ids)).all()}
+
+    action = "Star" if request.is_star else "Unstar"
+    logs = []
+    for record in records.values():
+        record.is_star = request.is_star
+        logs.append(models.FileLog(file_id=record.id, user_id=current_user.id, action=action))
+        changes.record(db, action.lower(), record)
+    versions.bump(db, {record.parent_id for record in records.values()})
+    db.add_all(logs)
     db.commit()
-    db.refresh(restored_file)
 
-    return {
-        "status": "success",
-        "message": f"File '{file_name}' restored successfully",
-        "target_path": restored_file.path
-    }
\ No newline at end of file
+    for record in records.values():
+        utils.append_log(record.id, f"{action.lower()}red '{record.filename}' by", username=current_user.username)
+
+    return {"results": [
+        {"id": file_id, "status": "ok", "is_star": request.is_star} if file_id in records
+        else {"id": file_id, "status": "not_found"}
+        for file_id in ids
+    ]}
+
+@router.post("/bulk/restore", summary="Restore many RecycleBin items at once")
+def bulk_restore(
+    request: RestoreRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    ids = _dedupe(request.recycle_ids)
+    items = {r.id: r for r in db.query(models.RecycleBin).filter(models.RecycleBin.id.in_(ids)).all()}
+    results = {rid: {"id": rid, "status": "not_found"} for rid in ids if rid not in items}
+
+    def lock_keys():
+        return [key for item in items.values() for key in restore_lock_keys(item)], []
+
+    restored = {}
+    with path_locks.lock_for(db, lock_keys):
+        for rid, item in items.items():
+            undo = []
+            try:
+                with db.begin_nested():
+                    record = restore_recycle_item(item, request.replace, db, current_user, undo)
+                restored[rid] = record
+            except HTTPException as e:
+                undo_storage(undo)
+                results[rid] = {"id": rid, "status": "error", "detail": e.detail}
+            except Exception as e:
+                undo_storage(undo)
+                results[rid] = {"id": rid, "status": "error", "detail": str(e)}
+
+        db.flush()
+        db.add_all([
+            models.FileLog(file_id=record.id, user_id=current_user.id, action="Restore")
+            for record in restored.values()
+        ])
+        db.commit()
+
+    for rid, record in restored.items():
+        results[rid] = {"id": rid, "status": "restored", "file_id": record.id, "target_path": record.path}
+
+    return {"results": [results[rid] for rid in ids]}
+
+def purge_recycle_items(items, db: Session) -> dict:
+    """
+    Delete RecycleBin items, with their subtrees' rows and stored contents,
+    for good, giving their size back to the owners' quotas; {id: result} per
+    item. The caller holds the locks and commits.
+    """
+    items = list(items)
+    results = {}
+    subtrees = {
+        item.id: db.query(models.FileModel).filter(
+            (models.FileModel.path == item.path) | models.FileModel.path.startswith(f"{item.path}/", autoescape=True)
+        ).all() if item.file_id is not None else []
+        for item in items
+    }
+
+    # files go to the backend as one batch, folders one tree at a time
+    files = [item for item in items if not item.is_folder]
+    keys = [item.storage_key or item.path for item in files]
+    keys += [row.storage_key for item in items if item.is_folder for row in subtrees[item.id] if row.storage_key]
+    try:
+        storage.delete_many(keys)
+    except Exception as e:
+        for item in files:
+            results[item.id] = {"id": item.id, "status": "error", "detail": f"Error deleting file/folder: {e}"}
+
+    for item in items:
+        if item.id in results:
+            continue
+        if item.is_folder:
+            try:
+                storage.delete_tree(item.path, tree_keys(db, item.path) if item.file_id is not None else tree_keys(db))
+            except Exception as e:
+                results[item.id] = {"id": item.id, "status": "error", "detail": f"Error deleting file/folder: {e}"}
+                continue
+        if item.file_id is not None and storage.has_folders and not layout.BY_ID:
+            storage.delete_tree(child_key(TRASH_DIR.as_posix(), str(item.id)), [])
+
+        db.delete(item)
+        db.flush()
+        if item.file_id is None:
+            quotas.adjust(db, item.owner_id, -(item.size or 0))
+        else:
+            purge_rows(db, subtrees[item.id])
+        results[item.id] = {"id": item.id, "status": "deleted"}
+    return results
+
+def purge_rows(db: Session, rows):
+    """Delete the rows of a trashed subtree and take their files off their uploaders' usage."""
+    usage = {}
+    for row in rows:
+        if not row.is_folder:
+            usage[row.uploaded_by_id] = usage.get(row.uploaded_by_id, 0) + (row.size or 0)
+    for user_id, size in usage.items():
+        quotas.adjust(db, user_id, -size)
+    ids = [row.id for row in rows]
+    for start in range(0, len(ids), 1000):
+        batch = ids[start:start + 1000]
+        # detached from each other first, so the order of the deletes doesn't matter to the parent_id key
+        db.query(models.FileModel).filter(models.FileModel.id.in_(batch)).update(
+            {models.FileModel.parent_id: None}, synchronize_session=False
+        )
+    for start in range(0, len(ids), 1000):
+        db.query(models.FileModel).filter(models.FileModel.id.in_(ids[start:start + 1000])).delete(
+            synchronize_session=False
+        )
+    for row in rows:
+        db.expunge(row)
+
+@router.post("/bulk/permanent-delete", summary="Permanently delete many RecycleBin items at once")
+def bulk_permanent_delete(
+    request: PermanentDeleteRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(role_required("admin")),
+):
+    ids = _dedupe(request.recycle_ids)
+    items = {r.id: r for r in db.query(models.RecycleBin).filter(models.RecycleBin.id.in_(ids)).all()}
+    results = {rid: {"id": rid, "status": "not_found"} for rid in ids if rid not in items}
+
+    with path_locks.lock_for(db, lambda: ([item.path for item in items.values()], [])):
+        results.update(purge_recycle_items(items.values(), db))
+        db.commit()
+
+    for rid, result in results.items():
+        if result["status"] == "deleted":
+            utils.append_log(rid, f" permanently deleted from RecycleBin by", username=current_user.username)
+
+    return {"results": [results[rid] for rid in ids]}
@@ -0,0 +1,94 @@
+"""
+Subtrees for GET /files/tree/{folder_id}: everything below a folder as
+nested FolderResponse objects, so the sidebar gets the folders it expands
+in one request instead of one listing per node.
+
+The subtree is read in one recursive CTE over parent_id, down to `depth`
+levels and optionally folders only, with just the columns the response
+shows. The rows are grouped by parent in one pass and written out depth
+first as JSON fragments of about CHUNK_SIZE bytes, so the response is
+never built as nested objects however large the tree is.
+"""
+import json
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import case, func, literal, select
+from sqlalchemy.orm import aliased
+
+from app import models
+
+CHUNK_SIZE = 64 * 1024  # bytes of JSON per streamed chunk
+
+
+def subtree_rows(db, folder_id, trash_prefix: str, depth: Optional[int] = None, folders_only: bool = False):
+    """
+    The rows below `folder_id` (0: the top level), `depth` levels deep (None:
+    all), ordered for display; rows under `trash_prefix` are left out.
+    """
+    def listed(table):
+        conditions = [~func.coalesce(table.path, "").startswith(trash_prefix, autoescape=True)]
+        if folders_only:
+            conditions.append(table.is_folder == True)
+        return conditions
+
+    def columns(table):
+        size = case((table.is_folder == True, table.tree_size), else_=table.size)
+        return table.id, table.filename, table.parent_id, table.uploaded_at, table.is_folder, size.label("size")
+
+    top = models.FileModel
+    parent = top.parent_id == folder_id if folder_id else top.parent_id == None
+    tree = select(*columns(top), literal(1).label("level")).where(parent, *listed(top)).cte("tree", recursive=True)
+
+    child = aliased(models.FileModel)
+    below = (
+        select(*columns(child), (tree.c.level + 1).label("level"))
+        .join(tree, child.parent_id == tree.c.id)
+        .where(tree.c.is_folder == True, *listed(child))
+    )
+    if depth is not None:
+        below = below.where(tree.c.level < depth)
+    tree = tree.union_all(below)
+    return db.execute(select(tree).order_by(tree.c.is_folder.desc(), tree.c.filename)).all()
+
+
+def _node(row, depth: Optional[int]) -> str:
+    """A row's object without its closing brace, up to the opening bracket of its children if it has any."""
+    opened = bool(row.is_folder) and (depth is None or row.level < depth)
+    fields = json.dumps({
+        "id": row.id,
+        "name": row.filename,
+        "parent_id": row.parent_id,
+        "created_at": row.uploaded_at.isoformat() if row.uploaded_at else None,
+        "is_folder": bool(row.is_folder),
+        "size": int(row.size or 0),
+    })
+    # children: null for files and for folders below the depth asked for, which the client expands later
+    return fields[:-1] + (', "children": [' if opened else ', "children": null}')
+
+
+def stream_tree(rows, folder_id, depth: Optional[int] = None):
+    """The rows of subtree_rows() as a JSON list of nested nodes, in chunks."""
+    children = defaultdict(list)
+    for row in rows:
+        children[row.parent_id].append(row)
+
+    parts, size = ["["], 1
+    stack = [[iter(children.pop(folder_id or None, ())), True]]  # [children left, none written yet]
+    while stack:
+        level = stack[-1]
+        row = next(level[0], None)
+        if row is None:
+            stack.pop()
+            part = "]}" if stack else "]"
+        else:
+            part = ("" if level[1] else ", ") + _node(row, depth)
+            level[1] = False
+            if part.endswith("["):
+                stack.append([iter(children.pop(row.id, ())), True])
+        parts.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield "".join(parts)
+            parts, size = [], 0
+    yield "".join(parts)
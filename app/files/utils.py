@@ -1,3 +1,6 @@
+import atexit
+import queue
+import threading
 from pathlib import Path
 from datetime import datetime
 
@@ -23,12 +26,70 @@ def get_log_path(file_id: int) -> Path:
     return LOG_DIR / f"file_{file_id}.txt"
 
 
+class LogWriter:
+    """
+    Appends audit log lines from one background thread, so request handlers
+    only put a line on a queue instead of opening a file per action.
+    Readers call flush() first to see every line queued so far.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def put(self, log_file: Path, line: str):
+        if self._thread is None:
+            self._start()
+        self._queue.put((log_file, line))
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until every queued line is on disk."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # one open() per file per batch
+            by_file = {}
+            for log_file, line in batch:
+                by_file.setdefault(log_file, []).append(line)
+            for log_file, lines in by_file.items():
+                try:
+                    with open(log_file, "a", encoding="utf-8") as f:
+                        f.writelines(lines)
+                except OSError as e:
+                    print(f"Warning: could not write {len(lines)} log line(s) to {log_file}: {e}")
+
+            for _ in batch:
+                self._queue.task_done()
+
+
+log_writer = LogWriter()
+
+
 def append_log(file_id: int, message: str, username: str):
     """Append a new line into the log file for a given file/folder"""
     log_file = get_log_path(file_id)
     timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")  
-    with open(log_file, "a", encoding="utf-8") as f:
-        f.write(f"[{timestamp}] {message} {username}\n ")
+    log_writer.put(log_file, f"[{timestamp}] {message} {username}\n ")
         
 def get_folder_full_path(folder: models.FileModel):
     """Return the full path on disk for a folder object."""
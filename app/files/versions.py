@@ -0,0 +1,118 @@
+"""
+Listing versions, for ETags on GET /files/folder/{id} and GET /files/.
+
+Every folder row has a version that goes up with any change to what its
+listing shows: a child created, renamed, moved in or out, deleted, restored
+or starred (routes.listing_changed), a child folder's rollup
+(rollups.apply, which bumps the whole ancestor chain in the UPDATE it
+already makes) and the paths at or below it (bump_tree). The top level has
+no row: its version pairs the "root_version" counter, bumped when top-level
+entries come, go, are renamed or starred, with the sum of those entries' own
+versions, which their rollups bump. While the counter stays the same the
+entries do too and the sum only grows, so the pair never repeats, and a
+change deep in the tree writes no row that every writer shares.
+
+A listing's ETag is the folder, its version and the query parameters, so a
+request whose If-None-Match still matches gets a 304 after one primary key
+lookup, without the listing queries or serialization; the same version tells
+whether a cached listing (app.files.listing_cache) is still good. The
+version is read before the listing: a change in between gives the new
+listing the old ETag, which only costs the client one more full response.
+"""
+import hashlib
+from typing import Optional, Union
+
+from fastapi import Request, Response
+from sqlalchemy import func, or_, update
+
+from app import models
+from app.config import LISTING_CACHE_SIZE
+from app.files import listing_cache
+from app.utils import metrics
+
+ROOT_VERSION = "root_version"
+ETAG_FORMAT = 1  # part of every ETag; bump when the listing responses change shape
+
+
+def bump(db, folder_ids):
+    """The listings of `folder_ids` (None or 0: the top level) changed."""
+    ids = set(folder_ids)
+    listing_cache.changed(db, ids)
+    if ids & {None, 0}:
+        counter = models.Counter
+        bumped = db.execute(update(counter).where(counter.name == ROOT_VERSION).values(value=counter.value + 1))
+        if bumped.rowcount == 0:
+            db.add(counter(name=ROOT_VERSION, value=1))
+            db.flush()
+    ids -= {None, 0}
+    if ids:
+        db.execute(
+            update(models.FileModel).where(models.FileModel.id.in_(ids))
+            .values(version=models.FileModel.version + 1)
+        )
+
+
+def bump_tree(db, path: str):
+    """The folder at `path` and every folder below it: the paths their listings show change."""
+    path = path.replace("\\", "/").rstrip("/")
+    folders = (
+        models.FileModel.is_folder == True,
+        or_(models.FileModel.path == path, models.FileModel.path.startswith(f"{path}/", autoescape=True)),
+    )
+    if LISTING_CACHE_SIZE:
+        listing_cache.changed(db, [folder_id for (folder_id,) in db.query(models.FileModel.id).filter(*folders)])
+    db.execute(
+        update(models.FileModel).where(*folders).values(version=models.FileModel.version + 1),
+        execution_options={"synchronize_session": "fetch"},
+    )
+
+
+def version(db, folder_id) -> Union[int, str, None]:
+    """A folder's listing version ("<counter>.<entries>" for the top level), None when there is no such folder."""
+    if not folder_id:
+        counter = db.query(models.Counter.value).filter(models.Counter.name == ROOT_VERSION).scalar()
+        # the same entries as the top-level listings show
+        entries = db.query(func.coalesce(func.sum(models.FileModel.version), 0)).filter(
+            models.FileModel.parent_id == None, ~func.coalesce(models.FileModel.path, "").ilike("%recyclebin%")
+        ).scalar()
+        return f"{counter or 0}.{entries}"
+    return db.query(models.FileModel.version).filter(models.FileModel.id == folder_id).scalar()
+
+
+def listing_etag(folder_id, current: Union[int, str, None], **params) -> Optional[str]:
+    """The ETag of a listing of `folder_id` at version `current`."""
+    if current is None:
+        return None
+    query = "&".join(f"{name}={params[name]}" for name in sorted(params))
+    digest = hashlib.sha1(f"{ETAG_FORMAT}?{query}".encode()).hexdigest()[:12]
+    return f'W/"{folder_id or 0}-{current}-{digest}"'
+
+
+def matches(request: Request, etag: Optional[str]) -> bool:
+    header = request.headers.get("if-none-match")
+    if not etag or not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison, as If-None-Match wants
+    return etag.removeprefix("W/") in {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+def not_modified(request: Request, etag: Optional[str], route: str) -> Optional[Response]:
+    """The 304 for a conditional request whose ETag still matches; None when the listing has to be sent."""
+    if not request.headers.get("if-none-match"):
+        result = "unconditional"
+    else:
+        result = "not_modified" if matches(request, etag) else "modified"
+    metrics.listing_requests.inc(route=route, result=result)
+    if result != "not_modified":
+        return None
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+def cache_headers(etag: Optional[str]) -> dict:
+    # private: listings need a token; no-cache: reuse only after a conditional request
+    headers = {"Cache-Control": "private, no-cache"}
+    if etag:
+        headers["ETag"] = etag
+    return headers
@@ -0,0 +1,355 @@
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import (
+    JOB_CONCURRENCY,
+    JOB_OUTPUT_DIR,
+    JOB_OUTPUT_PRUNE_INTERVAL,
+    JOB_OUTPUT_RETENTION,
+    JOB_PROGRESS_INTERVAL,
+)
+from app.database import SessionLocal
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(BaseException):
+    """
+    Raised from JobContext when a cancel was requested.
+    Derives from BaseException (like asyncio.CancelledError) so the generic
+    `except Exception` blocks in the file helpers don't swallow it.
+    """
+
+
+class JobContext:
+    """Progress/cancel handle passed to every operation handler."""
+
+    def __init__(self, job_id: int, cancel_event: threading.Event, session_factory=SessionLocal):
+        self.job_id = job_id
+        self.cancel_event = cancel_event
+        self.session_factory = session_factory
+        self.items_total = 0
+        self.items_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self._last_flush = 0.0
+
+    def set_total(self, items: int = None, bytes: int = None):
+        if items is not None:
+            self.items_total = items
+        if bytes is not None:
+            self.bytes_total = bytes
+        self.flush()
+
+    def advance(self, items: int = 0, bytes: int = 0):
+        """Record finished work; also the point where a cancel takes effect."""
+        self.items_done += items
+        self.bytes_done += int(bytes or 0)
+        if time.monotonic() - self._last_flush >= JOB_PROGRESS_INTERVAL:
+            self.flush()
+        self.check_cancelled()
+
+    # handlers take a plain callback(items, bytes)
+    __call__ = advance
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def flush(self):
+        """Persist progress in its own session and pick up cancels made by other workers."""
+        self._last_flush = time.monotonic()
+        db = self.session_factory()
+        try:
+            db.query(models.Job).filter(models.Job.id == self.job_id).update(
+                {
+                    models.Job.items_total: self.items_total,
+                    models.Job.items_done: self.items_done,
+                    models.Job.bytes_total: self.bytes_total,
+                    models.Job.bytes_done: self.bytes_done,
+                },
+                synchronize_session=False,
+            )
+            db.commit()
+            cancel = db.query(models.Job.cancel_requested).filter(models.Job.id == self.job_id).scalar()
+            if cancel:
+                self.cancel_event.set()
+        finally:
+            db.close()
+
+
+class JobEngine:
+    """
+    In-process worker pool for long running file operations.
+    Each operation type gets its own ThreadPoolExecutor so a slow zip can't
+    starve deletes; pool sizes come from JOB_CONCURRENCY.
+    """
+
+    def __init__(self, session_factory=SessionLocal, concurrency: dict = None):
+        self.session_factory = session_factory
+        self.concurrency = concurrency or JOB_CONCURRENCY
+        self._executors = {}
+        self._cancel_events = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def _executor(self, operation: str) -> ThreadPoolExecutor:
+        with self._lock:
+            executor = self._executors.get(operation)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency.get(operation, 1),
+                    thread_name_prefix=f"job-{operation}",
+                )
+                self._executors[operation] = executor
+            return executor
+
+    def submit(self, db: Session, operation: str, params: dict, current_user: models.User) -> models.Job:
+        job = models.Job(
+            operation=operation,
+            status="queued",
+            params=json.dumps(params),
+            created_by_id=current_user.id,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self.enqueue(job.id, operation)
+        return job
+
+    def enqueue(self, job_id: int, operation: str):
+        with self._lock:
+            self._cancel_events.setdefault(job_id, threading.Event())
+        self._executor(operation).submit(self._run, job_id)
+
+    def cancel(self, db: Session, job: models.Job):
+        """Queued jobs are cancelled at once, running ones at their next progress step."""
+        if job.status in FINISHED_STATES:
+            return job
+        job.cancel_requested = True
+        # only flip queued -> cancelled if no worker claimed it in the meantime
+        db.query(models.Job).filter(models.Job.id == job.id, models.Job.status == "queued").update(
+            {models.Job.status: "cancelled", models.Job.finished_at: datetime.now()},
+            synchronize_session=False,
+        )
+        db.commit()
+        db.refresh(job)
+        event = self._cancel_events.get(job.id)
+        if event:
+            event.set()
+        return job
+
+    def recover(self):
+        """
+        Called on startup. Jobs left "running" by a dead process are re-queued when
+        the operation is safe to repeat and failed otherwise; queued jobs resume.
+        """
+        from app.jobs.operations import OPERATIONS
+
+        db = self.session_factory()
+        try:
+            for job in db.query(models.Job).filter(models.Job.status == "running").all():
+                if _worker_alive(job.worker):
+                    continue
+                operation = OPERATIONS.get(job.operation)
+                if operation and operation.resumable and not job.cancel_requested:
+                    job.status = "queued"
+                    job.worker = None
+                else:
+                    job.status = "failed"
+                    job.error = "Interrupted by server restart"
+                    job.finished_at = datetime.now()
+            db.commit()
+
+            queued = db.query(models.Job.id, models.Job.operation).filter(models.Job.status == "queued").all()
+        finally:
+            db.close()
+
+        for job_id, operation in queued:
+            self.enqueue(job_id, operation)
+
+    def shutdown(self):
+        """Stop running handlers at their next progress step; recover() picks them up on restart."""
+        self._stopping = True
+        for event in list(self._cancel_events.values()):
+            event.set()
+        for executor in list(self._executors.values()):
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _claim(self, db: Session, job_id: int) -> bool:
+        claimed = db.query(models.Job).filter(models.Job.id == job_id, models.Job.status == "queued").update(
+            {
+                models.Job.status: "running",
+                models.Job.worker: WORKER_ID,
+                models.Job.started_at: datetime.now(),
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+        return claimed == 1
+
+    def _finish(self, job_id: int, status: str, result=None, error: str = None, ctx: JobContext = None):
+        db = self.session_factory()
+        try:
+            values = {
+                models.Job.status: status,
+                models.Job.error: error,
+                models.Job.finished_at: datetime.now(),
+            }
+            if result is not None:
+                values[models.Job.result] = json.dumps(result, default=str)
+            if ctx:
+                values.update({
+                    models.Job.items_total: max(ctx.items_total, ctx.items_done),
+                    models.Job.items_done: ctx.items_done,
+                    models.Job.bytes_total: max(ctx.bytes_total, ctx.bytes_done),
+                    models.Job.bytes_done: ctx.bytes_done,
+                })
+            db.query(models.Job).filter(models.Job.id == job_id).update(values, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _run(self, job_id: int):
+        from app.jobs.operations import OPERATIONS
+
+        cancel_event = self._cancel_events.setdefault(job_id, threading.Event())
+        db = self.session_factory()
+        ctx = None
+        try:
+            if not self._claim(db, job_id):
+                return
+
+            job = db.query(models.Job).filter(models.Job.id == job_id).first()
+            operation = OPERATIONS.get(job.operation)
+            if operation is None:
+                self._finish(job_id, "failed", error=f"Unknown operation '{job.operation}'")
+                return
+
+            current_user = db.query(models.User).filter(models.User.id == job.created_by_id).first()
+            params = operation.params_model(**json.loads(job.params or "{}"))
+            ctx = JobContext(job_id, cancel_event, self.session_factory)
+            if job.cancel_requested:
+                cancel_event.set()
+            ctx.check_cancelled()
+
+            result = operation.handler(params, db, current_user, ctx)
+            self._finish(job_id, "succeeded", result=result, ctx=ctx)
+
+        except JobCancelled:
+            db.rollback()
+            if not self._stopping:
+                self._finish(job_id, "cancelled", ctx=ctx)
+        except HTTPException as e:
+            db.rollback()
+            self._finish(job_id, "failed", error=str(e.detail), ctx=ctx)
+        except Exception as e:
+            db.rollback()
+            print(f"Job {job_id} failed: {e}")
+            self._finish(job_id, "failed", error=str(e), ctx=ctx)
+        finally:
+            db.close()
+            self._cancel_events.pop(job_id, None)
+
+
+def _worker_alive(worker: str) -> bool:
+    """True when `worker` is another live process on this host."""
+    if not worker:
+        return False
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname():
+        # can't probe processes on other hosts, leave their jobs alone
+        return True
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+job_engine = JobEngine()
+
+
+#result files
+def output_job_id(name: str):
+    """The job a file in JOB_OUTPUT_DIR belongs to ("job_12.zip" -> 12), None for anything else."""
+    stem, _, _ = name.partition(".")
+    prefix, _, job_id = stem.partition("_")
+    return int(job_id) if prefix == "job" and job_id.isdigit() else None
+
+
+def prune_outputs(db: Session, retention: float = JOB_OUTPUT_RETENTION) -> int:
+    """Delete result files of jobs that finished more than `retention` seconds ago, or whose row is gone."""
+    if not JOB_OUTPUT_DIR.is_dir():
+        return 0
+    files = {}
+    for path in JOB_OUTPUT_DIR.iterdir():
+        job_id = output_job_id(path.name)
+        if job_id is not None:
+            files.setdefault(job_id, []).append(path)
+    if not files:
+        return 0
+
+    cutoff = datetime.now() - timedelta(seconds=retention)
+    jobs = dict(db.query(models.Job.id, models.Job.finished_at).filter(models.Job.id.in_(files)).all())
+    deleted = 0
+    for job_id, paths in files.items():
+        # a queued or running job is still writing its result (no finished_at yet)
+        if job_id in jobs and (jobs[job_id] is None or jobs[job_id] > cutoff):
+            continue
+        for path in paths:
+            path.unlink(missing_ok=True)
+            deleted += 1
+    return deleted
+
+
+class OutputPruner:
+    """Runs prune_outputs() in a background thread every `interval` seconds."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, interval: float = JOB_OUTPUT_PRUNE_INTERVAL):
+        if self._thread is not None or interval <= 0 or JOB_OUTPUT_RETENTION <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="job-output-pruner", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self, interval: float):
+        while not self._stop.wait(interval):
+            db = SessionLocal()
+            try:
+                deleted = prune_outputs(db)
+                if deleted:
+                    print(f"Job results pruned: {deleted}")
+            except Exception as e:
+                db.rollback()
+                print(f"Warning: pruning job results failed: {e}")
+            finally:
+                db.close()
+
+
+output_pruner = OutputPruner()
@@ -0,0 +1,149 @@
+from collections import namedtuple
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import JOB_OUTPUT_DIR, QUOTA_RECONCILE_BATCH, RECYCLE_RETENTION_DAYS
+from app.files import downloads, purge, quotas, utils
+from app.files import routes as file_routes
+from app.schemas import (
+    CopyRequest,
+    DeleteRequest,
+    MoveRequest,
+    PurgeRecycleBinRequest,
+    ReconcileQuotasRequest,
+    RestoreRequest,
+    SyncRequest,
+    ZipRequest,
+)
+
+# params_model validates the submitted params, resumable jobs are re-queued after a crash
+Operation = namedtuple("Operation", ["params_model", "handler", "resumable"])
+
+
+def subtree_totals(records) -> tuple:
+    """(entries, bytes) for the given records including everything below them."""
+    items, size = 0, 0
+    stack = list(records)
+    while stack:
+        record = stack.pop()
+        items += 1
+        size += int(record.size or 0)
+        if record.is_folder:
+            stack.extend(record.children)
+    return items, size
+
+
+def run_copy(params: CopyRequest, db: Session, current_user: models.User, ctx):
+    dest_id = params.destination_folder_id if params.destination_folder_id != 0 else None
+    sources = db.query(models.FileModel).filter(models.FileModel.id.in_(params.file_ids)).all()
+    items, size = subtree_totals(sources)
+    ctx.set_total(items=items, bytes=size)
+
+    copied = file_routes.copy_records(params.file_ids, dest_id, db, current_user, progress=ctx)
+    return {"copied_files": copied}
+
+
+def run_move(params: MoveRequest, db: Session, current_user: models.User, ctx):
+    sources = db.query(models.FileModel).filter(models.FileModel.id.in_(params.file_ids)).all()
+    ctx.set_total(items=len(sources), bytes=sum(int(f.size or 0) for f in sources))
+
+    moved = file_routes.move_records(params.file_ids, params.destination_folder_id, db, progress=ctx)
+    return {"moved_files": moved}
+
+
+def run_delete(params: DeleteRequest, db: Session, current_user: models.User, ctx):
+    ctx.set_total(items=len(params.file_ids))
+
+    deleted, missing = [], []
+    for file_id in params.file_ids:
+        file_db = file_routes.live_files(db).filter(models.FileModel.id == file_id).first()
+        if not file_db:
+            # gone or already in the trash, e.g. when a resumed job repeats an item
+            missing.append(file_id)
+            ctx.advance(1)
+            continue
+
+        size = int(file_db.size or 0)
+        utils.append_log(file_db.id, f" deleted file {file_db.filename}  by", username=current_user.username)
+        file_routes.move_to_recycle_bin_db(file_db, current_user, db)
+        db.commit()
+
+        deleted.append(file_id)
+        ctx.advance(1, size)
+
+    return {"deleted_file_ids": deleted, "missing_file_ids": missing}
+
+
+def run_zip(params: ZipRequest, db: Session, current_user: models.User, ctx):
+    folder = db.query(models.FileModel).filter(models.FileModel.id == params.folder_id).first()
+    if not folder or not folder.is_folder:
+        raise HTTPException(404, "Folder not found")
+
+    folder_key = utils.get_folder_full_path(folder).as_posix()
+    if not file_routes.stored(folder_key, True):
+        raise HTTPException(404, "Folder not found")
+
+    files = [member for member in file_routes.zip_members(folder, db) if not member[1].is_folder]
+    ctx.set_total(items=len(files), bytes=sum(packed.size if packed else e.size for _, e, packed in files))
+
+    JOB_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    zip_path = JOB_OUTPUT_DIR / f"job_{ctx.job_id}.zip"
+    try:
+        downloads.write_zip(files, zip_path, progress=ctx.advance)
+    except BaseException:
+        zip_path.unlink(missing_ok=True)
+        raise
+
+    db.add(models.FileLog(file_id=folder.id, user_id=current_user.id, action="Download"))
+    db.commit()
+    return {"file": zip_path.name, "filename": f"{folder.filename}.zip"}
+
+
+def run_restore(params: RestoreRequest, db: Session, current_user: models.User, ctx):
+    ctx.set_total(items=len(params.recycle_ids))
+
+    restored, failed = [], []
+    for recycle_id in params.recycle_ids:
+        try:
+            result = file_routes.restore_file(recycle_id, params.replace, db, current_user)
+            restored.append({"id": recycle_id, "target_path": result["target_path"]})
+        except HTTPException as e:
+            db.rollback()
+            failed.append({"id": recycle_id, "detail": e.detail})
+        ctx.advance(1)
+
+    return {"restored": restored, "failed": failed}
+
+
+def run_sync(params: SyncRequest, db: Session, current_user: models.User, ctx):
+    created = file_routes.sync_disk_tree(db, current_user, progress=ctx)
+    return {"created_entries": created}
+
+
+def run_reconcile_quotas(params: ReconcileQuotasRequest, db: Session, current_user: models.User, ctx):
+    if current_user.role != "admin":
+        raise HTTPException(403, "Only admins can reconcile quotas")
+    ctx.set_total(items=db.query(models.User).count())
+
+    return quotas.reconcile(db, params.batch_size or QUOTA_RECONCILE_BATCH, progress=ctx.advance)
+
+
+def run_purge_recycle_bin(params: PurgeRecycleBinRequest, db: Session, current_user: models.User, ctx):
+    if current_user.role != "admin":
+        raise HTTPException(403, "Only admins can purge the RecycleBin")
+    days = RECYCLE_RETENTION_DAYS if params.days is None else params.days
+    return purge.purge_expired(db, days, stop=ctx.cancel_event, progress=ctx.advance)
+
+
+OPERATIONS = {
+    "copy": Operation(CopyRequest, run_copy, False),
+    "move": Operation(MoveRequest, run_move, False),
+    "delete": Operation(DeleteRequest, run_delete, True),
+    "zip": Operation(ZipRequest, run_zip, True),
+    "restore": Operation(RestoreRequest, run_restore, False),
+    "sync": Operation(SyncRequest, run_sync, True),
+    "reconcile_quotas": Operation(ReconcileQuotasRequest, run_reconcile_quotas, True),
+    "purge_recycle_bin": Operation(PurgeRecycleBinRequest, run_purge_recycle_bin, True),
+}
@@ -0,0 +1,126 @@
+import json
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+from app.auth.utils import get_current_user
+from app.config import JOB_OUTPUT_DIR
+from app.database import get_db
+from app.jobs.engine import job_engine
+from app.jobs.operations import OPERATIONS
+from app.utils.metrics import MeteredFileResponse
+from app.utils.profiler import ProfiledRoute
+
+router = APIRouter(route_class=ProfiledRoute)
+
+
+def job_to_dict(job: models.Job) -> dict:
+    return {
+        "id": job.id,
+        "operation": job.operation,
+        "status": job.status,
+        "items_total": job.items_total or 0,
+        "items_done": job.items_done or 0,
+        "bytes_total": job.bytes_total or 0,
+        "bytes_done": job.bytes_done or 0,
+        "cancel_requested": bool(job.cancel_requested),
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def get_job_or_404(job_id: int, db: Session, current_user: models.User) -> models.Job:
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if not job or (job.created_by_id != current_user.id and current_user.role != "admin"):
+        raise HTTPException(404, "Job not found")
+    return job
+
+
+#submit job
+@router.post("/", summary="Queue a long running file operation")
+def submit_job(
+    request: schemas.JobSubmit,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    operation = OPERATIONS.get(request.operation)
+    if not operation:
+        raise HTTPException(400, f"Unknown operation '{request.operation}'. Use one of: {', '.join(OPERATIONS)}")
+
+    try:
+        params = operation.params_model(**request.params)
+    except ValidationError as e:
+        raise HTTPException(422, e.errors())
+
+    job = job_engine.submit(db, request.operation, params.model_dump(), current_user)
+    return {"job_id": job.id, "status": job.status}
+
+
+#list own jobs (admin sees all)
+@router.get("/", summary="List jobs")
+def list_jobs(
+    page: int = 1,
+    limit: int = 20,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    query = db.query(models.Job)
+    if current_user.role != "admin":
+        query = query.filter(models.Job.created_by_id == current_user.id)
+
+    total = query.count()
+    jobs = query.order_by(models.Job.id.desc()).offset((page - 1) * limit).limit(limit).all()
+
+    return {
+        "data": [job_to_dict(job) for job in jobs],
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "pages": (total + limit - 1) // limit,
+    }
+
+
+#poll progress
+@router.get("/{job_id}", summary="Get job status and progress")
+def get_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return job_to_dict(get_job_or_404(job_id, db, current_user))
+
+
+#cancel
+@router.post("/{job_id}/cancel", summary="Cancel a queued or running job")
+def cancel_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    job = get_job_or_404(job_id, db, current_user)
+    job = job_engine.cancel(db, job)
+    return job_to_dict(job)
+
+
+#download result of a zip job
+@router.get("/{job_id}/result", summary="Download the archive produced by a zip job")
+def download_job_result(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    job = get_job_or_404(job_id, db, current_user)
+    if job.status != "succeeded" or job.operation != "zip":
+        raise HTTPException(409, "Job has no downloadable result")
+
+    result = json.loads(job.result)
+    result_path = JOB_OUTPUT_DIR / result["file"]
+    if not result_path.exists():
+        raise HTTPException(404, "Result file not found; results are deleted some time after their job finished")
+
+    return MeteredFileResponse(path=result_path, filename=result["filename"])
@@ -1,11 +1,29 @@
-from fastapi import FastAPI
-from app.database import SessionLocal, engine, Base
+import time
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse
+from app.config import DEBUG, PACK_THRESHOLD
+from app.database import SessionLocal, engine
+from app.auth.utils import role_required
+from app.utils import metrics, profiler, query_stats
 from app.auth import routes as auth_routes
 from app.users import routes as user_routes
 from app.files import routes as file_routes
+from app.jobs import routes as job_routes
+from app.changes import routes as change_routes
+from app.changes.feed import change_feed
+from app.jobs.engine import job_engine, output_pruner
+from app.files import quotas
+from app.files.purge import purger
+from app.files.listing_cache import channel as listing_cache_channel
+from app.files.metadata import extractor as metadata_extractor
+from app.files.previews import preview_cache
+from app.files.utils import log_writer
+from app.storage.compactor import compactor
 from fastapi.middleware.cors import CORSMiddleware
 
-Base.metadata.create_all(bind=engine)
+# schema is managed by Alembic: run `python -m app.create_tables` (or `alembic upgrade head`) on deploy
 
 app = FastAPI(title="File Manager - Backend (User module)")
 origins = [
@@ -22,7 +40,65 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  
     allow_headers=["*"],  
+    expose_headers=["ETag"] + (["X-DB-Query-Count", "X-DB-Time-Ms", "X-DB-Slowest-Ms"] if DEBUG else []),
 )
+
+query_stats.install(engine)
+metrics.install_pool_metrics(engine)
+
+
+@app.middleware("http")
+async def count_queries(request: Request, call_next):
+    stats = query_stats.start()
+    response = await call_next(request)
+
+    query_stats.finish(f"{request.method} {query_stats.route_template(request)}", stats)
+
+    if DEBUG:
+        response.headers.update(query_stats.response_headers(stats))
+    return response
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.observe_request(
+            request.method, query_stats.route_template(request), status, time.perf_counter() - started
+        )
+
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    reason = profiler.should_profile(request)
+    if not reason:
+        return await call_next(request)
+
+    session = profiler.start(reason)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        profiler.finish(session, f"{request.method} {query_stats.route_template(request)}", status)
+    if reason == "header":
+        response.headers["X-Profile-Id"] = session.id
+    return response
+
+@app.middleware("http")
+async def reject_over_quota_uploads(request: Request, call_next):
+    # before the body is read: an upload whose Content-Length is already over the quota
+    if request.method == "POST" and request.url.path in quotas.UPLOAD_PATHS:
+        rejection = await run_in_threadpool(quotas.precheck_upload, request.method, request.url.path, request.headers)
+        if rejection is not None:
+            return rejection
+    return await call_next(request)
+
 # import threading
 
 # @app.on_event("startup")
@@ -40,8 +116,64 @@ app.add_middleware(
 app.include_router(auth_routes.router, prefix="/auth", tags=["auth"])
 app.include_router(user_routes.router, prefix="/users", tags=["users"])
 app.include_router(file_routes.router, prefix="/files", tags=["files"])
+app.include_router(job_routes.router, prefix="/jobs", tags=["jobs"])
+app.include_router(change_routes.router, prefix="/changes", tags=["changes"])
+
+
+@app.on_event("startup")
+def start_jobs():
+    # resume queued jobs and settle the ones a previous process left running
+    job_engine.recover()
+    output_pruner.start()
+    metrics.REGISTRY.start_exporter()
+    if PACK_THRESHOLD:
+        compactor.start()
+    quotas.reconciler.start()
+    purger.start()
+    change_feed.start()
+    listing_cache_channel.start()
+    metadata_extractor.start()
+
+
+@app.on_event("shutdown")
+def stop_jobs():
+    job_engine.shutdown()
+    output_pruner.stop()
+    log_writer.flush()
+    metrics.REGISTRY.stop_exporter()
+    compactor.stop()
+    quotas.reconciler.stop()
+    purger.stop()
+    change_feed.stop()
+    listing_cache_channel.stop()
+    metadata_extractor.stop()
+    preview_cache.stop()
 
 
 @app.get("/", tags=["root"])
 def root():
     return {"message": "File Manager backend — user module active"}
+
+
+@app.get("/debug/query-stats", tags=["debug"], summary="SQL statement counts and DB time per route")
+def query_stats_report(current_user=Depends(role_required("admin"))):
+    return query_stats.route_stats.snapshot()
+
+
+# unauthenticated like most Prometheus targets; restrict it at the proxy if needed
+@app.get("/metrics", tags=["debug"], summary="Prometheus metrics of all workers", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/debug/profiles", tags=["debug"], summary="Stored request profiles, newest first")
+def list_profiles(current_user=Depends(role_required("admin"))):
+    return profiler.list_profiles()
+
+
+@app.get("/debug/profiles/{profile_id}", tags=["debug"], summary="Download a profile as folded stacks (flamegraph input)")
+def download_profile(profile_id: str, current_user=Depends(role_required("admin"))):
+    path = profiler.profile_path(profile_id)
+    if not path:
+        raise HTTPException(404, "Profile not found")
+    return FileResponse(path=path, filename=f"profile_{profile_id}.folded", media_type="text/plain")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, DateTime, Float
+from sqlalchemy import BigInteger, Column, ForeignKey, Index, Integer, String, Boolean, DateTime, Float, Text
 from sqlalchemy.sql import func
 from app.database import Base
 from sqlalchemy.orm import relationship
@@ -18,14 +18,22 @@ class User(Base):
         hashed_password = Column(String(255), nullable=False)
         is_active = Column(Boolean, default=True)
         created_at = Column(DateTime(timezone=True), default=datetime.now())
+        # storage quota in bytes; NULL = the role's (ROLE_QUOTAS), 0 = unlimited
+        quota_bytes = Column(BigInteger, nullable=True)
+        # bytes of the files this user owns, RecycleBin included (app/files/quotas.py)
+        used_bytes = Column(BigInteger, nullable=False, default=0, server_default="0")
 
 class FileModel(Base):
     __tablename__ = "files"
+    __table_args__ = (
+        # listings (parent_id) and duplicate-name checks (parent_id, filename)
+        Index("uq_files_parent_filename", "parent_id", "filename", unique=True),
+    )
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255),  index=True, nullable=False)
     # original_name = Column(String(255), nullable=False)
-    path = Column(String(255))
-    uploaded_by_id = Column(Integer, ForeignKey("users.id"))
+    path = Column(String(255), index=True)
+    uploaded_by_id = Column(Integer, ForeignKey("users.id"), index=True)
     uploaded_at = Column(DateTime(timezone=True), default=datetime.now())
     is_folder = Column(Boolean, default=False)  
     is_star = Column(Boolean, default=False)
@@ -39,12 +47,23 @@ class FileModel(Base):
         foreign_keys=[parent_id]
     )
     size = Column(Float, default=0)
+    # contents stored under this key (STORAGE_LAYOUT=id, or a pack entry); NULL = at `path`
+    storage_key = Column(String(255), nullable=True, index=True)
+    # compression at rest: "gzip"/"zstd" and the JSON frame index; NULL = stored raw
+    codec = Column(String(16), nullable=True)
+    frame_index = Column(Text, nullable=True)
+    # folders: bytes, files and subfolders of the whole subtree (app.files.rollups); 0 for files
+    tree_size = Column(BigInteger, nullable=False, default=0, server_default="0")
+    file_count = Column(Integer, nullable=False, default=0, server_default="0")
+    folder_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # folders: goes up with every change to what the folder's listing shows (app.files.versions)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
 
 
 class FileLog(Base):
     __tablename__ = "file_logs"
     id = Column(Integer, primary_key=True, index=True)
-    file_id = Column(Integer)
+    file_id = Column(Integer, index=True)
     action = Column(String(255), nullable=False)  
     user_id = Column(Integer, ForeignKey("users.id"))
     timestamp = Column(DateTime(timezone=True), default=datetime.now())
@@ -58,11 +77,72 @@ class RecycleBin(Base):
     filename = Column(String(255), index=True, nullable=False) 
     # original_name = Column(String(255), nullable=False)
     deleted_by_id = Column(Integer, ForeignKey("users.id"))
-    deleted_at = Column(DateTime(timezone=True), default=datetime.now)
+    deleted_at = Column(DateTime(timezone=True), default=datetime.now, index=True)
     is_folder = Column(Boolean, default=False)
     path = Column(String(255), nullable=True)  
+    # the deleted row itself, kept with its subtree under path (NULL: an entry from
+    # before the central trash, which kept only this row); where to restore it to
+    file_id = Column(Integer, ForeignKey("files.id"), nullable=True, index=True)
+    parent_id = Column(Integer, nullable=True)
+    original_path = Column(String(255), nullable=True)
+    storage_key = Column(String(255), nullable=True, index=True)
+    codec = Column(String(16), nullable=True)
+    frame_index = Column(Text, nullable=True)
+    # size (whole subtree) and owner of what was deleted, which still counts towards quotas
+    size = Column(Float, default=0)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+
+    deleted_by = relationship("User", foreign_keys=[deleted_by_id])
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    operation = Column(String(50), index=True, nullable=False)
+    # queued -> running -> succeeded / failed / cancelled
+    status = Column(String(20), index=True, default="queued", nullable=False)
+    params = Column(Text, nullable=True)  # JSON encoded request body
+    result = Column(Text, nullable=True)  # JSON encoded handler result
+    error = Column(Text, nullable=True)
+
+    items_total = Column(Integer, default=0)
+    items_done = Column(Integer, default=0)
+    bytes_total = Column(BigInteger, default=0)
+    bytes_done = Column(BigInteger, default=0)
+
+    cancel_requested = Column(Boolean, default=False)
+    worker = Column(String(255), nullable=True)  # "<host>:<pid>" of the process running it
+
+    created_by_id = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime(timezone=True), default=datetime.now)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    created_by = relationship("User")
 
-    deleted_by = relationship("User")
+
+class Counter(Base):
+    """Named counters that have no row of their own to live on, like the top level's listing version."""
+    __tablename__ = "counters"
+
+    name = Column(String(64), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
+class ChangeEvent(Base):
+    """One entry of the change feed; its id is the sequence number clients resume from."""
+    __tablename__ = "change_events"
+
+    id = Column(Integer, primary_key=True)
+    type = Column(String(16), nullable=False)  # create, rename, move, delete, star, unstar
+    # the folder whose listing changed (NULL: the top level) and, for moves, the one it left
+    folder_id = Column(Integer, nullable=True, index=True)
+    old_folder_id = Column(Integer, nullable=True)
+    file_id = Column(Integer, nullable=False)
+    name = Column(String(255), nullable=False)
+    is_folder = Column(Boolean, default=False)
+    created_at = Column(DateTime(timezone=True), default=datetime.now, index=True)
 
 
 
@@ -96,3 +176,26 @@ class RecycleBin(Base):
 #     timestamp = Column(DateTime(timezone=True), default=datetime.now)
 
 #     user = relationship("User", back_populates="logs")
+
+
+class FileMetadata(Base):
+    """What app.files.metadata extracted from a file's contents; /files/properties reads only this and the file row."""
+    __tablename__ = "file_metadata"
+    __table_args__ = (
+        # content lookups for upload negotiation: the size narrows it down, the hash decides
+        Index("ix_file_metadata_size_sha256", "size", "sha256"),
+    )
+
+    file_id = Column(Integer, ForeignKey("files.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String(16), nullable=False)  # done, failed
+    # the file's size when extracted: a different size now means the contents changed
+    size = Column(BigInteger, nullable=True)
+    mime_type = Column(String(127), nullable=True)
+    sha256 = Column(String(64), nullable=True)
+    attributes = Column(Text, nullable=True)  # JSON: width/height, rows/columns, lines, ...
+    # from the stored object: bytes on disk, permission bits (local storage only) and last write
+    stored_size = Column(BigInteger, nullable=True)
+    mode = Column(Integer, nullable=True)
+    modified_at = Column(DateTime(timezone=True), nullable=True)
+    extracted_at = Column(DateTime(timezone=True), default=datetime.now)
+    error = Column(String(255), nullable=True)
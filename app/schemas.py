@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 # --- USER SCHEMAS ---
@@ -20,6 +20,15 @@ class UserOut(BaseModel):
     class Config:
         orm_mode = True
 
+class QuotaOut(BaseModel):
+    user_id: int
+    quota_bytes: Optional[int] = None  # None: unlimited
+    used_bytes: int
+    remaining_bytes: Optional[int] = None
+
+class QuotaUpdate(BaseModel):
+    quota_bytes: Optional[int] = None  # None: the role's quota, 0: unlimited
+
 class UserLogin(BaseModel):
     username: str
     password: str
@@ -44,6 +53,8 @@ class FolderResponse(BaseModel):
     name: str
     parent_id: Optional[int] = None
     created_at: datetime
+    is_folder: bool = True
+    size: int = 0
     children: Optional[List["FolderResponse"]] = None 
     
     class Config:
@@ -58,4 +69,52 @@ class MoveRequest(BaseModel): # Added for completeness of move/cut operation
     file_ids: List[int]
     destination_folder_id: Optional[int] = None
     
+
+# --- BULK SCHEMAS ---
+
+class BulkStarRequest(BaseModel):
+    file_ids: List[int]
+    is_star: bool = True
+
+class UploadCandidate(BaseModel):
+    name: str
+    size: int
+    sha256: str
+
+class UploadNegotiation(BaseModel):
+    parent_id: Optional[int] = None
+    files: List[UploadCandidate]
+
+class DownloadRequest(BaseModel):
+    file_ids: List[int]
+    name: Optional[str] = None  # archive filename, "download.zip" when unset
+
+class PermanentDeleteRequest(BaseModel):
+    recycle_ids: List[int]
+
+# --- JOB SCHEMAS ---
+
+class JobSubmit(BaseModel):
+    operation: str  # copy, move, delete, zip, restore, sync, reconcile_quotas, purge_recycle_bin
+    params: Dict[str, Any] = {}
+
+class DeleteRequest(BaseModel):
+    file_ids: List[int]
+
+class ZipRequest(BaseModel):
+    folder_id: int
+
+class RestoreRequest(BaseModel):
+    recycle_ids: List[int]
+    replace: bool = False
+
+class SyncRequest(BaseModel):
+    pass
+
+class PurgeRecycleBinRequest(BaseModel):
+    days: Optional[float] = None  # retention, RECYCLE_RETENTION_DAYS when unset
+
+class ReconcileQuotasRequest(BaseModel):
+    batch_size: Optional[int] = None  # users per transaction, QUOTA_RECONCILE_BATCH when unset
+
 FolderResponse.update_forward_refs()
\ No newline at end of file
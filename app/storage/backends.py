@@ -0,0 +1,33 @@
+from app.config import (
+    PACK_DIR,
+    PACK_SEGMENT_SIZE,
+    PACK_THRESHOLD,
+    S3_BUCKET,
+    S3_ENDPOINT_URL,
+    S3_PREFIX,
+    S3_REGION,
+    STORAGE_BACKEND,
+    STORAGE_MAX_WORKERS,
+    STORAGE_ROOT,
+)
+from app.storage.base import Storage, StorageError
+from app.storage.local import LocalStorage, ShardedStorage
+from app.storage.packs import PackedStorage, PackStore
+
+
+def create_storage(name: str = STORAGE_BACKEND) -> Storage:
+    if name == "local":
+        return LocalStorage()
+    if name == "sharded":
+        return ShardedStorage(STORAGE_ROOT)
+    if name == "s3":
+        from app.storage.s3 import S3Storage
+        return S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION, STORAGE_MAX_WORKERS)
+    raise StorageError(f"Unknown STORAGE_BACKEND '{name}' (expected local, sharded or s3)")
+
+
+if PACK_THRESHOLD and STORAGE_BACKEND == "s3":
+    raise StorageError("PACK_THRESHOLD needs a local STORAGE_BACKEND: pack segments are local files")
+
+# always wrapped, so packed files stay readable after PACK_THRESHOLD is turned off
+storage = PackedStorage(create_storage(), PackStore(PACK_DIR, PACK_SEGMENT_SIZE))
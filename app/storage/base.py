@@ -0,0 +1,147 @@
+"""
+Storage backends: where the contents of files live.
+
+Routes address stored objects by key, the posix path kept in FileModel.path
+and RecycleBin.path ("uploads/docs/a.txt"); each backend maps keys onto its
+own layout. Folders are key prefixes. Backends with real directories create
+them in make_folder, the others ignore folders entirely (has_folders False).
+
+Backends that cannot enumerate a prefix (can_list False) get the keys of the
+objects below a folder from the caller, who takes them from the database.
+"""
+from collections import namedtuple
+
+CHUNK_SIZE = 1024 * 1024
+
+ObjectStat = namedtuple("ObjectStat", ["key", "size", "mtime", "is_folder"])
+
+
+class StorageError(Exception):
+    pass
+
+
+class ObjectNotFound(StorageError, FileNotFoundError):
+    pass
+
+
+def normalize_key(key) -> str:
+    """"uploads\\a\\b.txt" -> "uploads/a/b.txt"; rejects keys that would escape the storage root."""
+    key = str(key).replace("\\", "/").strip("/")
+    parts = key.split("/")
+    if not key or any(part in ("", ".", "..") for part in parts):
+        raise StorageError(f"Invalid storage key: '{key}'")
+    return key
+
+
+def child_key(folder_key: str, name: str) -> str:
+    return f"{normalize_key(folder_key)}/{name}"
+
+
+def parent_key(key: str) -> str:
+    return normalize_key(key).rpartition("/")[0]
+
+
+def rebase(key: str, src: str, dst: str) -> str:
+    """The key `key` below `src` gets when `src` becomes `dst`."""
+    return dst + key[len(src):]
+
+
+class Storage:
+    name = None
+    has_folders = True  # folders exist on their own, empty ones included
+    can_list = True  # list() can enumerate a prefix
+
+    #objects
+    def put_stream(self, key: str, chunks) -> int:
+        """Store the byte chunks under `key`, replacing what was there; returns the size."""
+        raise NotImplementedError
+
+    def put_bytes(self, key: str, data: bytes) -> int:
+        return self.put_stream(key, [data] if data else [])
+
+    def get_stream(self, key: str, start: int = 0, length: int = None, chunk_size: int = CHUNK_SIZE):
+        """Iterator over `length` bytes (all when None) from offset `start`; ObjectNotFound if missing."""
+        raise NotImplementedError
+
+    def stat(self, key: str):
+        """ObjectStat for a file or folder, None when there is nothing under `key`."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def list(self, prefix: str, recursive: bool = True):
+        """ObjectStat for every file and folder below `prefix`."""
+        raise NotImplementedError
+
+    def copy(self, src: str, dst: str):
+        raise NotImplementedError
+
+    def move(self, src: str, dst: str):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        """Remove one file; missing files are ignored."""
+        raise NotImplementedError
+
+    def make_folder(self, key: str):
+        pass
+
+    def local_path(self, key: str):
+        """Path of the object on the local file system, None for remote backends."""
+        return None
+
+    def uri(self, key: str) -> str:
+        return normalize_key(key)
+
+    #batches: backends override these when they have a cheaper way than one call per object
+    def copy_many(self, pairs) -> list:
+        """Copy every (src, dst) pair; returns the sources that did not exist."""
+        missing = []
+        for src, dst in pairs:
+            try:
+                self.copy(src, dst)
+            except ObjectNotFound:
+                missing.append(src)
+        return missing
+
+    def link_many(self, pairs) -> list:
+        """copy_many() for copies nothing writes to in place: backends that can share the data do."""
+        return self.copy_many(pairs)
+
+    def move_many(self, pairs) -> list:
+        """Move every (src, dst) pair; returns the sources that did not exist."""
+        missing = []
+        for src, dst in pairs:
+            try:
+                self.move(src, dst)
+            except ObjectNotFound:
+                missing.append(src)
+        return missing
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    #folders
+    def walk(self, prefix: str, keys=None):
+        """Everything below `prefix`: listed, or the stats of `keys` when the caller knows them."""
+        if keys is None:
+            yield from self.list(prefix, recursive=True)
+            return
+        for key in keys:
+            info = self.stat(key)
+            if info is not None:
+                yield info
+
+    def move_tree(self, src: str, dst: str, keys=None):
+        src, dst = normalize_key(src), normalize_key(dst)
+        entries = list(self.walk(src, keys))
+        self.make_folder(dst)
+        for entry in entries:
+            if entry.is_folder:
+                self.make_folder(rebase(entry.key, src, dst))
+        self.move_many([(e.key, rebase(e.key, src, dst)) for e in entries if not e.is_folder])
+
+    def delete_tree(self, key: str, keys=None):
+        self.delete_many([e.key for e in self.walk(key, keys) if not e.is_folder])
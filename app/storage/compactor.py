@@ -0,0 +1,153 @@
+"""
+Reclaims the space of pack entries no file refers to any more.
+
+    python -m app.storage.compactor            # one pass
+    python -m app.storage.compactor --loop     # every PACK_COMPACT_INTERVAL seconds
+
+A pass looks at every sealed segment (see app.storage.packs):
+
+- one that no files/recycle_bin row refers to is deleted, but only on the
+  pass after the one that first found it unreferenced, so requests that
+  read a key just before it was rewritten can finish;
+- one whose unreferenced share is above PACK_COMPACT_GARBAGE has its live
+  entries appended to a fresh segment and the rows pointing at them
+  updated, which leaves it unreferenced for the next pass.
+
+The app runs passes in a background thread when PACK_COMPACT_INTERVAL > 0.
+A pass holds a host-wide path lock, so with several uvicorn workers a
+worker whose turn comes while another one is compacting skips its pass.
+"""
+import argparse
+import sys
+import threading
+import time
+
+from fastapi import HTTPException
+from sqlalchemy import update
+
+from app import models
+from app.config import PACK_COMPACT_GARBAGE, PACK_COMPACT_INTERVAL
+from app.database import SessionLocal
+from app.files.locks import path_locks
+from app.storage.backends import storage
+from app.storage.packs import PACK_PREFIX, parse_key
+
+KEY_TABLES = (models.FileModel, models.RecycleBin)
+# held for a pass so the workers of a host take turns; "\0" keeps it apart from real paths
+COMPACT_LOCK = ("\0pack-compactor",)
+
+
+def referenced_keys(db, segment: str) -> set:
+    """Keys in `segment` that some file or RecycleBin row refers to."""
+    keys = set()
+    for table in KEY_TABLES:
+        keys.update(key for (key,) in db.query(table.storage_key).filter(
+            table.storage_key.startswith(f"{PACK_PREFIX}{segment}:", autoescape=True)
+        ).distinct())
+    return keys
+
+
+class Compactor:
+    def __init__(self, packs, garbage: float = PACK_COMPACT_GARBAGE):
+        self.packs = packs
+        self.garbage = garbage
+        self._unreferenced = set()  # segments found unreferenced by the previous pass
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> dict:
+        counts = {"segments": 0, "rewritten": 0, "entries": 0, "removed": 0, "freed_bytes": 0}
+        with self._lock:
+            try:
+                with path_locks.lock(exclusive=[COMPACT_LOCK], timeout=0):
+                    self._pass(counts)
+            except HTTPException:
+                print("Pack compaction skipped: another process is running a pass")
+        return counts
+
+    def _pass(self, counts: dict):
+        db = SessionLocal()
+        try:
+            unreferenced = set()
+            for segment in sorted(self.packs.segments(), key=lambda s: s.created):
+                if not self.packs.sealed(segment):
+                    continue
+                counts["segments"] += 1
+                keys = referenced_keys(db, segment.name)
+                if not keys:
+                    if segment.name in self._unreferenced:
+                        self.packs.remove_segment(segment.name)
+                        counts["removed"] += 1
+                        counts["freed_bytes"] += segment.size
+                    else:
+                        unreferenced.add(segment.name)
+                    continue
+
+                live = sum(parse_key(key).length for key in keys)
+                if segment.size and live < segment.size * (1 - self.garbage):
+                    self.rewrite(db, keys)
+                    counts["rewritten"] += 1
+                    counts["entries"] += len(keys)
+                    unreferenced.add(segment.name)
+            self._unreferenced = unreferenced
+        finally:
+            db.close()
+
+    def rewrite(self, db, keys):
+        """Append the entries to the current segment and point their rows at the copies."""
+        for old in sorted(keys, key=lambda key: parse_key(key).offset):
+            new = self.packs.append(self.packs.read(old))
+            for table in KEY_TABLES:
+                db.execute(update(table).where(table.storage_key == old).values(storage_key=new))
+        db.commit()
+
+    #background thread
+    def start(self, interval: float = PACK_COMPACT_INTERVAL):
+        if self._thread is not None or interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="pack-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                counts = self.run_once()
+            except Exception as e:
+                print(f"Warning: pack compaction failed: {e}")
+                continue
+            if counts["rewritten"] or counts["removed"]:
+                print(f"Pack compaction: {counts}")
+
+
+compactor = Compactor(storage.packs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loop", action="store_true", help="keep running, a pass every --interval seconds")
+    parser.add_argument("--interval", type=float, default=PACK_COMPACT_INTERVAL or 300)
+    args = parser.parse_args()
+
+    while True:
+        started = time.monotonic()
+        counts = compactor.run_once()
+        print(
+            f"{counts['segments']} sealed segments: {counts['rewritten']} rewritten ({counts['entries']:,} entries), "
+            f"{counts['removed']} removed, {counts['freed_bytes'] / 1024 / 1024:,.1f} MB freed "
+            f"in {time.monotonic() - started:.2f}s"
+        )
+        if not args.loop:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
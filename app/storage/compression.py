@@ -0,0 +1,256 @@
+"""
+Compression at rest for uploaded files (COMPRESSION=gzip|zstd|auto, off by default).
+
+A compressed object is a sequence of independently decodable frames of
+FRAME_SIZE uncompressed bytes each (the last one shorter):
+
+gzip  one gzip member whose deflate stream is fully flushed after every
+      frame, so inflating can start at any frame boundary
+zstd  one zstd frame per frame, concatenated
+
+Either way the stored object is a valid .gz/.zst stream, sent as is to
+clients that accept the encoding. The frame index (FileModel.frame_index,
+JSON) holds the logical size and the compressed offset of every frame, so
+a Range request reads and decodes only the frames it overlaps.
+
+Whether a file is compressed is decided on its first SAMPLE_SIZE bytes:
+known compressed formats and samples that don't shrink by MIN_SAVING are
+stored raw. zstd needs the zstandard package (pip install zstandard); "auto"
+uses it when installed and gzip otherwise.
+"""
+import json
+import struct
+import zlib
+from collections import namedtuple
+from itertools import chain
+from pathlib import Path
+
+from app.config import COMPRESSION, COMPRESSION_LEVEL
+from app.storage.base import CHUNK_SIZE, StorageError
+
+FRAME_SIZE = CHUNK_SIZE
+SAMPLE_SIZE = 64 * 1024
+MIN_SAVING = 0.1  # compress only when the sample shrinks by at least 10%
+
+# formats that are compressed already
+SKIP_SUFFIXES = {
+    ".7z", ".avi", ".br", ".bz2", ".docx", ".gif", ".gz", ".heic", ".jpeg", ".jpg", ".m4a", ".mkv",
+    ".mov", ".mp3", ".mp4", ".ogg", ".pdf", ".png", ".pptx", ".rar", ".webm", ".webp", ".xlsx",
+    ".xz", ".zip", ".zst",
+}
+
+# what an object needs to be read back: codec name and its frame index
+Packed = namedtuple("Packed", ["codec", "size", "frame_size", "offsets"])
+
+
+class GzipCodec:
+    name = encoding = "gzip"
+    # magic, deflate, no flags, mtime 0, no extra flags, unknown OS
+    HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+    def __init__(self, level: int = None):
+        self.level = 6 if level is None else level
+
+    def encoder(self):
+        return _GzipEncoder(self.level)
+
+    def decode_frame(self, data: bytes) -> bytes:
+        # raw deflate from a full-flush point; the gzip trailer after the last frame is ignored
+        return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data)
+
+
+class _GzipEncoder:
+    def __init__(self, level: int):
+        self._deflate = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._crc = 0
+        self._size = 0
+
+    def header(self) -> bytes:
+        return GzipCodec.HEADER
+
+    def frame(self, data: bytes) -> bytes:
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        return self._deflate.compress(data) + self._deflate.flush(zlib.Z_FULL_FLUSH)
+
+    def trailer(self) -> bytes:
+        return self._deflate.flush(zlib.Z_FINISH) + struct.pack("<II", self._crc, self._size & 0xFFFFFFFF)
+
+
+class ZstdCodec:
+    name = encoding = "zstd"
+
+    def __init__(self, level: int = None):
+        try:
+            import zstandard
+        except ImportError:
+            raise StorageError("COMPRESSION=zstd needs zstandard: pip install zstandard")
+        self._zstd = zstandard
+        self.level = 3 if level is None else level
+
+    # zstandard contexts are not thread safe: one per upload, one per decoded frame
+    def encoder(self):
+        return _ZstdEncoder(self._zstd.ZstdCompressor(level=self.level))
+
+    def decode_frame(self, data: bytes) -> bytes:
+        return self._zstd.ZstdDecompressor().decompress(data)
+
+
+class _ZstdEncoder:
+    def __init__(self, compressor):
+        self._compressor = compressor
+
+    def header(self) -> bytes:
+        return b""
+
+    def frame(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def trailer(self) -> bytes:
+        return b""
+
+
+def _zstd_available() -> bool:
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+_codecs = {}
+
+
+def codec(name: str):
+    if name not in _codecs:
+        if name == "gzip":
+            _codecs[name] = GzipCodec(COMPRESSION_LEVEL)
+        elif name == "zstd":
+            _codecs[name] = ZstdCodec(COMPRESSION_LEVEL)
+        else:
+            raise StorageError(f"Unknown codec '{name}'")
+    return _codecs[name]
+
+
+if COMPRESSION not in ("off", "gzip", "zstd", "auto"):
+    raise StorageError(f"Unknown COMPRESSION '{COMPRESSION}' (expected off, gzip, zstd or auto)")
+DEFAULT_CODEC = {"off": None, "auto": "zstd" if _zstd_available() else "gzip"}.get(COMPRESSION, COMPRESSION)
+if DEFAULT_CODEC:
+    codec(DEFAULT_CODEC)  # fail at startup, not on the first upload
+
+
+#writing
+class Packer:
+    """Compresses an iterator of byte chunks frame by frame, recording the frame offsets."""
+
+    def __init__(self, codec_name: str, chunks):
+        self.codec = codec_name
+        self._encoder = codec(codec_name).encoder()
+        self._chunks = chunks
+        self.size = 0
+        self.offsets = []
+
+    def __iter__(self):
+        position = 0
+
+        def emit(data: bytes):
+            nonlocal position
+            position += len(data)
+            return data
+
+        header = self._encoder.header()
+        if header:
+            yield emit(header)
+        pending = bytearray()
+        for chunk in self._chunks:
+            pending += chunk
+            while len(pending) >= FRAME_SIZE:
+                yield emit(self._frame(position, bytes(pending[:FRAME_SIZE])))
+                del pending[:FRAME_SIZE]
+        if pending:
+            yield emit(self._frame(position, bytes(pending)))
+        self.offsets.append(position)  # end of the last frame
+        trailer = self._encoder.trailer()
+        if trailer:
+            yield trailer
+
+    def _frame(self, position: int, data: bytes) -> bytes:
+        self.offsets.append(position)
+        self.size += len(data)
+        return self._encoder.frame(data)
+
+    def index(self) -> str:
+        return json.dumps({"size": self.size, "frame_size": FRAME_SIZE, "offsets": self.offsets}, separators=(",", ":"))
+
+
+def worth_compressing(filename: str, sample: bytes) -> bool:
+    if Path(filename).suffix.lower() in SKIP_SUFFIXES or not sample:
+        return False
+    # a fast level 1 deflate is a good enough guess for either codec
+    return len(zlib.compress(sample[:SAMPLE_SIZE], 1)) <= len(sample[:SAMPLE_SIZE]) * (1 - MIN_SAVING)
+
+
+def pack(filename: str, chunks):
+    """(chunks to store, Packer or None): compressed when enabled and the start of the data compresses."""
+    chunks = iter(chunks)
+    if DEFAULT_CODEC is None:
+        return chunks, None
+    sample = b""
+    for chunk in chunks:
+        sample += chunk
+        if len(sample) >= SAMPLE_SIZE:
+            break
+    chunks = chain([sample], chunks) if sample else chunks
+    if not worth_compressing(filename, sample):
+        return chunks, None
+    packer = Packer(DEFAULT_CODEC, chunks)
+    return packer, packer
+
+
+#reading
+def packed(record):
+    """Packed for a compressed file/RecycleBin row, None for one stored raw."""
+    if not getattr(record, "codec", None):
+        return None
+    index = json.loads(record.frame_index)
+    return Packed(record.codec, index["size"], index["frame_size"], index["offsets"])
+
+
+def accepts(accept_encoding: str, encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows `encoding` (q=0 refuses it)."""
+    weights = {}
+    for item in (accept_encoding or "").split(","):
+        token, _, params = item.partition(";")
+        params = params.strip().lower()
+        try:
+            weights[token.strip().lower()] = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            weights[token.strip().lower()] = 0.0
+    return weights.get(encoding, weights.get("*", 0.0)) > 0
+
+
+def read(storage, key: str, info: Packed, start: int = 0, length: int = None):
+    """The uncompressed bytes start..start+length of a compressed object, decoding only the frames needed."""
+    end = info.size if length is None else min(start + length, info.size)
+    if start >= end:
+        return
+    offsets = info.offsets
+    first, last = start // info.frame_size, (end - 1) // info.frame_size
+    decode = codec(info.codec).decode_frame
+
+    # one ranged read for all the frames, split at the frame boundaries
+    stream = storage.get_stream(key, offsets[first], offsets[last + 1] - offsets[first])
+    pending = bytearray()
+    position = first * info.frame_size
+    for frame in range(first, last + 1):
+        frame_length = offsets[frame + 1] - offsets[frame]
+        while len(pending) < frame_length:
+            chunk = next(stream, None)
+            if chunk is None:
+                raise StorageError(f"{key}: compressed object is shorter than its frame index")
+            pending += chunk
+        data = decode(bytes(pending[:frame_length]))
+        del pending[:frame_length]
+        lo, hi = max(start - position, 0), min(end - position, len(data))
+        position += len(data)
+        yield data if (lo, hi) == (0, len(data)) else data[lo:hi]
@@ -0,0 +1,40 @@
+"""
+Where a file's contents are stored, independent of the backend.
+
+tree  the key is the logical path (uploads/docs/a.txt): the physical tree
+      mirrors the folders, and every move or rename moves data.
+id    the key is objects/<h[:2]>/<h[2:4]>/<id> with h the sha256 of the id,
+      assigned when the file is created and kept for its lifetime
+      (FileModel.storage_key). The logical path lives only in the database,
+      so moves and renames are metadata-only, folders have no physical
+      presence, and no directory holds more than a few hundred entries
+      (65536 leaf directories).
+
+Rows with storage_key NULL are in the tree layout. Switching an existing
+install to STORAGE_LAYOUT=id keeps them working: files are moved to their id
+key the first time they are moved or renamed, or all at once with
+python -m app.storage.relayout.
+"""
+import hashlib
+
+from app.config import STORAGE_LAYOUT
+from app.storage.base import StorageError
+
+OBJECTS_PREFIX = "objects"
+
+if STORAGE_LAYOUT not in ("tree", "id"):
+    raise StorageError(f"Unknown STORAGE_LAYOUT '{STORAGE_LAYOUT}' (expected tree or id)")
+
+BY_ID = STORAGE_LAYOUT == "id"
+
+
+def object_key(file_id: int) -> str:
+    digest = hashlib.sha256(str(file_id).encode()).hexdigest()
+    return f"{OBJECTS_PREFIX}/{digest[:2]}/{digest[2:4]}/{file_id}"
+
+
+def assign_key(record):
+    """Give a new file (flushed, so it has an id) its id-layout key; no-op in the tree layout."""
+    if BY_ID and not record.is_folder:
+        record.storage_key = object_key(record.id)
+    return record
@@ -0,0 +1,157 @@
+"""
+Local file system backends.
+
+LocalStorage keeps the layout the app has always had: the key is the path
+relative to the working directory, so uploads/ mirrors the folder tree.
+ShardedStorage stores each file under root/ab/cd/<sha256 of the key>; no
+directory grows past 256 entries on the upper levels, and folders exist only
+in the database.
+"""
+import hashlib
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from app.storage.base import CHUNK_SIZE, ObjectNotFound, ObjectStat, Storage, StorageError, normalize_key
+
+
+def _read_chunks(f, start: int, length, chunk_size: int):
+    with f:
+        f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+class LocalStorage(Storage):
+    name = "local"
+
+    def __init__(self, root: Path = Path(".")):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / normalize_key(key)
+
+    def _stat(self, key: str, path: Path):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        is_folder = path.is_dir()
+        return ObjectStat(key, 0 if is_folder else st.st_size, st.st_mtime, is_folder)
+
+    def local_path(self, key: str) -> Path:
+        return self._path(key)
+
+    def uri(self, key: str) -> str:
+        return str(self._path(key).resolve())
+
+    def put_stream(self, key: str, chunks) -> int:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # written next to the target and renamed into place, so readers never see half a file
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+        size = 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return size
+
+    def get_stream(self, key: str, start: int = 0, length: int = None, chunk_size: int = CHUNK_SIZE):
+        try:
+            f = open(self._path(key), "rb")
+        except (FileNotFoundError, IsADirectoryError):
+            raise ObjectNotFound(key)
+        return _read_chunks(f, start, length, chunk_size)
+
+    def stat(self, key: str):
+        key = normalize_key(key)
+        return self._stat(key, self._path(key))
+
+    def list(self, prefix: str, recursive: bool = True):
+        base = self._path(prefix)
+        if not base.is_dir():
+            return
+        for path in (base.rglob("*") if recursive else base.iterdir()):
+            info = self._stat(path.relative_to(self.root).as_posix(), path)
+            if info is not None:
+                yield info
+
+    def copy(self, src: str, dst: str):
+        target = self._path(dst)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            shutil.copy2(self._path(src), target)
+        except FileNotFoundError:
+            raise ObjectNotFound(src)
+
+    def link_many(self, pairs) -> list:
+        # hard links: no data written; safe since every write replaces the file (put_stream renames)
+        missing = []
+        for src, dst in pairs:
+            target = self._path(dst)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(self._path(src), target)
+            except FileNotFoundError:
+                missing.append(src)
+            except OSError:
+                # another file system, one without hard links, or a target already there
+                missing.extend(self.copy_many([(src, dst)]))
+        return missing
+
+    def move(self, src: str, dst: str):
+        source, target = self._path(src), self._path(dst)
+        if not source.exists():
+            raise ObjectNotFound(src)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(source), str(target))
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def make_folder(self, key: str):
+        self._path(key).mkdir(parents=True, exist_ok=True)
+
+    def move_tree(self, src: str, dst: str, keys=None):
+        # one rename moves the whole directory, files the database doesn't know about included
+        self.move(src, dst)
+
+    def delete_tree(self, key: str, keys=None):
+        path = self._path(key)
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink(missing_ok=True)
+
+
+class ShardedStorage(LocalStorage):
+    name = "sharded"
+    has_folders = False
+    can_list = False
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha256(normalize_key(key).encode("utf-8")).hexdigest()
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def list(self, prefix: str, recursive: bool = True):
+        raise StorageError("The sharded layout cannot list a folder; the database is its index")
+
+    def make_folder(self, key: str):
+        pass
+
+    # files are moved one by one, using the keys the caller took from the database
+    move_tree = Storage.move_tree
+    delete_tree = Storage.delete_tree
@@ -0,0 +1,266 @@
+"""
+Pack storage for small files (PACK_THRESHOLD bytes and below).
+
+Instead of a file (inode, directory entry) each, small contents are
+appended to large segment files under PACK_DIR and addressed by a key
+recorded in storage_key:
+
+    pack:<segment>:<offset>:<length>
+
+Entries are immutable: a copy shares its source's key, deleting a file only
+drops its row, and a moved or renamed file keeps its key. Space of entries
+no row refers to any more is reclaimed by app.storage.compactor, which
+rewrites mostly-dead segments.
+
+Every process appends to a segment of its own, so no locking is needed
+across uvicorn workers. A segment takes writes for at most SEAL_AGE
+seconds (and PACK_SEGMENT_SIZE bytes), after which it is sealed; the
+compactor only touches sealed segments. Reads slice a read-only mmap of
+the segment.
+
+PackedStorage wraps the configured backend: pack keys are served from the
+segments, every other key goes to the backend. Segments are local files, so
+packing is not available with STORAGE_BACKEND=s3.
+"""
+import mmap
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from itertools import chain
+from pathlib import Path
+
+from app.storage.base import CHUNK_SIZE, ObjectNotFound, ObjectStat, StorageError
+
+PACK_PREFIX = "pack:"
+SEGMENT_SUFFIX = ".pack"
+SEAL_AGE = 600  # seconds a segment takes writes for
+MAP_RECHECK = 10  # seconds before a cached mmap is checked against the file again
+
+PackEntry = namedtuple("PackEntry", ["segment", "offset", "length"])
+Segment = namedtuple("Segment", ["name", "size", "created"])
+
+
+def is_pack_key(key) -> bool:
+    return bool(key) and str(key).startswith(PACK_PREFIX)
+
+
+def make_key(segment: str, offset: int, length: int) -> str:
+    return f"{PACK_PREFIX}{segment}:{offset}:{length}"
+
+
+def parse_key(key: str) -> PackEntry:
+    try:
+        segment, offset, length = key[len(PACK_PREFIX):].split(":")
+        return PackEntry(segment, int(offset), int(length))
+    except ValueError:
+        raise StorageError(f"Invalid pack key: '{key}'")
+
+
+def read_small(chunks, limit: int):
+    """(contents, None) when `chunks` hold `limit` bytes or fewer, else (None, the same chunks)."""
+    chunks = iter(chunks)
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            return None, chain(head, chunks)
+    return b"".join(head), None
+
+
+class _Writer:
+    """The segment this process appends to."""
+
+    def __init__(self, name: str, fd: int):
+        self.name = name
+        self.fd = fd
+        self.position = 0
+        self.pid = os.getpid()
+        self.opened = time.time()
+
+
+class PackStore:
+    def __init__(self, root: Path, segment_size: int):
+        self.root = Path(root)
+        self.segment_size = segment_size
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._maps = {}  # segment -> (mmap, inode, checked at)
+        self._map_lock = threading.Lock()
+
+    def _path(self, segment: str) -> Path:
+        return self.root / f"{segment}{SEGMENT_SUFFIX}"
+
+    #writing
+    def _open_segment(self) -> _Writer:
+        self.root.mkdir(parents=True, exist_ok=True)
+        # creation time first, so the compactor can tell sealed segments by name alone
+        name = f"{int(time.time())}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        fd = os.open(self._path(name), os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o644)
+        return _Writer(name, fd)
+
+    def append(self, data: bytes) -> str:
+        """Store `data` in this process's segment; returns its key."""
+        with self._write_lock:
+            writer = self._writer
+            if (
+                writer is None
+                or writer.pid != os.getpid()  # forked: the segment belongs to the parent
+                or time.time() - writer.opened > SEAL_AGE
+                or (writer.position and writer.position + len(data) > self.segment_size)
+            ):
+                if writer is not None and writer.pid == os.getpid():
+                    os.close(writer.fd)
+                writer = self._writer = self._open_segment()
+            offset = writer.position
+            view = memoryview(data)
+            while view:
+                view = view[os.write(writer.fd, view):]
+            writer.position += len(data)
+        return make_key(writer.name, offset, len(data))
+
+    def close(self):
+        """Stop appending to the current segment; the next write starts a new one."""
+        with self._write_lock:
+            if self._writer is not None and self._writer.pid == os.getpid():
+                os.close(self._writer.fd)
+            self._writer = None
+
+    #reading
+    def _map(self, segment: str, needed: int):
+        now = time.time()
+        with self._map_lock:
+            cached = self._maps.get(segment)
+            if cached and len(cached[0]) >= needed and now - cached[2] < MAP_RECHECK:
+                return cached[0]
+            try:
+                f = open(self._path(segment), "rb")
+            except FileNotFoundError:
+                self._maps.pop(segment, None)
+                raise ObjectNotFound(segment)
+            with f:
+                st = os.fstat(f.fileno())
+                if cached and cached[1] == st.st_ino and len(cached[0]) >= needed:
+                    # same file, long enough: just note that it was checked
+                    self._maps[segment] = (cached[0], cached[1], now)
+                    return cached[0]
+                if st.st_size < needed:
+                    raise ObjectNotFound(segment)
+                # the segment may still grow: map all of it now, remap when a later entry is beyond
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = (view, st.st_ino, now)
+            return view
+
+    def read(self, key: str, start: int = 0, length: int = None) -> bytes:
+        entry = parse_key(key)
+        start = min(start, entry.length)
+        end = entry.length if length is None else min(start + length, entry.length)
+        if entry.length == 0:
+            if not self._path(entry.segment).exists():
+                raise ObjectNotFound(key)
+            return b""
+        view = self._map(entry.segment, entry.offset + entry.length)
+        return view[entry.offset + start:entry.offset + end]
+
+    def stat(self, key: str):
+        entry = parse_key(key)
+        try:
+            st = self._path(entry.segment).stat()
+        except FileNotFoundError:
+            return None
+        if st.st_size < entry.offset + entry.length:
+            return None
+        return ObjectStat(key, entry.length, st.st_mtime, False)
+
+    def uri(self, key: str) -> str:
+        entry = parse_key(key)
+        return f"{self._path(entry.segment).resolve()}#{entry.offset}+{entry.length}"
+
+    #segments, for the compactor
+    def segments(self):
+        if not self.root.is_dir():
+            return
+        for path in self.root.glob(f"*{SEGMENT_SUFFIX}"):
+            created = path.stem.partition("-")[0]
+            try:
+                yield Segment(path.stem, path.stat().st_size, int(created))
+            except (FileNotFoundError, ValueError):
+                continue
+
+    def sealed(self, segment: Segment) -> bool:
+        # twice the age, so a write that was just starting at the deadline is long done
+        return time.time() - segment.created > 2 * SEAL_AGE
+
+    def remove_segment(self, segment: str):
+        with self._map_lock:
+            self._maps.pop(segment, None)
+        self._path(segment).unlink(missing_ok=True)
+
+
+class PackedStorage:
+    """A backend with pack keys served from a PackStore; everything else is the backend's."""
+
+    def __init__(self, backend, packs: PackStore):
+        self.backend = backend
+        self.packs = packs
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def get_stream(self, key: str, start: int = 0, length: int = None, chunk_size: int = CHUNK_SIZE):
+        if not is_pack_key(key):
+            return self.backend.get_stream(key, start, length, chunk_size)
+        data = self.packs.read(key, start, length)
+        return iter([data] if data else [])
+
+    def stat(self, key: str):
+        return self.packs.stat(key) if is_pack_key(key) else self.backend.stat(key)
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def local_path(self, key: str):
+        # part of a segment: callers stream it through get_stream
+        return None if is_pack_key(key) else self.backend.local_path(key)
+
+    def uri(self, key: str) -> str:
+        return self.packs.uri(key) if is_pack_key(key) else self.backend.uri(key)
+
+    def copy(self, src: str, dst: str):
+        if is_pack_key(src):
+            self.backend.put_bytes(dst, self.packs.read(src))
+        else:
+            self.backend.copy(src, dst)
+
+    def move(self, src: str, dst: str):
+        if is_pack_key(src):
+            # the entry itself stays until the compactor finds nothing refers to it
+            self.copy(src, dst)
+        else:
+            self.backend.move(src, dst)
+
+    def delete(self, key: str):
+        if not is_pack_key(key):
+            self.backend.delete(key)
+
+    def delete_many(self, keys):
+        self.backend.delete_many(key for key in keys if not is_pack_key(key))
+
+    def copy_many(self, pairs) -> list:
+        pairs = list(pairs)
+        missing = self.backend.copy_many([(src, dst) for src, dst in pairs if not is_pack_key(src)])
+        for src, dst in pairs:
+            if is_pack_key(src):
+                try:
+                    self.copy(src, dst)
+                except ObjectNotFound:
+                    missing.append(src)
+        return missing
+
+    def move_many(self, pairs) -> list:
+        pairs = list(pairs)
+        missing = self.backend.move_many([(src, dst) for src, dst in pairs if not is_pack_key(src)])
+        return missing + self.copy_many([(src, dst) for src, dst in pairs if is_pack_key(src)])
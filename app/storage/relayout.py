@@ -0,0 +1,86 @@
+"""
+Move tree-layout files to their id-layout keys.
+
+    STORAGE_LAYOUT=id python -m app.storage.relayout
+    STORAGE_LAYOUT=id python -m app.storage.relayout --batch-size 5000 --dry-run
+
+Every file whose storage_key is NULL is moved from its logical path to
+objects/<fan-out>/<id>, a batch at a time: one move_many on the backend, then
+one commit. An interrupted run just continues where it stopped the next time.
+Files missing from storage are reported and left in the tree layout. Best run
+while the app is idle, since a file moved by a request during its batch is
+skipped until the next run. Folders and RecycleBin entries are not touched.
+"""
+import argparse
+import sys
+import time
+
+from app import models
+from app.database import SessionLocal
+from app.storage import layout
+from app.storage.backends import storage
+from app.storage.base import normalize_key
+
+
+def relayout(batch_size: int, dry_run: bool = False) -> dict:
+    counts = {"moved": 0, "missing": 0}
+    started = time.monotonic()
+    db = SessionLocal()
+    try:
+        last_id = 0
+        while True:
+            rows = (
+                db.query(models.FileModel)
+                .filter(
+                    models.FileModel.storage_key == None,
+                    models.FileModel.is_folder == False,
+                    models.FileModel.path != None,
+                    models.FileModel.id > last_id,
+                )
+                .order_by(models.FileModel.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            pairs = [(normalize_key(row.path), layout.object_key(row.id)) for row in rows]
+            if dry_run:
+                counts["moved"] += len(pairs)
+                continue
+
+            missing = set(storage.move_many(pairs))
+            for row, (src, dst) in zip(rows, pairs):
+                if src in missing:
+                    print(f"  missing from storage, left in place: {src}")
+                    counts["missing"] += 1
+                    continue
+                row.storage_key = dst
+                counts["moved"] += 1
+            db.commit()
+
+            rate = counts["moved"] / max(time.monotonic() - started, 1e-6)
+            print(f"  {counts['moved']:,} files moved ({rate:,.0f} files/s)")
+    finally:
+        db.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000, help="files per move_many + commit")
+    parser.add_argument("--dry-run", action="store_true", help="only count the files that would move")
+    args = parser.parse_args()
+
+    if not layout.BY_ID:
+        parser.error("set STORAGE_LAYOUT=id (for the app too) before moving files to the id layout")
+
+    print(f"Moving tree-layout files to id keys on the '{storage.name}' backend")
+    counts = relayout(args.batch_size, args.dry_run)
+    verb = "Would move" if args.dry_run else "Moved"
+    print(f"{verb} {counts['moved']:,} files; {counts['missing']:,} missing from storage")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+S3-compatible object store backend (AWS S3, MinIO, Ceph RGW, moto for tests).
+
+Keys become object names below S3_PREFIX; a folder is an empty marker object
+named "<key>/" so empty folders survive and show up in listings. S3 has no
+rename, so moves are copies followed by deletes. Deletes go out as
+DeleteObjects requests of up to 1000 keys, copies run STORAGE_MAX_WORKERS at
+a time.
+
+Needs boto3 (pip install boto3); credentials come from the usual AWS_*
+environment variables or config files. python -m app.storage.s3_check runs
+it against a moto server or any S3 endpoint.
+"""
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from app.storage.base import CHUNK_SIZE, ObjectNotFound, ObjectStat, Storage, StorageError, normalize_key
+
+DELETE_BATCH = 1000  # most keys one DeleteObjects request accepts
+
+
+class _ChunkReader(io.RawIOBase):
+    """File-like view of an iterator of byte chunks, for upload_fileobj."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        self.size += n
+        return n
+
+
+class S3Storage(Storage):
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None, region: str = None, max_workers: int = 8):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise StorageError("STORAGE_BACKEND=s3 needs boto3: pip install boto3")
+        if not bucket:
+            raise StorageError("STORAGE_BACKEND=s3 needs S3_BUCKET")
+
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region or None)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.max_workers = max_workers
+        self._client_error = ClientError
+
+    def _name(self, key: str) -> str:
+        return self.prefix + normalize_key(key)
+
+    def _key(self, name: str) -> str:
+        return name[len(self.prefix):].rstrip("/")
+
+    def _missing(self, error) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def _names_under(self, prefix: str, delimiter: str = ""):
+        """Raw object names (and with a delimiter, common prefixes) below `prefix`."""
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter=delimiter):
+            for obj in page.get("Contents", []):
+                yield obj
+            for common in page.get("CommonPrefixes", []):
+                yield {"Key": common["Prefix"], "Size": 0, "LastModified": None}
+
+    def uri(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._name(key)}"
+
+    def put_stream(self, key: str, chunks) -> int:
+        reader = _ChunkReader(chunks)
+        # multipart above 8 MiB, so big uploads are never held in memory
+        self.client.upload_fileobj(io.BufferedReader(reader, CHUNK_SIZE), self.bucket, self._name(key))
+        return reader.size
+
+    def get_stream(self, key: str, start: int = 0, length: int = None, chunk_size: int = CHUNK_SIZE):
+        kwargs = {"Bucket": self.bucket, "Key": self._name(key)}
+        if length == 0:
+            return iter(())
+        if start or length is not None:
+            end = "" if length is None else start + length - 1
+            kwargs["Range"] = f"bytes={start}-{end}"
+        try:
+            body = self.client.get_object(**kwargs)["Body"]
+        except self._client_error as e:
+            if self._missing(e):
+                raise ObjectNotFound(key)
+            raise
+        return body.iter_chunks(chunk_size)
+
+    def stat(self, key: str):
+        key = normalize_key(key)
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._name(key))
+            return ObjectStat(key, head["ContentLength"], head["LastModified"].timestamp(), False)
+        except self._client_error as e:
+            if not self._missing(e):
+                raise
+        # a folder: its marker or anything below it
+        listing = self.client.list_objects_v2(Bucket=self.bucket, Prefix=self._name(key) + "/", MaxKeys=1)
+        if listing.get("KeyCount", 0):
+            return ObjectStat(key, 0, None, True)
+        return None
+
+    def list(self, prefix: str, recursive: bool = True):
+        prefix = normalize_key(prefix)
+        base = self._name(prefix) + "/"
+        folders = set()
+        for obj in self._names_under(base, "" if recursive else "/"):
+            if obj["Key"] == base:
+                continue
+            key = self._key(obj["Key"])
+            # folders without a marker still show up, once, through the keys below them
+            implied = []
+            parent = key.rpartition("/")[0] if recursive else prefix
+            while parent != prefix and parent not in folders:
+                implied.append(parent)
+                parent = parent.rpartition("/")[0]
+            if obj["Key"].endswith("/"):
+                implied.insert(0, key)
+            for folder in reversed(implied):
+                if folder not in folders:
+                    folders.add(folder)
+                    yield ObjectStat(folder, 0, None, True)
+            if not obj["Key"].endswith("/"):
+                yield ObjectStat(key, obj["Size"], obj["LastModified"].timestamp(), False)
+
+    def copy(self, src: str, dst: str):
+        try:
+            # managed copy: multipart for objects over 5 GB
+            self.client.copy({"Bucket": self.bucket, "Key": self._name(src)}, self.bucket, self._name(dst))
+        except self._client_error as e:
+            if self._missing(e):
+                raise ObjectNotFound(src)
+            raise
+
+    def move(self, src: str, dst: str):
+        self.copy(src, dst)
+        self.delete(src)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._name(key))
+
+    def make_folder(self, key: str):
+        self.client.put_object(Bucket=self.bucket, Key=self._name(key) + "/", Body=b"")
+
+    #batches
+    def _delete_names(self, names):
+        names = list(names)
+        for i in range(0, len(names), DELETE_BATCH):
+            batch = [{"Key": name} for name in names[i:i + DELETE_BATCH]]
+            response = self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": batch, "Quiet": True})
+            if response.get("Errors"):
+                error = response["Errors"][0]
+                raise StorageError(f"Could not delete {error['Key']}: {error.get('Message', error.get('Code'))}")
+
+    def delete_many(self, keys):
+        self._delete_names(self._name(key) for key in keys)
+
+    def _copy_one(self, pair):
+        try:
+            self.copy(*pair)
+        except ObjectNotFound:
+            return pair[0]
+        return None
+
+    def copy_many(self, pairs) -> list:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return [src for src in pool.map(self._copy_one, list(pairs)) if src is not None]
+
+    def move_many(self, pairs) -> list:
+        pairs = list(pairs)
+        missing = set(self.copy_many(pairs))
+        self.delete_many(src for src, _ in pairs if src not in missing)
+        return list(missing)
+
+    #folders: whole prefixes, markers included
+    def move_tree(self, src: str, dst: str, keys=None):
+        src_name, dst_name = self._name(src), self._name(dst)
+        names = [src_name + "/"] + [obj["Key"] for obj in self._names_under(src_name + "/") if obj["Key"] != src_name + "/"]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            list(pool.map(lambda name: self._copy_name(name, dst_name + name[len(src_name):]), names))
+        self._delete_names(names)
+
+    def _copy_name(self, src_name: str, dst_name: str):
+        if src_name.endswith("/"):
+            self.client.put_object(Bucket=self.bucket, Key=dst_name, Body=b"")
+        else:
+            self.client.copy({"Bucket": self.bucket, "Key": src_name}, self.bucket, dst_name)
+
+    def delete_tree(self, key: str, keys=None):
+        name = self._name(key)
+        self._delete_names([name, name + "/"] + [obj["Key"] for obj in self._names_under(name + "/")])
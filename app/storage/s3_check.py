@@ -0,0 +1,163 @@
+"""
+Checks the S3 backend against a real S3-compatible server.
+
+    python -m app.storage.s3_check --moto                  # an in-process moto server (pip install "moto[server]")
+    python -m app.storage.s3_check --endpoint http://127.0.0.1:9000 --bucket files   # MinIO, ...
+
+Runs put_stream (small and multipart), whole and ranged get_stream, stat,
+list, copy_many and link_many (with a missing source), move_tree,
+delete_many and delete_tree on objects below a fresh prefix, and compares
+every result with what was written. Everything it wrote is deleted at the
+end. Credentials come from the usual AWS_* variables (--moto sets dummy
+ones). Exits non-zero on any mismatch.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import time
+import uuid
+
+from app.config import S3_BUCKET, S3_ENDPOINT_URL, S3_REGION
+from app.storage.base import ObjectNotFound
+from app.storage.s3 import S3Storage
+
+MOTO_PORT = 5055
+TOPS = ("a", "c", "moved")  # the folders check() writes below its prefix
+
+
+def chunks_of(data: bytes, size: int):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def shown(value) -> str:
+    if isinstance(value, bytes) and len(value) > 60:
+        return f"<{len(value):,} bytes, sha256 {hashlib.sha256(value).hexdigest()[:12]}>"
+    return repr(value)
+
+
+def read(storage, key: str, start: int = 0, length: int = None) -> bytes:
+    return b"".join(storage.get_stream(key, start, length))
+
+
+def check(storage, big_bytes: int) -> list:
+    problems = []
+
+    def expect(what, got, wanted):
+        if got != wanted:
+            problems.append(f"{what}: got {shown(got)}, expected {shown(wanted)}")
+
+    # put_stream: chunks of odd sizes, and one object big enough for a multipart upload
+    small = b"".join(f"line {i}\n".encode() for i in range(1000))
+    big = os.urandom(big_bytes)
+    expect("put_stream size", storage.put_stream("a/small.txt", chunks_of(small, 777)), len(small))
+    expect("put_stream size (multipart)", storage.put_stream("a/b/big.bin", chunks_of(big, 1024 * 1024 + 3)), len(big))
+    expect("put_stream size (empty)", storage.put_stream("a/empty", iter(())), 0)
+    storage.make_folder("a/folder")
+
+    # get_stream: whole, ranged, open ended, empty, missing
+    expect("get_stream", read(storage, "a/small.txt"), small)
+    expect("get_stream (multipart)", read(storage, "a/b/big.bin"), big)
+    expect("get_stream range", read(storage, "a/small.txt", 10, 25), small[10:35])
+    expect("get_stream from offset", read(storage, "a/b/big.bin", big_bytes - 5000), big[-5000:])
+    expect("get_stream range across chunks", read(storage, "a/b/big.bin", 1000, 3 * 1024 * 1024), big[1000:1000 + 3 * 1024 * 1024])
+    expect("get_stream length 0", read(storage, "a/small.txt", 5, 0), b"")
+    expect("get_stream empty object", read(storage, "a/empty"), b"")
+    try:
+        read(storage, "a/missing")
+        problems.append("get_stream of a missing key did not raise ObjectNotFound")
+    except ObjectNotFound:
+        pass
+
+    # stat
+    stat = storage.stat("a/small.txt")
+    expect("stat file", (stat.size, stat.is_folder) if stat else None, (len(small), False))
+    stat = storage.stat("a/b")
+    expect("stat implied folder", stat.is_folder if stat else None, True)
+    stat = storage.stat("a/folder")
+    expect("stat folder marker", stat.is_folder if stat else None, True)
+    expect("stat missing", storage.stat("a/nothing"), None)
+
+    # list
+    expect("list recursive", sorted((s.key, s.is_folder) for s in storage.list("a")), sorted([
+        ("a/small.txt", False), ("a/empty", False), ("a/b", True), ("a/b/big.bin", False), ("a/folder", True),
+    ]))
+    expect("list one level", sorted(s.key for s in storage.list("a", recursive=False)),
+           sorted(["a/small.txt", "a/empty", "a/b", "a/folder"]))
+
+    # copy_many / link_many: the missing source is returned, the rest copied
+    missing = storage.copy_many([("a/small.txt", "c/small.txt"), ("a/b/big.bin", "c/big.bin"), ("a/gone", "c/gone")])
+    expect("copy_many missing", missing, ["a/gone"])
+    expect("copy_many contents", (read(storage, "c/small.txt"), read(storage, "c/big.bin") == big), (small, True))
+    expect("link_many missing", storage.link_many([("a/small.txt", "c/linked.txt"), ("a/gone", "c/gone")]), ["a/gone"])
+    expect("link_many contents", read(storage, "c/linked.txt"), small)
+    expect("copy leaves the source", storage.exists("a/small.txt"), True)
+
+    # move_tree: the whole prefix, markers included; nothing left at the source
+    storage.move_tree("a", "moved/a")
+    expect("move_tree source", list(storage.list("a")), [])
+    expect("move_tree source stat", storage.stat("a"), None)
+    expect("move_tree result", sorted((s.key, s.is_folder) for s in storage.list("moved/a")), sorted([
+        ("moved/a/small.txt", False), ("moved/a/empty", False), ("moved/a/b", True),
+        ("moved/a/b/big.bin", False), ("moved/a/folder", True),
+    ]))
+    expect("move_tree contents", read(storage, "moved/a/b/big.bin") == big, True)
+
+    # delete_many (a missing key is not an error), delete_tree
+    storage.delete_many(["c/small.txt", "c/linked.txt", "c/never-there"])
+    expect("delete_many", sorted(s.key for s in storage.list("c")), ["c/big.bin"])
+    storage.delete_tree("moved")
+    expect("delete_tree", (list(storage.list("moved")), storage.stat("moved")), ([], None))
+    storage.delete_tree("c")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--moto", action="store_true", help="start a moto server on --port and use it")
+    parser.add_argument("--port", type=int, default=MOTO_PORT)
+    parser.add_argument("--endpoint", default=S3_ENDPOINT_URL, help="S3 endpoint (default: S3_ENDPOINT_URL)")
+    parser.add_argument("--bucket", default=S3_BUCKET or "s3-check", help="created when missing")
+    parser.add_argument("--region", default=S3_REGION or "us-east-1")
+    parser.add_argument("--big-mb", type=int, default=9, help="size of the multipart object (parts are 8 MiB)")
+    args = parser.parse_args()
+
+    server = None
+    if args.moto:
+        from moto.server import ThreadedMotoServer
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)  # one line per request otherwise
+        server = ThreadedMotoServer(port=args.port, verbose=False)
+        server.start()
+        args.endpoint = f"http://127.0.0.1:{args.port}"
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+
+    try:
+        # a prefix of its own, so a shared bucket is left as it was
+        storage = S3Storage(args.bucket, f"s3_check-{uuid.uuid4().hex[:8]}", args.endpoint, args.region)
+        buckets = {bucket["Name"] for bucket in storage.client.list_buckets().get("Buckets", [])}
+        if args.bucket not in buckets:
+            storage.client.create_bucket(Bucket=args.bucket)
+
+        started = time.monotonic()
+        try:
+            problems = check(storage, args.big_mb * 1024 * 1024)
+        finally:
+            for top in TOPS:
+                storage.delete_tree(top)
+        print(f"s3://{args.bucket}/{storage.prefix}: checked in {time.monotonic() - started:.2f}s")
+    finally:
+        if server is not None:
+            server.stop()
+
+    for problem in problems:
+        print("FAIL:", problem)
+    if problems:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
 # app/users/routes.py
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
 
 from app import schemas, models
 from app.database import get_db
-from app.auth.utils import get_current_user
+from app.auth.utils import get_current_user, role_required
+from app.files import quotas
+from app.utils.profiler import ProfiledRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
 @router.get("/me", response_model=schemas.UserOut, summary="Get current logged-in user")
@@ -19,3 +21,37 @@ def read_users_me(current_user: models.User = Depends(get_current_user)):
 def list_users(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     users = db.query(models.User).all()
     return users
+
+
+def quota_out(user: models.User) -> schemas.QuotaOut:
+    return schemas.QuotaOut(
+        user_id=user.id,
+        quota_bytes=quotas.quota_for(user),
+        used_bytes=user.used_bytes or 0,
+        remaining_bytes=quotas.remaining(user),
+    )
+
+
+@router.get("/me/quota", response_model=schemas.QuotaOut, summary="Storage quota and usage of the current user")
+def read_my_quota(current_user: models.User = Depends(get_current_user)):
+    return quota_out(current_user)
+
+
+@router.put("/{user_id}/quota", response_model=schemas.QuotaOut, summary="Set a user's storage quota (admin)")
+def set_quota(
+    user_id: int,
+    update: schemas.QuotaUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(role_required("admin")),
+):
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if not user:
+        raise HTTPException(404, "User not found")
+    if update.quota_bytes is not None and update.quota_bytes < 0:
+        raise HTTPException(400, "quota_bytes can't be negative")
+
+    # a lower quota than the usage only blocks new writes, nothing is deleted
+    user.quota_bytes = update.quota_bytes
+    db.commit()
+    db.refresh(user)
+    return quota_out(user)
@@ -0,0 +1,483 @@
+"""
+In-process counters, gauges and histograms rendered in the Prometheus text
+format at GET /metrics.
+
+Each uvicorn worker keeps its own values in memory (a dict update under a
+lock per observation) and a background thread writes them to
+METRICS_DIR/metrics_<pid>.json every METRICS_FLUSH_INTERVAL seconds.
+/metrics merges the files of every worker: counters and histograms are
+summed over all of them, including workers that have exited, so totals never
+go backwards; gauges are summed over live workers only. RETIRE_AFTER seconds
+after a worker exits, a scrape adds its counters and histograms to
+metrics_retired.json and deletes its file, so the directory doesn't grow with
+every restart and a new worker that gets the same pid doesn't overwrite them.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from starlette.responses import FileResponse, StreamingResponse
+
+from fastapi import HTTPException
+
+from app.config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+from app.files.locks import path_locks
+from app.files.utils import log_writer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+BYTE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KiB .. 1 GiB
+
+RETIRED = "metrics_retired.json"
+RETIRE_AFTER = 60  # seconds an exited worker's file is left as it is
+RETIRE_LOCK = ("\0metrics-retire",)  # held to fold files into RETIRED, or to read them all
+RETIRE_WAIT = 5  # seconds a scrape waits for RETIRE_LOCK before reading without it
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = registry.lock
+        self._values = {}
+        registry.add(self)
+        if not self.labelnames:
+            # unlabelled series are exported from the start, as 0
+            self._values[()] = self._empty()
+
+    def _empty(self):
+        return 0
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> dict:
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, registry, name: str, help: str, labels=(), collect=None):
+        super().__init__(registry, name, help, labels)
+        # called at snapshot time for gauges that mirror some other state
+        self.collect = collect
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> dict:
+        if self.collect:
+            self.set(self.collect())
+        return super().samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(registry, name, help, labels)
+
+    def _empty(self):
+        # [per-bucket counts (last one is +Inf), sum, count]
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = self._empty()
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> dict:
+        with self._lock:
+            return {json.dumps(key): [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+
+
+class Registry:
+    def __init__(self, directory: Path = METRICS_DIR):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.directory = directory
+        self._exporter = None
+        self._stop = threading.Event()
+        self._written = False  # whether this process has written its snapshot yet
+
+    def add(self, metric: _Metric):
+        self.metrics[metric.name] = metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return Counter(self, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels=(), collect=None) -> Gauge:
+        return Gauge(self, name, help, labels, collect)
+
+    def histogram(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return Histogram(self, name, help, labels, buckets)
+
+    def snapshot(self) -> dict:
+        return {
+            name: {
+                "kind": metric.kind,
+                "help": metric.help,
+                "labels": metric.labelnames,
+                "buckets": getattr(metric, "buckets", None),
+                "samples": metric.samples(),
+            }
+            for name, metric in self.metrics.items()
+        }
+
+    #multi-worker snapshots
+    def _snapshot_path(self, pid: int) -> Path:
+        return self.directory / f"metrics_{pid}.json"
+
+    def write_snapshot(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        _write_json(self._snapshot_path(os.getpid()), self.snapshot())
+        self._written = True
+
+    def start_exporter(self):
+        if self._exporter is not None:
+            return
+        own = self._snapshot_path(os.getpid())
+        if not self._written and own.exists():
+            # left by an exited worker that had this pid
+            self.retire([own])
+        self._stop.clear()
+        self._exporter = threading.Thread(target=self._export_loop, name="metrics-exporter", daemon=True)
+        self._exporter.start()
+
+    def stop_exporter(self):
+        self._stop.set()
+        if self._exporter is not None:
+            self._exporter.join(timeout=5)
+            self._exporter = None
+        self.write_snapshot()
+
+    def _export_loop(self):
+        while not self._stop.wait(METRICS_FLUSH_INTERVAL):
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                print(f"Warning: could not write metrics snapshot: {e}")
+
+    def collect_all(self) -> list:
+        """
+        Snapshots of every worker as (pid, alive, snapshot); this process
+        first, the retired workers' totals as pid 0. Read holding RETIRE_LOCK,
+        so a file being folded into RETIRED is never counted twice or not at all.
+        """
+        try:
+            with path_locks.lock(exclusive=[RETIRE_LOCK], timeout=RETIRE_WAIT):
+                return self._collect(retire=True)
+        except HTTPException:
+            return self._collect(retire=False)
+
+    def _collect(self, retire: bool) -> list:
+        snapshots = [(os.getpid(), True, self.snapshot())]
+        if not self.directory.exists():
+            return snapshots
+        exited = []
+        for path in self.directory.glob("metrics_*.json"):
+            pid = path.stem.partition("_")[2]
+            if path.name != RETIRED and (not pid.isdigit() or int(pid) == os.getpid()):
+                continue
+            try:
+                snapshot = _read_json(path)
+                modified = path.stat().st_mtime
+            except (OSError, ValueError):
+                continue  # being replaced right now; picked up on the next scrape
+            if path.name == RETIRED:
+                snapshots.append((0, False, snapshot))
+                continue
+            alive = _pid_alive(int(pid))
+            if not alive and time.time() - modified > RETIRE_AFTER:
+                exited.append(path)
+            snapshots.append((int(pid), alive, snapshot))
+        if retire and exited:
+            self._fold(exited)  # what was just read is what RETIRED gets
+        return snapshots
+
+    def retire(self, paths: list):
+        """Add the counters and histograms of exited workers' files to RETIRED and delete the files."""
+        try:
+            with path_locks.lock(exclusive=[RETIRE_LOCK], timeout=RETIRE_WAIT):
+                self._fold(paths)
+        except HTTPException:
+            print("Warning: metrics snapshots not retired: another process holds the lock")
+
+    def _fold(self, paths: list):
+        retired_path = self.directory / RETIRED
+        try:
+            retired = _read_json(retired_path) if retired_path.exists() else {}
+            folded = []
+            for path in paths:
+                try:
+                    _merge(retired, _read_json(path), alive=False)
+                except FileNotFoundError:
+                    continue
+                folded.append(path)
+            if folded:
+                _write_json(retired_path, retired)
+                for path in folded:
+                    path.unlink(missing_ok=True)
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not retire metrics snapshots: {e}")
+
+    def render(self) -> str:
+        """All workers merged, in the Prometheus text exposition format (0.0.4)."""
+        merged = {}
+        for _, alive, snapshot in self.collect_all():
+            _merge(merged, snapshot, alive)
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            for key, value in sorted(metric["samples"].items()):
+                labels = list(zip(metric["labels"], json.loads(key)))
+                if metric["kind"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(metric["buckets"]) + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    le = bound if bound == "+Inf" else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(merged: dict, snapshot: dict, alive: bool):
+    """Add `snapshot` to `merged`, in place; the gauges of workers that are gone are left out."""
+    for name, metric in snapshot.items():
+        if metric["kind"] == "gauge" and not alive:
+            continue
+        target = merged.setdefault(name, {**metric, "samples": {}})
+        for key, value in metric["samples"].items():
+            if key not in target["samples"]:
+                target["samples"][key] = [list(value[0]), value[1], value[2]] if metric["kind"] == "histogram" else value
+            elif metric["kind"] == "histogram":
+                current = target["samples"][key]
+                current[0] = [a + b for a, b in zip(current[0], value[0])]
+                current[1] += value[1]
+                current[2] += value[2]
+            else:
+                target["samples"][key] += value
+
+
+def _read_json(path: Path) -> dict:
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _write_json(path: Path, data: dict):
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _format_labels(labels: list) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+REGISTRY = Registry()
+
+request_count = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route and status code", ("method", "route", "status"))
+request_latency = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time until the response starts, by route", ("method", "route"))
+
+upload_bytes = REGISTRY.histogram(
+    "file_upload_bytes", "Size of each uploaded file", buckets=BYTE_BUCKETS)
+download_bytes = REGISTRY.histogram(
+    "file_download_bytes", "Bytes sent by each file/folder download", buckets=BYTE_BUCKETS)
+active_uploads = REGISTRY.gauge("file_uploads_active", "Upload requests being stored")
+active_downloads = REGISTRY.gauge("file_downloads_active", "Downloads still streaming to the client")
+
+pool_checkouts = REGISTRY.counter("db_pool_checkouts_total", "Connections handed out by the DB pool")
+pool_wait = REGISTRY.histogram(
+    "db_pool_checkout_wait_seconds", "Time requests spent waiting for a pooled DB connection", buckets=WAIT_BUCKETS)
+pool_timeouts = REGISTRY.counter("db_pool_checkout_timeouts_total", "Checkouts that gave up waiting for a connection")
+pool_checked_out = REGISTRY.gauge("db_pool_connections_in_use", "DB connections currently checked out")
+
+purged_items = REGISTRY.counter("recycle_bin_purged_items_total", "RecycleBin items deleted by retention")
+purged_bytes = REGISTRY.counter("recycle_bin_purged_bytes_total", "Bytes reclaimed by RecycleBin retention")
+
+listing_requests = REGISTRY.counter(
+    "listing_requests_total",
+    "Folder listing requests by If-None-Match outcome; not_modified / (not_modified + modified) is the 304 hit ratio",
+    labels=("route", "result"),
+)
+listing_cache_requests = REGISTRY.counter(
+    "listing_cache_requests_total", "Folder listing cache lookups; hit / (hit + miss) is the hit ratio", labels=("result",))
+listing_cache_evictions = REGISTRY.counter("listing_cache_evictions_total", "Listings dropped to stay within LISTING_CACHE_SIZE")
+listing_cache_invalidations = REGISTRY.counter(
+    "listing_cache_invalidations_total", "Cached listings dropped because their folder changed")
+listing_cache_messages = REGISTRY.counter(
+    "listing_cache_messages_total", "Invalidation datagrams between workers", labels=("direction",))
+listing_cache_bytes = REGISTRY.gauge("listing_cache_bytes", "Bytes of JSON in the listing cache")
+listing_cache_entries = REGISTRY.gauge("listing_cache_entries", "Listings in the listing cache")
+change_feed_subscribers = REGISTRY.gauge("change_feed_subscribers", "Clients connected to the change feed")
+change_feed_events = REGISTRY.counter("change_feed_events_total", "Change events read from the outbox")
+change_feed_deliveries = REGISTRY.counter(
+    "change_feed_deliveries_total", "Change events handed to subscribers (one per subscriber)")
+change_feed_resets = REGISTRY.counter(
+    "change_feed_resets_total", "Subscribers told to refetch: resumed from too far back or too slow to keep up")
+metadata_extractions = REGISTRY.counter(
+    "metadata_extractions_total", "Files whose metadata was extracted, by outcome", labels=("result",))
+metadata_extract_seconds = REGISTRY.histogram("metadata_extract_seconds", "Time to read and analyse one file")
+metadata_queue = REGISTRY.gauge("metadata_queue_depth", "Files waiting for metadata extraction")
+metadata_deferred = REGISTRY.counter(
+    "metadata_deferred_total", "New files not queued because the queue was full; the next scan picks them up")
+upload_negotiated_files = REGISTRY.counter(
+    "upload_negotiated_files_total", "Files offered to upload negotiation: created from stored contents, or to upload",
+    labels=("result",))
+upload_negotiated_bytes = REGISTRY.counter(
+    "upload_negotiated_bytes_total", "Bytes not uploaded because their contents were already stored")
+preview_requests = REGISTRY.counter(
+    "preview_requests_total", "Preview requests: served from the cache, made, or waiting for one being made",
+    labels=("kind", "result"))
+preview_seconds = REGISTRY.histogram("preview_seconds", "Time to make a preview", labels=("kind",))
+preview_cache_bytes = REGISTRY.gauge("preview_cache_bytes", "Bytes of previews on disk, as this process last counted")
+preview_evictions = REGISTRY.counter("preview_evictions_total", "Previews deleted to stay within PREVIEW_CACHE_SIZE")
+
+audit_log_queue = REGISTRY.gauge(
+    "audit_log_queue_depth", "Audit log lines waiting to be written", collect=log_writer.depth)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float):
+    request_count.inc(method=method, route=route, status=status)
+    request_latency.observe(seconds, method=method, route=route)
+
+
+class _Metered:
+    """Counts the bytes a response actually sends and the downloads in flight."""
+
+    async def __call__(self, scope, receive, send):
+        sent = 0
+
+        async def counting_send(message):
+            nonlocal sent
+            if message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.pathsend":
+                sent += os.path.getsize(message["path"])
+            await send(message)
+
+        active_downloads.inc()
+        try:
+            await super().__call__(scope, receive, counting_send)
+        finally:
+            active_downloads.dec()
+            download_bytes.observe(sent)
+
+
+class MeteredFileResponse(_Metered, FileResponse):
+    pass
+
+
+class MeteredStreamingResponse(_Metered, StreamingResponse):
+    pass
+
+
+_opening = threading.local()  # time this thread spent opening new DB connections
+
+
+def install_pool_metrics(engine):
+    """
+    Count checkouts of `engine`'s pool and time how long it takes to open new
+    connections, with pool and dialect events, which stay with the engine when
+    dispose() or recreate() replaces its pool.
+    """
+    @event.listens_for(engine, "do_connect")
+    def _connecting(dialect, connection_record, cargs, cparams):
+        _opening.started = time.perf_counter()
+
+    @event.listens_for(engine, "connect")
+    def _connected(dbapi_connection, connection_record):
+        started = getattr(_opening, "started", None)
+        if started is not None:
+            _opening.spent = getattr(_opening, "spent", 0.0) + time.perf_counter() - started
+            _opening.started = None
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_checkouts.inc()
+        pool_checked_out.inc()
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        pool_checked_out.dec()
+
+
+def timed_checkout(db):
+    """
+    Check out `db`'s connection, observing the wait for the pool: the whole
+    checkout less the time spent opening a new connection, if it needed one.
+    """
+    _opening.spent = 0.0
+    started = time.perf_counter()
+    try:
+        db.connection()
+    except PoolTimeoutError:
+        pool_timeouts.inc()
+        raise
+    finally:
+        pool_wait.observe(max(0.0, time.perf_counter() - started - _opening.spent))
@@ -0,0 +1,298 @@
+"""
+Opt-in sampling profiler for single requests.
+
+A request is profiled when an admin sends "X-Profile: 1" or when it falls in
+the PROFILE_SAMPLE_RATE sample. While it runs, a sampler thread reads the
+stack of the thread executing the endpoint every PROFILE_INTERVAL seconds
+(sys._current_frames, so the profiled code is not slowed down) and counts
+each stack. The result is written to PROFILE_DIR as
+  <id>.folded  one "frame;frame;frame count" line per stack, the input format
+               of flamegraph.pl, speedscope and inferno
+  <id>.json    route, duration and how the samples split into SQL, disk I/O,
+               lock waits and Python
+When no request is being profiled the only cost is a header lookup in the
+middleware and a ContextVar read per endpoint call.
+"""
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import linecache
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from fastapi.routing import APIRoute
+from jose import JWTError, jwt
+
+from app.config import (
+    ALGORITHM,
+    BASE_DIR,
+    PROFILE_DIR,
+    PROFILE_INTERVAL,
+    PROFILE_KEEP,
+    PROFILE_SAMPLE_RATE,
+    SECRET_KEY,
+)
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9]+-[0-9]+$")
+
+# stacks passing through these spend their time in the database
+SQL_FRAMES = ("sqlalchemy/pool/", "pymysql/", "MySQLdb/", "psycopg")
+# DBAPI calls made by SQLAlchemy (execute, commit, rollback, fetching rows)
+SQL_FUNCTIONS = {"sqlalchemy/engine/default.py": "do_", "sqlalchemy/engine/cursor.py": "fetch"}
+# a leaf frame in these modules is file system work
+DISK_FILES = ("shutil.py", "pathlib", "zipfile", "tempfile.py", "/os.py", "genericpath.py", "_pyio.py")
+# leaf lines calling C-level file functions (open(), f.write(), ...) have no frame of their own
+DISK_CALL = re.compile(r"\b(open|read|readinto|write|writelines|flush|fsync|stat|unlink|rename|replace|mkdir|rmdir)\(")
+
+_current = contextvars.ContextVar("profile_session", default=None)
+_ids = itertools.count(1)
+
+
+class ProfileSession:
+    """Samples collected for one request."""
+
+    def __init__(self, reason: str):
+        self.id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{next(_ids)}"
+        self.reason = reason
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        self.stacks = Counter()
+        self.categories = Counter()
+        self.samples = 0
+        self._threads = Counter()
+        self._lock = threading.Lock()
+
+    def enter_thread(self):
+        with self._lock:
+            self._threads[threading.get_ident()] += 1
+
+    def leave_thread(self):
+        with self._lock:
+            ident = threading.get_ident()
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+
+    def sample(self, frames: dict):
+        with self._lock:
+            idents = list(self._threads)
+        for ident in idents:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack, category = fold(frame)
+            with self._lock:
+                self.stacks[stack] += 1
+                self.categories[category] += 1
+                self.samples += 1
+
+
+class Sampler:
+    """One background thread sampling every active session; idle when there are none."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._sessions = set()
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def add(self, session: ProfileSession):
+        with self._lock:
+            self._sessions.add(session)
+            self._active.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, session: ProfileSession):
+        with self._lock:
+            self._sessions.discard(session)
+            if not self._sessions:
+                self._active.clear()
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                sessions = list(self._sessions)
+            if not sessions:
+                continue
+            frames = sys._current_frames()
+            for session in sessions:
+                session.sample(frames)
+            del frames
+
+
+sampler = Sampler()
+
+
+#stack folding
+@functools.lru_cache(maxsize=4096)
+def _short_file(filename: str) -> str:
+    filename = filename.replace("\\", "/")
+    base = BASE_DIR.as_posix() + "/"
+    if filename.startswith(base):
+        return filename[len(base):]
+    if "site-packages/" in filename:
+        return filename.rpartition("site-packages/")[2]
+    return filename.rpartition("/")[2]
+
+
+def fold(frame) -> tuple:
+    """("root;...;leaf", category) for the stack ending at `frame`."""
+    labels = []
+    category = None
+    leaf = frame
+    while frame is not None:
+        code = frame.f_code
+        filename = code.co_filename.replace("\\", "/")
+        labels.append(f"{_short_file(code.co_filename)}:{code.co_name}")
+        if category is None and (
+            any(part in filename for part in SQL_FRAMES)
+            or any(filename.endswith(f) and code.co_name.startswith(p) for f, p in SQL_FUNCTIONS.items())
+        ):
+            category = "sql"
+        frame = frame.f_back
+
+    if category is None:
+        filename = leaf.f_code.co_filename.replace("\\", "/")
+        if filename.endswith("threading.py") and leaf.f_code.co_name in ("wait", "wait_for", "acquire"):
+            category = "lock_wait"
+        elif any(part in filename for part in DISK_FILES) or DISK_CALL.search(
+            linecache.getline(leaf.f_code.co_filename, leaf.f_lineno)
+        ):
+            category = "disk"
+        else:
+            category = "python"
+    return ";".join(reversed(labels)), category
+
+
+#request hooks
+def should_profile(request) -> str:
+    """Why `request` gets profiled: "header", "sample", or "" when it doesn't."""
+    if request.headers.get(PROFILE_HEADER) and _is_admin(request.headers.get("Authorization", "")):
+        return "header"
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return ""
+
+
+def _is_admin(authorization: str) -> bool:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return payload.get("role") == "admin"
+
+
+def start(reason: str) -> ProfileSession:
+    session = ProfileSession(reason)
+    _current.set(session)
+    sampler.add(session)
+    return session
+
+
+def finish(session: ProfileSession, route: str, status: int) -> dict:
+    """Stop sampling and write the profile files; returns the metadata."""
+    sampler.remove(session)
+    _current.set(None)
+    meta = {
+        "id": session.id,
+        "route": route,
+        "status": status,
+        "reason": session.reason,
+        "started_at": session.started_at.isoformat(),
+        "duration_ms": round((time.perf_counter() - session.started) * 1000, 2),
+        "interval_ms": sampler.interval * 1000,
+        "samples": session.samples,
+        "categories": {
+            name: {"samples": count, "percent": round(100 * count / session.samples, 1)}
+            for name, count in session.categories.most_common()
+        },
+    }
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        root = route.replace(";", ":")
+        with open(PROFILE_DIR / f"{session.id}.folded", "w", encoding="utf-8") as f:
+            for stack, count in session.stacks.most_common():
+                f.write(f"{root};{stack} {count}\n")
+        (PROFILE_DIR / f"{session.id}.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        _prune()
+    except OSError as e:
+        print(f"Warning: could not write profile {session.id}: {e}")
+    return meta
+
+
+def _prune():
+    metas = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in metas[PROFILE_KEEP:]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".folded").unlink(missing_ok=True)
+
+
+def list_profiles() -> list:
+    """Metadata of the stored profiles, newest first."""
+    profiles = []
+    for path in PROFILE_DIR.glob("*.json"):
+        try:
+            profiles.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return sorted(profiles, key=lambda meta: meta["started_at"], reverse=True)
+
+
+def profile_path(profile_id: str):
+    """Path of the folded stacks of `profile_id`, or None if there is no such profile."""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = PROFILE_DIR / f"{profile_id}.folded"
+    return path if path.exists() else None
+
+
+#endpoint wrapper
+def _track_thread(endpoint):
+    """Register the thread running `endpoint` with the request's profile session."""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def tracked(*args, **kwargs):
+            session = _current.get()
+            if session is None:
+                return await endpoint(*args, **kwargs)
+            session.enter_thread()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                session.leave_thread()
+    else:
+        @functools.wraps(endpoint)
+        def tracked(*args, **kwargs):
+            session = _current.get()
+            if session is None:
+                return endpoint(*args, **kwargs)
+            session.enter_thread()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                session.leave_thread()
+    return tracked
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute whose endpoint can be sampled: APIRouter(route_class=ProfiledRoute)."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _track_thread(endpoint), **kwargs)
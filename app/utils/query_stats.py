@@ -0,0 +1,157 @@
+import contextvars
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import event
+
+from app.config import QUERY_COUNT_WARN_THRESHOLD
+
+# QueryStats of the request being served; the middleware sets it and the
+# threadpool running sync routes inherits a copy of the context, so every
+# statement a request issues lands in the same object
+_current = contextvars.ContextVar("request_query_stats", default=None)
+
+
+class QueryStats:
+    """Statements issued while serving one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, elapsed: float):
+        with self._lock:
+            self.count += 1
+            self.total_time += elapsed
+            self.statements[statement] += 1
+            if elapsed > self.slowest_time:
+                self.slowest_time = elapsed
+                self.slowest_statement = statement
+
+    def most_repeated(self):
+        """(statement, times) of the statement run most often, the usual N+1 signature."""
+        with self._lock:
+            return self.statements.most_common(1)[0] if self.statements else (None, 0)
+
+
+class RouteQueryStats:
+    """Per-route totals across requests, keyed by "GET /files/folder/{folder_id}"."""
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def add(self, route: str, stats: QueryStats):
+        with self._lock:
+            entry = self._routes.setdefault(route, {
+                "requests": 0,
+                "queries": 0,
+                "db_time_ms": 0.0,
+                "max_queries": 0,
+                "slowest_ms": 0.0,
+                "slowest_statement": None,
+            })
+            entry["requests"] += 1
+            entry["queries"] += stats.count
+            entry["db_time_ms"] += stats.total_time * 1000
+            entry["max_queries"] = max(entry["max_queries"], stats.count)
+            if stats.slowest_time * 1000 > entry["slowest_ms"]:
+                entry["slowest_ms"] = stats.slowest_time * 1000
+                entry["slowest_statement"] = stats.slowest_statement
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                route: {
+                    **entry,
+                    "avg_queries": entry["queries"] / entry["requests"],
+                    "avg_db_time_ms": entry["db_time_ms"] / entry["requests"],
+                }
+                for route, entry in self._routes.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+route_stats = RouteQueryStats()
+
+
+def start() -> QueryStats:
+    stats = QueryStats()
+    _current.set(stats)
+    return stats
+
+
+def current():
+    return _current.get()
+
+
+def finish(route: str, stats: QueryStats):
+    route_stats.add(route, stats)
+    if QUERY_COUNT_WARN_THRESHOLD and stats.count > QUERY_COUNT_WARN_THRESHOLD:
+        statement, times = stats.most_repeated()
+        print(
+            f"Warning: {route} issued {stats.count} SQL statements "
+            f"({stats.total_time * 1000:.1f} ms); most repeated x{times}: {_shorten(statement)}"
+        )
+
+
+def route_template(request) -> str:
+    """
+    "/files/folder/{folder_id}" for the route that served `request`: the
+    route's own template, so all requests to one route share a key whatever
+    their parameter values. FastAPI versions that keep the router's route in
+    the scope leave the include_router prefix out of its template; the prefix
+    is then the part of the URL in front of what the template matches.
+    """
+    route = request.scope.get("route")
+    if route is None:
+        return "<unmatched>"
+    path = request.scope["path"]
+    if route.path_regex.fullmatch(path):
+        return route.path
+    for i, char in enumerate(path):
+        if char == "/" and i and route.path_regex.fullmatch(path[i:]):
+            return path[:i] + route.path
+    return route.path
+
+
+def response_headers(stats: QueryStats) -> dict:
+    return {
+        "X-DB-Query-Count": str(stats.count),
+        "X-DB-Time-Ms": f"{stats.total_time * 1000:.2f}",
+        "X-DB-Slowest-Ms": f"{stats.slowest_time * 1000:.2f}",
+    }
+
+
+def _shorten(statement, limit: int = 200) -> str:
+    statement = " ".join((statement or "").split())
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+def install(engine):
+    """Time every statement on `engine` and charge it to the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start_time"].pop()
+        stats = _current.get()
+        if stats is not None:
+            stats.record(statement, time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        # after_cursor_execute doesn't run for a failed statement
+        if context.connection is not None and context.connection.info.get("query_start_time"):
+            context.connection.info["query_start_time"].pop()
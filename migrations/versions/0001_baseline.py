@@ -0,0 +1,124 @@
+"""baseline: schema as created by Base.metadata.create_all
+
+Databases that were built with create_all() before migrations existed already
+have some or all of these tables; only the missing ones are created, so
+`alembic upgrade head` adopts them without a manual stamp.
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-19 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001_baseline"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("username", sa.String(length=255), nullable=False),
+            sa.Column("role", sa.String(length=50), nullable=True),
+            sa.Column("full_name", sa.String(length=255), nullable=True),
+            sa.Column("hashed_password", sa.String(length=255), nullable=False),
+            sa.Column("is_active", sa.Boolean(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    if "files" not in existing:
+        op.create_table(
+            "files",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("filename", sa.String(length=255), nullable=False),
+            sa.Column("path", sa.String(length=255), nullable=True),
+            sa.Column("uploaded_by_id", sa.Integer(), nullable=True),
+            sa.Column("uploaded_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("is_folder", sa.Boolean(), nullable=True),
+            sa.Column("is_star", sa.Boolean(), nullable=True),
+            sa.Column("parent_id", sa.Integer(), nullable=True),
+            sa.Column("size", sa.Float(), nullable=True),
+            sa.ForeignKeyConstraint(["parent_id"], ["files.id"]),
+            sa.ForeignKeyConstraint(["uploaded_by_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_files_id", "files", ["id"])
+        op.create_index("ix_files_filename", "files", ["filename"])
+
+    if "file_logs" not in existing:
+        op.create_table(
+            "file_logs",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("file_id", sa.Integer(), nullable=True),
+            sa.Column("action", sa.String(length=255), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=True),
+            sa.Column("timestamp", sa.DateTime(timezone=True), nullable=True),
+            sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_file_logs_id", "file_logs", ["id"])
+
+    if "recycle_bin" not in existing:
+        op.create_table(
+            "recycle_bin",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("filename", sa.String(length=255), nullable=False),
+            sa.Column("deleted_by_id", sa.Integer(), nullable=True),
+            sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("is_folder", sa.Boolean(), nullable=True),
+            sa.Column("path", sa.String(length=255), nullable=True),
+            sa.ForeignKeyConstraint(["deleted_by_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_recycle_bin_id", "recycle_bin", ["id"])
+        op.create_index("ix_recycle_bin_filename", "recycle_bin", ["filename"])
+
+    if "jobs" not in existing:
+        op.create_table(
+            "jobs",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("operation", sa.String(length=50), nullable=False),
+            sa.Column("status", sa.String(length=20), nullable=False),
+            sa.Column("params", sa.Text(), nullable=True),
+            sa.Column("result", sa.Text(), nullable=True),
+            sa.Column("error", sa.Text(), nullable=True),
+            sa.Column("items_total", sa.Integer(), nullable=True),
+            sa.Column("items_done", sa.Integer(), nullable=True),
+            sa.Column("bytes_total", sa.BigInteger(), nullable=True),
+            sa.Column("bytes_done", sa.BigInteger(), nullable=True),
+            sa.Column("cancel_requested", sa.Boolean(), nullable=True),
+            sa.Column("worker", sa.String(length=255), nullable=True),
+            sa.Column("created_by_id", sa.Integer(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+            sa.ForeignKeyConstraint(["created_by_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_jobs_id", "jobs", ["id"])
+        op.create_index("ix_jobs_operation", "jobs", ["operation"])
+        op.create_index("ix_jobs_status", "jobs", ["status"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("jobs")
+    op.drop_table("recycle_bin")
+    op.drop_table("file_logs")
+    op.drop_table("files")
+    op.drop_table("users")
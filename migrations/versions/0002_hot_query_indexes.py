@@ -0,0 +1,57 @@
+"""indexes for the hot queries in app/files/routes.py
+
+- uq_files_parent_filename (parent_id, filename): folder listings filter on
+  parent_id (= ? / IS NULL) and the create/upload/rename duplicate checks on
+  (filename, parent_id). parent_id is the leading column, so this one index
+  also covers every parent_id-only lookup and no separate parent_id index is
+  needed. Being unique, it also stops two requests from creating the same
+  name twice.
+- ix_files_path: restore looks up the parent by exact path, rename and the
+  subtree queries match on a path prefix (LIKE 'uploads/a/%').
+- ix_file_logs_file_id: log rows are read and removed by file_id.
+- ix_recycle_bin_deleted_at: trash listing and purges go oldest first.
+
+Revision ID: 0002_hot_query_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-19 00:00:01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002_hot_query_indexes"
+down_revision: Union[str, Sequence[str], None] = "0001_baseline"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    duplicates = op.get_bind().execute(sa.text(
+        "SELECT parent_id, filename, COUNT(*) FROM files "
+        "GROUP BY parent_id, filename HAVING COUNT(*) > 1"
+    )).fetchall()
+    # rows at the root have parent_id NULL, which a unique index doesn't compare
+    duplicates = [row for row in duplicates if row[0] is not None]
+    if duplicates:
+        listing = ", ".join(f"parent {parent_id}: '{name}' x{count}" for parent_id, name, count in duplicates[:20])
+        raise RuntimeError(
+            f"Duplicate names in the files table, rename or remove them before upgrading: {listing}"
+        )
+
+    op.create_index("uq_files_parent_filename", "files", ["parent_id", "filename"], unique=True)
+    op.create_index("ix_files_path", "files", ["path"])
+    op.create_index("ix_file_logs_file_id", "file_logs", ["file_id"])
+    op.create_index("ix_recycle_bin_deleted_at", "recycle_bin", ["deleted_at"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_recycle_bin_deleted_at", table_name="recycle_bin")
+    op.drop_index("ix_file_logs_file_id", table_name="file_logs")
+    op.drop_index("ix_files_path", table_name="files")
+    op.drop_index("uq_files_parent_filename", table_name="files")
@@ -0,0 +1,35 @@
+"""storage_key on files and recycle_bin
+
+Where a file's contents are stored when STORAGE_LAYOUT=id
+(objects/<fan-out>/<id>). Existing rows keep NULL: their contents stay at
+their logical path until moved, renamed or relaid out with
+python -m app.storage.relayout.
+
+Revision ID: 0003_storage_key
+Revises: 0002_hot_query_indexes
+Create Date: 2026-10-19 00:00:02
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003_storage_key"
+down_revision: Union[str, Sequence[str], None] = "0002_hot_query_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("files", sa.Column("storage_key", sa.String(length=255), nullable=True))
+    op.add_column("recycle_bin", sa.Column("storage_key", sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("recycle_bin", "storage_key")
+    op.drop_column("files", "storage_key")
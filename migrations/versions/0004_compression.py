@@ -0,0 +1,36 @@
+"""codec and frame_index on files and recycle_bin
+
+Compression at rest (COMPRESSION=gzip|zstd|auto): the codec a file was
+stored with and its JSON frame index, used to decompress it and to serve
+Range requests. Existing rows keep NULL, i.e. stored raw.
+
+Revision ID: 0004_compression
+Revises: 0003_storage_key
+Create Date: 2026-10-19 00:00:03
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004_compression"
+down_revision: Union[str, Sequence[str], None] = "0003_storage_key"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in ("files", "recycle_bin"):
+        op.add_column(table, sa.Column("codec", sa.String(length=16), nullable=True))
+        op.add_column(table, sa.Column("frame_index", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ("recycle_bin", "files"):
+        op.drop_column(table, "frame_index")
+        op.drop_column(table, "codec")
@@ -0,0 +1,33 @@
+"""index storage_key on files and recycle_bin
+
+Pack storage (PACK_THRESHOLD) keeps small files in shared segments, keyed
+pack:<segment>:<offset>:<length> in storage_key. The compactor finds the
+entries of a segment by key prefix and repoints rows by exact key.
+
+Revision ID: 0005_storage_key_index
+Revises: 0004_compression
+Create Date: 2026-10-19 00:00:04
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005_storage_key_index"
+down_revision: Union[str, Sequence[str], None] = "0004_compression"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_files_storage_key", "files", ["storage_key"])
+    op.create_index("ix_recycle_bin_storage_key", "recycle_bin", ["storage_key"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_recycle_bin_storage_key", table_name="recycle_bin")
+    op.drop_index("ix_files_storage_key", table_name="files")
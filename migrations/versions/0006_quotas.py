@@ -0,0 +1,65 @@
+"""storage quotas: usage counters on users, size and owner on recycle_bin
+
+- users.quota_bytes: per-user quota (NULL = the role's from ROLE_QUOTAS)
+- users.used_bytes: bytes of the user's files, RecycleBin included; filled
+  here from files, kept up to date by the routes and reconciled periodically
+- recycle_bin.size / owner_id: deleted files keep counting for their owner
+  until they are deleted permanently
+- ix_files_uploaded_by_id, ix_recycle_bin_owner_id: the reconciliation sums
+  per owner
+
+Revision ID: 0006_quotas
+Revises: 0005_storage_key_index
+Create Date: 2026-10-19 00:00:05
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006_quotas"
+down_revision: Union[str, Sequence[str], None] = "0005_storage_key_index"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("users", sa.Column("quota_bytes", sa.BigInteger(), nullable=True))
+    op.add_column("users", sa.Column("used_bytes", sa.BigInteger(), nullable=False, server_default="0"))
+    with op.batch_alter_table("recycle_bin") as batch:
+        batch.add_column(sa.Column("size", sa.Float(), nullable=True))
+        batch.add_column(sa.Column("owner_id", sa.Integer(), nullable=True))
+        batch.create_foreign_key("fk_recycle_bin_owner_id_users", "users", ["owner_id"], ["id"])
+    op.create_index("ix_recycle_bin_owner_id", "recycle_bin", ["owner_id"])
+    op.create_index("ix_files_uploaded_by_id", "files", ["uploaded_by_id"])
+
+    # usage of existing files; RecycleBin rows from before have no size and count as 0
+    users = sa.table("users", sa.column("id", sa.Integer), sa.column("used_bytes", sa.BigInteger))
+    files = sa.table(
+        "files",
+        sa.column("uploaded_by_id", sa.Integer),
+        sa.column("size", sa.Float),
+        sa.column("is_folder", sa.Boolean),
+    )
+    usage = (
+        sa.select(sa.func.coalesce(sa.func.sum(files.c.size), 0))
+        .where(files.c.uploaded_by_id == users.c.id, files.c.is_folder == sa.false())
+        .scalar_subquery()
+    )
+    op.execute(users.update().values(used_bytes=sa.cast(usage, sa.BigInteger)))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_files_uploaded_by_id", table_name="files")
+    op.drop_index("ix_recycle_bin_owner_id", table_name="recycle_bin")
+    with op.batch_alter_table("recycle_bin") as batch:
+        batch.drop_constraint("fk_recycle_bin_owner_id_users", type_="foreignkey")
+        batch.drop_column("owner_id")
+        batch.drop_column("size")
+    op.drop_column("users", "used_bytes")
+    op.drop_column("users", "quota_bytes")
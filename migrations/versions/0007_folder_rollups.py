@@ -0,0 +1,71 @@
+"""tree_size, file_count and folder_count on files
+
+Per-folder rollups of the whole subtree (app.files.rollups), filled here
+from the existing rows; files keep 0.
+
+Revision ID: 0007_folder_rollups
+Revises: 0006_quotas
+Create Date: 2026-10-19 00:00:06
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007_folder_rollups"
+down_revision: Union[str, Sequence[str], None] = "0006_quotas"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("files", sa.Column("tree_size", sa.BigInteger(), nullable=False, server_default="0"))
+    op.add_column("files", sa.Column("file_count", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("files", sa.Column("folder_count", sa.Integer(), nullable=False, server_default="0"))
+
+    files = sa.table(
+        "files",
+        sa.column("id", sa.Integer),
+        sa.column("parent_id", sa.Integer),
+        sa.column("is_folder", sa.Boolean),
+        sa.column("size", sa.Float),
+        sa.column("tree_size", sa.BigInteger),
+        sa.column("file_count", sa.Integer),
+        sa.column("folder_count", sa.Integer),
+    )
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(files.c.id, files.c.parent_id, files.c.is_folder, files.c.size)).all()
+    parents = {row.id: row.parent_id for row in rows}
+    sums = {row.id: [0, 0, 0] for row in rows if row.is_folder}
+    for row in rows:
+        contribution = (0, 0, 1) if row.is_folder else (int(row.size or 0), 1, 0)
+        parent_id, seen = row.parent_id, set()
+        while parent_id in sums and parent_id not in seen:
+            seen.add(parent_id)
+            for i, value in enumerate(contribution):
+                sums[parent_id][i] += value
+            parent_id = parents.get(parent_id)
+
+    statement = files.update().where(files.c.id == sa.bindparam("folder_id")).values(
+        tree_size=sa.bindparam("b_tree_size"),
+        file_count=sa.bindparam("b_file_count"),
+        folder_count=sa.bindparam("b_folder_count"),
+    )
+    params = [
+        {"folder_id": folder_id, "b_tree_size": size, "b_file_count": count, "b_folder_count": folders}
+        for folder_id, (size, count, folders) in sums.items() if size or count or folders
+    ]
+    for start in range(0, len(params), 1000):
+        bind.execute(statement, params[start:start + 1000])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("files") as batch:
+        batch.drop_column("folder_count")
+        batch.drop_column("file_count")
+        batch.drop_column("tree_size")
@@ -0,0 +1,43 @@
+"""file_id, parent_id and original_path on recycle_bin
+
+Deleted files and folders keep their rows (and their subtrees') under
+uploads/RecycleBin/<recycle id>/; the RecycleBin entry points at the kept
+row and remembers where it was deleted from. Existing entries keep NULL and
+are restored the old way.
+
+Revision ID: 0008_central_trash
+Revises: 0007_folder_rollups
+Create Date: 2026-10-19 00:00:07
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008_central_trash"
+down_revision: Union[str, Sequence[str], None] = "0007_folder_rollups"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("recycle_bin") as batch:
+        batch.add_column(sa.Column("file_id", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("parent_id", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("original_path", sa.String(length=255), nullable=True))
+        batch.create_foreign_key("fk_recycle_bin_file_id_files", "files", ["file_id"], ["id"])
+    op.create_index("ix_recycle_bin_file_id", "recycle_bin", ["file_id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_recycle_bin_file_id", table_name="recycle_bin")
+    with op.batch_alter_table("recycle_bin") as batch:
+        batch.drop_constraint("fk_recycle_bin_file_id_files", type_="foreignkey")
+        batch.drop_column("original_path")
+        batch.drop_column("parent_id")
+        batch.drop_column("file_id")
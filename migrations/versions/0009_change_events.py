@@ -0,0 +1,46 @@
+"""change_events table
+
+The change feed's outbox: file routes add a row in the same transaction as
+the change, and every worker reads new rows to push them to subscribers.
+
+Revision ID: 0009_change_events
+Revises: 0008_central_trash
+Create Date: 2026-10-19 00:00:08
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009_change_events"
+down_revision: Union[str, Sequence[str], None] = "0008_central_trash"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "change_events",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("type", sa.String(length=16), nullable=False),
+        sa.Column("folder_id", sa.Integer(), nullable=True),
+        sa.Column("old_folder_id", sa.Integer(), nullable=True),
+        sa.Column("file_id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=False),
+        sa.Column("is_folder", sa.Boolean(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_change_events_folder_id", "change_events", ["folder_id"])
+    op.create_index("ix_change_events_created_at", "change_events", ["created_at"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_change_events_created_at", table_name="change_events")
+    op.drop_index("ix_change_events_folder_id", table_name="change_events")
+    op.drop_table("change_events")
@@ -0,0 +1,40 @@
+"""version on files, counters table
+
+Listing versions for ETags (app.files.versions): a counter per folder row,
+and the top level's in the "root_version" row of counters.
+
+Revision ID: 0010_listing_versions
+Revises: 0009_change_events
+Create Date: 2026-10-19 00:00:09
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0010_listing_versions"
+down_revision: Union[str, Sequence[str], None] = "0009_change_events"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("files", sa.Column("version", sa.Integer(), nullable=False, server_default="0"))
+    counters = op.create_table(
+        "counters",
+        sa.Column("name", sa.String(length=64), nullable=False),
+        sa.Column("value", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.bulk_insert(counters, [{"name": "root_version", "value": 0}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("counters")
+    with op.batch_alter_table("files") as batch:
+        batch.drop_column("version")
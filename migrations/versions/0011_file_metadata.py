@@ -0,0 +1,48 @@
+"""file_metadata table
+
+What app.files.metadata extracts from each file at ingest (MIME type,
+SHA-256, attributes), for /files/properties to read instead of storage.
+
+Revision ID: 0011_file_metadata
+Revises: 0010_listing_versions
+Create Date: 2026-10-19 00:00:10
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0011_file_metadata"
+down_revision: Union[str, Sequence[str], None] = "0010_listing_versions"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "file_metadata",
+        sa.Column("file_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("size", sa.BigInteger(), nullable=True),
+        sa.Column("mime_type", sa.String(length=127), nullable=True),
+        sa.Column("sha256", sa.String(length=64), nullable=True),
+        sa.Column("attributes", sa.Text(), nullable=True),
+        sa.Column("stored_size", sa.BigInteger(), nullable=True),
+        sa.Column("mode", sa.Integer(), nullable=True),
+        sa.Column("modified_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("extracted_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("error", sa.String(length=255), nullable=True),
+        sa.ForeignKeyConstraint(["file_id"], ["files.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("file_id"),
+    )
+    op.create_index(op.f("ix_file_metadata_sha256"), "file_metadata", ["sha256"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_file_metadata_sha256"), table_name="file_metadata")
+    op.drop_table("file_metadata")
@@ -0,0 +1,32 @@
+"""file_metadata (size, sha256) index
+
+Upload negotiation (POST /files/upload/negotiate) looks stored contents up
+by size and hash; the index on sha256 alone gives way to it.
+
+Revision ID: 0012_content_index
+Revises: 0011_file_metadata
+Create Date: 2026-10-19 00:00:11
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0012_content_index"
+down_revision: Union[str, Sequence[str], None] = "0011_file_metadata"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_file_metadata_size_sha256", "file_metadata", ["size", "sha256"], unique=False)
+    op.drop_index(op.f("ix_file_metadata_sha256"), table_name="file_metadata")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(op.f("ix_file_metadata_sha256"), "file_metadata", ["sha256"], unique=False)
+    op.drop_index("ix_file_metadata_size_sha256", table_name="file_metadata")